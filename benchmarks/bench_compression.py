@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the bytes on the wire and the CPU cost of compressing the bodies of
+responses and updates.
+
+The decompression goes through the same decoders used by the client, fed
+in chunks like the ones received from a socket.
+
+Usage: python benchmarks/bench_compression.py [documents] [repetitions]
+"""
+import os
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from twisted.internet.protocol import Protocol
+from twisted.python.failure import Failure
+from twisted.web.client import GzipDecoder, ResponseDone
+
+import bench_input
+import bench_response
+from txsolr.compress import DeflateDecoder, gzipBody
+from txsolr.input import SimpleXMLInputFactory
+
+
+CHUNK_SIZE = 16384
+
+
+class _Discard(Protocol):
+
+    def connectionLost(self, reason):
+        pass
+
+
+class _Response(object):
+
+    def deliverBody(self, protocol):
+        self.protocol = protocol
+
+
+def decode(decoderClass, data):
+    response = _Response()
+    decoderClass(response).deliverBody(_Discard())
+    for i in xrange(0, len(data), CHUNK_SIZE):
+        response.protocol.dataReceived(data[i:i + CHUNK_SIZE])
+    response.protocol.connectionLost(Failure(ResponseDone()))
+
+
+def best(function, repetitions):
+    result = None
+    for _ in range(repetitions):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if result is None or elapsed < result:
+            result = elapsed
+    return result
+
+
+def report(name, body, repetitions):
+    print name
+    print '%-10s %12s %8s %14s %14s' % ('encoding', 'bytes', 'ratio',
+                                        'compress s', 'decompress s')
+    print '%-10s %12d %8.2f %14s %14s' % ('identity', len(body), 1, '-', '-')
+    encoders = [('gzip', gzipBody, GzipDecoder),
+                ('deflate', zlib.compress, DeflateDecoder)]
+    for encoding, encode, decoderClass in encoders:
+        encoded = encode(body)
+        compressTime = best(lambda: encode(body), repetitions)
+        decompressTime = best(lambda: decode(decoderClass, encoded),
+                              repetitions)
+        print '%-10s %12d %8.2f %14.4f %14.4f' % (
+            encoding, len(encoded), float(len(body)) / len(encoded),
+            compressTime, decompressTime)
+    print
+
+
+def main(count=1000, repetitions=5):
+    response = bench_response.encodeJSON(
+        bench_response.createDocuments(count))
+    report('JSON response with %d documents (best of %d)' %
+           (count, repetitions), response, repetitions)
+
+    update = SimpleXMLInputFactory().createAdd(
+        bench_input.createDocuments(count)).body
+    report('XML update with %d documents (best of %d)' %
+           (count, repetitions), update, repetitions)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the encoding throughput and the payload size of the input factories.
+
+Usage: python benchmarks/bench_input.py [documents] [repetitions]
+"""
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from txsolr.input import SimpleXMLInputFactory, JSONInputFactory
+
+
+def createDocuments(count):
+    documents = []
+    for i in range(count):
+        doc = {'id': 'doc-%d' % i,
+               'title': u'Document number %d' % i,
+               'text': u'Lorem ipsum dolor sit amet ナルト ' * 10,
+               'popularity': i % 100,
+               'price': i * 0.5,
+               'inStock': bool(i % 2),
+               'created': datetime(2010, 1, 1, 12, 0, 0),
+               'tags': ['tag%d' % j for j in range(5)]}
+        for j in range(12):
+            doc['field%d_s' % j] = 'value %d' % j
+        documents.append(doc)
+    return documents
+
+
+def measure(factory, documents, repetitions):
+    best = None
+    for _ in range(repetitions):
+        start = time.time()
+        body = factory.createAdd(documents).body
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, len(body)
+
+
+def main(count=1000, repetitions=5):
+    documents = createDocuments(count)
+    print 'Encoding %d documents with %d fields (best of %d)' % (
+        count, len(documents[0]), repetitions)
+    print '%-24s %12s %14s %12s' % ('factory', 'seconds', 'docs/second',
+                                    'bytes')
+    for factory in (SimpleXMLInputFactory(), JSONInputFactory()):
+        elapsed, size = measure(factory, documents, repetitions)
+        print '%-24s %12.4f %14.0f %12d' % (factory.__class__.__name__,
+                                            elapsed, count / elapsed, size)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the cost of the debug logging of bodies when the debug level is
+disabled, comparing the old eager messages with the current code.
+
+Before, every update body and every chunk of every response were formatted
+into a debug message, even when the message was discarded. Python 2 has no
+tracemalloc, so the bytes allocated by those messages are counted, and the
+peak memory of a request is measured in a child process.
+
+Usage: python benchmarks/bench_logging.py [body megabytes] [requests]
+"""
+import logging
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from twisted.internet.defer import Deferred
+from twisted.python.failure import Failure
+from twisted.web.client import ResponseDone
+
+from txsolr.response import ResponseConsumer
+
+
+CHUNK_SIZE = 65536
+
+_logger = logging.getLogger('txsolr')
+
+
+class RawResponse(object):
+
+    def __init__(self, body):
+        self.rawResponse = body
+
+
+def receive(chunks):
+    consumer = ResponseConsumer(Deferred(), RawResponse)
+    for chunk in chunks:
+        consumer.dataReceived(chunk)
+    consumer.connectionLost(Failure(ResponseDone()))
+
+
+def eagerRequest(body, chunks):
+    """The logging of a request before, returning the bytes formatted."""
+    message = 'Updating:\n%s' % body
+    _logger.debug(message)
+    formatted = len(message)
+    for chunk in chunks:
+        message = 'Consumer data received:\n' + chunk
+        _logger.debug(message)
+        formatted += len(message)
+    receive(chunks)
+    return formatted
+
+
+def currentRequest(body, chunks):
+    """The logging of a request now, returning the bytes formatted."""
+    if _logger.isEnabledFor(logging.DEBUG):
+        raise AssertionError('The debug level must be disabled')
+    receive(chunks)
+    return 0
+
+
+def peakMemory(request, body, chunks):
+    """Run a request in a child process and return its peak memory growth."""
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        request(body, chunks)
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(write, str(after - before))
+        os._exit(0)
+    os.close(write)
+    result = os.read(read, 64)
+    os.close(read)
+    os.waitpid(pid, 0)
+    return int(result)
+
+
+def main(megabytes=8, requests=20):
+    logging.basicConfig(level=logging.INFO)
+    body = 'x' * (megabytes * 1024 * 1024)
+    chunks = [body[i:i + CHUNK_SIZE]
+              for i in xrange(0, len(body), CHUNK_SIZE)]
+
+    print ('Requests with %d MB bodies in %d KB chunks, debug disabled' %
+           (megabytes, CHUNK_SIZE / 1024))
+    print '%-10s %16s %18s %14s' % ('logging', 'bytes formatted',
+                                    'peak growth (KB)', 'ms/request')
+    for name, request in (('eager', eagerRequest),
+                          ('current', currentRequest)):
+        formatted = request(body, chunks)
+        peak = peakMemory(request, body, chunks)
+        start = time.time()
+        for _ in range(requests):
+            request(body, chunks)
+        elapsed = (time.time() - start) / requests
+        print '%-10s %16d %18d %14.2f' % (name, formatted, peak,
+                                          elapsed * 1000)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
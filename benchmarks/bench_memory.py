@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the memory used by the documents of a response stored as C{dict}s
+and as compact documents.
+
+Python 2 has no tracemalloc, so the memory is measured adding the sizes of
+all the objects reachable from the documents, counting shared objects once.
+
+Usage: python benchmarks/bench_memory.py [documents]
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_response import createDocuments, encodeJSON
+from txsolr.response import (JSONSolrResponse, CompactJSONSolrResponse,
+                             CompactDocument)
+
+
+def deepSize(obj, seen):
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += deepSize(key, seen) + deepSize(value, seen)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            size += deepSize(value, seen)
+    elif isinstance(obj, CompactDocument):
+        size += deepSize(obj._schema, seen) + deepSize(obj._values, seen)
+        size += deepSize(obj._schema.fields, seen)
+        size += deepSize(obj._schema.index, seen)
+    return size
+
+
+def main(count=1000):
+    body = encodeJSON(createDocuments(count))
+    print 'Memory used by %d documents with 20 fields' % count
+    print '%-24s %12s %14s' % ('response', 'bytes', 'bytes/document')
+    for responseClass in (JSONSolrResponse, CompactJSONSolrResponse):
+        docs = responseClass(body).results.docs
+        size = deepSize(docs, set())
+        print '%-24s %12d %14d' % (responseClass.__name__, size,
+                                   size / count)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Compares encoding the whole query of every search with encoding only the
+variable parameters of a prepared query.
+
+Usage: python benchmarks/bench_query.py [searches] [repetitions]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from txsolr.query import PreparedQuery, encodeParams
+
+
+TEMPLATE = {
+    'fq': [u'type:product', u'inStock:true', u'region:(eu OR us)',
+           u'price:[10 TO 500]', u'-status:discontinued'],
+    'facet': 'true',
+    'facet_field': ['category', 'brand', 'color', 'size', 'material'],
+    'facet_mincount': 1,
+    'facet_limit': 20,
+    'fl': 'id,name,price,score',
+    'defType': 'edismax',
+    'qf': u'name^4 description^2 brand category',
+    'pf': u'name^8 description^4',
+    'mm': '2<75%',
+    'sort': 'score desc, id asc',
+    'rows': 20,
+    'hl': 'true',
+    'hl_fl': 'name,description',
+    'wt': 'json',
+}
+
+
+def encodeAll(count):
+    for i in xrange(count):
+        params = dict(TEMPLATE)
+        params.update(q=u'zapatos número %d' % i, start=i % 10 * 20)
+        encodeParams(params)
+
+
+def encodePrepared(count):
+    prepared = PreparedQuery(TEMPLATE)
+    for i in xrange(count):
+        prepared.encode(q=u'zapatos número %d' % i, start=i % 10 * 20)
+
+
+def measure(function, count, repetitions):
+    best = None
+    for _ in range(repetitions):
+        start = time.time()
+        function(count)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(count=20000, repetitions=5):
+    print 'Encoding %d searches with %d parameters (best of %d)' % (
+        count, len(TEMPLATE) + 2, repetitions)
+    print '%-12s %12s %16s' % ('encoding', 'seconds', 'us/search')
+    for name, function in (('whole', encodeAll),
+                           ('prepared', encodePrepared)):
+        elapsed = measure(function, count, repetitions)
+        print '%-12s %12.4f %16.2f' % (name, elapsed,
+                                       elapsed / count * 1000000)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
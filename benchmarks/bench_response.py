@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the decoding time and the size of JSON and javabin responses, and
+the time needed to read the first documents with a lazy response.
+
+Usage: python benchmarks/bench_response.py [documents] [repetitions]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from txsolr.javabin import (JavabinEncoder, NAMED_LST, ORDERED_MAP, ARR,
+                            SOLRDOC, SOLRDOCLST, DATE, _LONG)
+from txsolr.response import (JSONSolrResponse, JavabinSolrResponse,
+                             LazyJSONSolrResponse)
+
+
+def createDocuments(count):
+    documents = []
+    for i in range(count):
+        doc = [('id', u'doc-%d' % i),
+               ('title', [u'Document number %d' % i]),
+               ('text', [u'Lorem ipsum dolor sit amet ナルト ' * 10]),
+               ('popularity', i % 100),
+               ('price', i * 0.5),
+               ('inStock', bool(i % 2)),
+               ('created', 1262347200000 + i),
+               ('tags', [u'tag%d' % j for j in range(5)])]
+        for j in range(12):
+            doc.append(('field%d_s' % j, u'value %d' % j))
+        documents.append(doc)
+    return documents
+
+
+def encodeJSON(documents):
+    docs = []
+    for doc in documents:
+        doc = dict(doc)
+        created = time.gmtime(doc['created'] // 1000)
+        doc['created'] = time.strftime('%Y-%m-%dT%H:%M:%S', created) + \
+            '.%03dZ' % (doc['created'] % 1000)
+        docs.append(doc)
+    return json.dumps({
+        'responseHeader': {'status': 0, 'QTime': 1},
+        'response': {'numFound': len(docs), 'start': 0, 'docs': docs}})
+
+
+def encodeJavabin(documents):
+    """Encode the documents the way Solr's JavaBinCodec does."""
+    encoder = JavabinEncoder()
+    encoder.writeVersion()
+    encoder.writeTag(NAMED_LST, 2)
+    encoder.writeExternString('responseHeader')
+    encoder.writeTag(ORDERED_MAP, 2)
+    encoder.writeExternString('status')
+    encoder.writeInt(0)
+    encoder.writeExternString('QTime')
+    encoder.writeInt(1)
+    encoder.writeExternString('response')
+    encoder.writeTag(SOLRDOCLST)
+    encoder.writeValue([len(documents), 0, None])
+    encoder.writeTag(ARR, len(documents))
+    for doc in documents:
+        encoder.writeTag(SOLRDOC)
+        encoder.writeTag(ORDERED_MAP, len(doc))
+        for name, value in doc:
+            encoder.writeExternString(name)
+            if name == 'created':
+                encoder.writeTag(DATE)
+                encoder._parts.append(_LONG.pack(value))
+            else:
+                encoder.writeValue(value)
+    return encoder.flush()
+
+
+def readAll(response):
+    return [doc['id'] for doc in response.results.docs]
+
+
+def readFirst(response):
+    return [doc['id'] for doc in response.results.docs[:10]]
+
+
+def measure(responseClass, body, repetitions, read=readAll):
+    best = None
+    for _ in range(repetitions):
+        start = time.time()
+        read(responseClass(body))
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(count=1000, repetitions=5):
+    documents = createDocuments(count)
+    jsonBody = encodeJSON(documents)
+    bodies = [(JSONSolrResponse, jsonBody),
+              (LazyJSONSolrResponse, jsonBody),
+              (JavabinSolrResponse, encodeJavabin(documents))]
+    print 'Decoding %d documents with %d fields (best of %d)' % (
+        count, len(documents[0]), repetitions)
+    print '%-24s %12s %14s %12s' % ('response', 'seconds', 'docs/second',
+                                    'bytes')
+    for responseClass, body in bodies:
+        elapsed = measure(responseClass, body, repetitions)
+        print '%-24s %12.4f %14.0f %12d' % (responseClass.__name__, elapsed,
+                                            count / elapsed, len(body))
+
+    print
+    print 'Reading the first 10 documents'
+    for responseClass in (JSONSolrResponse, LazyJSONSolrResponse):
+        elapsed = measure(responseClass, jsonBody, repetitions, readFirst)
+        print '%-24s %12.4f' % (responseClass.__name__, elapsed)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
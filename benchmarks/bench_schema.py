@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Compares converting the dates of the documents of a page with strptime, as
+done by applications, and with a result schema.
+
+Usage: python benchmarks/bench_schema.py [documents] [repetitions]
+"""
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from txsolr.schema import ResultSchema, DATE, INT
+
+
+FIELDS = ['created', 'modified', 'published']
+
+
+def createPage(count):
+    docs = []
+    for i in range(count):
+        doc = {'id': 'doc-%d' % i, 'popularity': i % 100,
+               'title': u'Document number %d' % i}
+        for j, name in enumerate(FIELDS):
+            doc[name] = '2010-%02d-%02dT12:%02d:00Z' % (j + 1, i % 28 + 1,
+                                                        i % 60)
+        docs.append(doc)
+    return json.dumps(docs)
+
+
+def strptimeDecode(docs):
+    for doc in docs:
+        for name in FIELDS:
+            doc[name] = datetime.strptime(doc[name], '%Y-%m-%dT%H:%M:%SZ')
+
+
+def schemaDecode(docs, schema=ResultSchema(
+        dict([(name, DATE) for name in FIELDS], popularity=INT))):
+    schema.decode(docs)
+
+
+def measure(function, page, repetitions):
+    best = None
+    for _ in range(repetitions):
+        docs = json.loads(page)
+        start = time.time()
+        function(docs)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(count=10000, repetitions=5):
+    page = createPage(count)
+    print 'Converting %d dates in %d documents (best of %d)' % (
+        count * len(FIELDS), count, repetitions)
+    print '%-12s %12s %14s' % ('decoding', 'seconds', 'docs/second')
+    for name, function in (('strptime', strptimeDecode),
+                           ('schema', schemaDecode)):
+        elapsed = measure(function, page, repetitions)
+        print '%-12s %12.4f %14.0f' % (name, elapsed, count / elapsed)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -21,14 +21,17 @@ Solr Bindings for Python and Twisted
 
 import logging
 
-from client import SolrClient
+from client import SolrClient, LoadBalancingSolrClient
+from cloud import CloudSolrClient
 from input import escapeTerm
 from errors import (
-    InputError, HTTPWrongStatus, SolrResponseError, HTTPRequestError)
+    InputError, HTTPWrongStatus, SolrResponseError, HTTPRequestError,
+    RequestQueueFull, RequestTimeout, CircuitOpen)
 
 # Used to ignore pyflakes errors.
-_ = (SolrClient, escapeTerm, InputError, HTTPWrongStatus,
-     SolrResponseError, HTTPRequestError)
+_ = (SolrClient, LoadBalancingSolrClient, CloudSolrClient, escapeTerm,
+     InputError, HTTPWrongStatus, SolrResponseError, HTTPRequestError,
+     RequestQueueFull, RequestTimeout, CircuitOpen)
 
 __author__ = 'Manuel Cerón'
 __license__ = 'http://www.apache.org/licenses/LICENSE-2.0'
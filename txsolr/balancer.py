@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Load balancing of requests across several Solr nodes.
+"""
+import logging
+
+from twisted.internet.defer import maybeDeferred
+
+
+__all__ = ['Node', 'LoadBalancer', 'ROUND_ROBIN', 'LEAST_OUTSTANDING',
+           'EWMA']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+ROUND_ROBIN = 'round-robin'
+LEAST_OUTSTANDING = 'least-outstanding'
+EWMA = 'ewma'
+
+
+class Node(object):
+    """
+    A Solr node and its statistics.
+
+    @ivar url: The base URL of the node.
+    @ivar outstanding: The number of requests in flight.
+    @ivar latency: The exponentially weighted moving average of the latency
+        of the requests, in seconds.
+    @ivar failures: The number of consecutive failed requests.
+    @ivar healthy: C{False} if the node is out of rotation.
+    """
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.outstanding = 0
+        self.latency = 0.0
+        self.failures = 0
+        self.healthy = True
+
+    def __repr__(self):
+        return 'Node(%r)' % self.url
+
+
+class LoadBalancer(object):
+    """
+    Chooses the node for each request.
+
+    Nodes that fail C{maxFailures} consecutive requests are taken out of
+    rotation. Every C{probeInterval} seconds they are probed, and they are
+    put back when a probe succeeds. If all the nodes are out of rotation,
+    all of them are used, as there is nothing better to do.
+
+    @ivar nodes: The L{Node}s used for reads.
+    @ivar leader: The L{Node} used for writes, or C{None} if writes are
+        balanced like reads.
+
+    @param urls: The base URLs of the nodes.
+    @param strategy: How a node is chosen. L{ROUND_ROBIN} takes the nodes in
+        turns, L{LEAST_OUTSTANDING} takes the node with less requests in
+        flight and L{EWMA} takes the node with the lowest average latency
+        weighted by the requests in flight.
+    @param leader: The base URL of the node used for writes. If it's also in
+        C{urls} it's used for reads too.
+    @param maxFailures: The number of consecutive failures that take a node
+        out of rotation.
+    @param probeInterval: The number of seconds between probes of a node out
+        of rotation.
+    @param decay: The weight of the last latency in the moving average.
+    @param probe: A callable that receives a L{Node} and returns a
+        L{Deferred} that fires if the node is alive.
+    @param clock: The L{IReactorTime} provider used to measure latencies and
+        schedule probes. By default the global reactor is used.
+    """
+
+    def __init__(self, urls, strategy=ROUND_ROBIN, leader=None,
+                 maxFailures=1, probeInterval=5, decay=0.3, probe=None,
+                 clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        if strategy not in (ROUND_ROBIN, LEAST_OUTSTANDING, EWMA):
+            raise ValueError('Unknown strategy %r' % strategy)
+        if not urls:
+            raise ValueError('At least one URL is needed')
+
+        self.nodes = [Node(url) for url in urls]
+        self.leader = None
+        if leader is not None:
+            leader = leader.rstrip('/')
+            for node in self.nodes:
+                if node.url == leader:
+                    self.leader = node
+            if self.leader is None:
+                self.leader = Node(leader)
+
+        self.strategy = strategy
+        self.maxFailures = maxFailures
+        self.probeInterval = probeInterval
+        self.decay = decay
+        self.probe = probe
+
+        self._clock = clock
+        self._next = 0
+        self._probes = {}
+        self._stopped = False
+
+    def select(self, write=False):
+        """
+        Choose the node for a request.
+
+        @param write: C{True} if the request changes the index.
+        @return: A L{Node}.
+        """
+        if write and self.leader is not None:
+            return self.leader
+
+        nodes = [node for node in self.nodes if node.healthy] or self.nodes
+        start = self._next % len(nodes)
+        self._next += 1
+        if self.strategy == ROUND_ROBIN:
+            return nodes[start]
+
+        # Start from a different node every time to break ties in turns.
+        nodes = nodes[start:] + nodes[:start]
+        if self.strategy == LEAST_OUTSTANDING:
+            return min(nodes, key=lambda node: node.outstanding)
+        return min(nodes,
+                   key=lambda node: node.latency * (node.outstanding + 1))
+
+    def started(self, node):
+        """
+        Tell that a request to C{node} started.
+
+        @return: The start time, to be given to L{finished}.
+        """
+        node.outstanding += 1
+        return self._clock.seconds()
+
+    def finished(self, node, startTime, failed=False):
+        """Tell that a request to C{node} finished."""
+        node.outstanding -= 1
+        latency = self._clock.seconds() - startTime
+        node.latency += self.decay * (latency - node.latency)
+        if not failed:
+            node.failures = 0
+            return
+
+        node.failures += 1
+        if node.healthy and node.failures >= self.maxFailures:
+            _logger.warning('Taking %s out of rotation after %d failures' %
+                            (node.url, node.failures))
+            node.healthy = False
+            self._scheduleProbe(node)
+
+    def _scheduleProbe(self, node):
+        if self._stopped or self.probe is None:
+            return
+        if node not in self._probes:
+            self._probes[node] = self._clock.callLater(self.probeInterval,
+                                                       self._probe, node)
+
+    def _probe(self, node):
+        del self._probes[node]
+
+        def alive(_):
+            _logger.info('Putting %s back in rotation' % node.url)
+            node.healthy = True
+            node.failures = 0
+
+        def dead(failure):
+            _logger.debug('Probe of %s failed: %s' % (node.url,
+                                                      failure.value))
+            self._scheduleProbe(node)
+
+        maybeDeferred(self.probe, node).addCallbacks(alive, dead)
+
+    def stop(self):
+        """Cancel the scheduled probes."""
+        self._stopped = True
+        probes, self._probes = self._probes, {}
+        for call in probes.itervalues():
+            call.cancel()
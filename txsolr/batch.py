@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Batching of update requests.
+
+Sending every document in its own request is expensive, both for the client
+and for Solr. The L{BatchingIndexer} gathers documents and sends them in a
+single request when the batch is big enough or old enough.
+"""
+import logging
+
+from twisted.internet.defer import Deferred, maybeDeferred, succeed
+
+
+__all__ = ['BatchingIndexer']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+# Approximate overhead of the markup of each field value in the payload.
+_FIELD_OVERHEAD = 24
+
+
+def _documentSize(document):
+    """Estimate the size of the encoded payload of a document."""
+    size = 0
+    for key, value in document.iteritems():
+        if isinstance(value, (tuple, list, set)):
+            values = value
+        else:
+            values = [value]
+        for v in values:
+            if isinstance(v, basestring):
+                size += len(v)
+            else:
+                size += 8
+            size += len(key) + _FIELD_OVERHEAD
+    return size
+
+
+class _Batch(object):
+    """
+    A group of pending documents or IDs of the same kind.
+
+    @ivar kind: Either C{'add'} or C{'delete'}.
+    @ivar items: The documents or IDs of the batch.
+    @ivar deferreds: The L{Deferred}s of the callers, in the same order as the
+        items.
+    @ivar size: The approximate size of the payload.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.items = []
+        self.deferreds = []
+        self.size = 0
+
+
+class BatchingIndexer(object):
+    """
+    Gathers added and deleted documents and sends them to Solr in batches.
+
+    A batch is sent when it reaches C{maxDocuments} documents, C{maxBytes}
+    bytes of (approximate) payload, or when its first document has been
+    waiting for C{maxDelay} milliseconds, whichever comes first.
+
+    Adds and deletes are sent in different batches, in the same order they
+    were requested.
+
+    @param client: The L{SolrClient} used to send the batches.
+    @param maxDocuments: The maximum number of documents of a batch.
+    @param maxBytes: The maximum approximate size of the payload of a batch.
+    @param maxDelay: The maximum time, in milliseconds, a document waits
+        before its batch is sent.
+    @param overwrite: The C{overwrite} option for the added documents.
+    @param commitWithin: The C{commitWithin} option for the added documents.
+    @param clock: The L{IReactorTime} provider used to schedule the flushes.
+        By default the global reactor is used.
+    """
+
+    def __init__(self, client, maxDocuments=100, maxBytes=1024 * 1024,
+                 maxDelay=1000, overwrite=None, commitWithin=None,
+                 clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.client = client
+        self.maxDocuments = maxDocuments
+        self.maxBytes = maxBytes
+        self.maxDelay = maxDelay
+        self.overwrite = overwrite
+        self.commitWithin = commitWithin
+
+        self._clock = clock
+        self._batch = None
+        self._timer = None
+
+    def add(self, document):
+        """Add a document to the current batch.
+
+        @param document: A C{dict} representing the document.
+        @return: A L{Deferred} that fires with the L{SolrResponse} of the
+            batch containing the document.
+        """
+        return self._enqueue('add', document, _documentSize(document))
+
+    def delete(self, id):
+        """Delete a document in the current batch.
+
+        @param id: The ID of the document.
+        @return: A L{Deferred} that fires with the L{SolrResponse} of the
+            batch containing the deletion.
+        """
+        return self._enqueue('delete', id, len(unicode(id)) + _FIELD_OVERHEAD)
+
+    def _enqueue(self, kind, item, size):
+        if self._batch is not None and self._batch.kind != kind:
+            self.flush()
+
+        if self._batch is None:
+            self._batch = _Batch(kind)
+            self._timer = self._clock.callLater(self.maxDelay / 1000.0,
+                                                self._timeout)
+
+        d = Deferred()
+        batch = self._batch
+        batch.items.append(item)
+        batch.deferreds.append(d)
+        batch.size += size
+
+        if (len(batch.items) >= self.maxDocuments or
+            batch.size >= self.maxBytes):
+            self.flush()
+        return d
+
+    def _timeout(self):
+        self._timer = None
+        self.flush()
+
+    def flush(self):
+        """Send the current batch now.
+
+        @return: A L{Deferred} that fires when the batch is acknowledged by
+            Solr. Errors are only reported to the L{Deferred}s of the
+            documents in the batch.
+        """
+        batch = self._batch
+        if batch is None:
+            return succeed(None)
+
+        self._batch = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        _logger.debug('Sending batch of %d %s (~%d bytes)' %
+                      (len(batch.items), batch.kind, batch.size))
+
+        if batch.kind == 'add':
+            d = maybeDeferred(self.client.add, batch.items,
+                              overwrite=self.overwrite,
+                              commitWithin=self.commitWithin)
+        else:
+            d = maybeDeferred(self.client.delete, batch.items)
+
+        def done(result):
+            for deferred in batch.deferreds:
+                deferred.callback(result)
+
+        def failed(failure):
+            for deferred in batch.deferreds:
+                deferred.errback(failure)
+
+        return d.addCallbacks(done, failed)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Circuit breakers for Solr endpoints.
+
+An overloaded node answers slowly or with errors, and sending it more
+requests only makes things worse. A breaker stops sending requests to an
+endpoint that keeps failing, failing them immediately, and lets a few
+requests through from time to time to know when it recovers.
+"""
+import logging
+from collections import deque
+
+from twisted.internet.defer import CancelledError, fail, maybeDeferred
+from twisted.python.failure import Failure
+
+from txsolr.errors import CircuitOpen, HTTPRequestError, HTTPWrongStatus
+
+
+__all__ = ['CircuitBreaker', 'CLOSED', 'OPEN', 'HALF_OPEN']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+# States of a breaker.
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class _Endpoint(object):
+    """
+    The state of the breaker of an endpoint.
+
+    @ivar state: One of L{CLOSED}, L{OPEN} or L{HALF_OPEN}.
+    @ivar failures: The number of consecutive failures.
+    @ivar outcomes: The recent outcomes, C{True} for failures.
+    @ivar openedAt: The time when the breaker was opened.
+    @ivar trials: The number of trial requests in flight while half open.
+    """
+
+    def __init__(self, window):
+        self.state = CLOSED
+        self.failures = 0
+        self.outcomes = deque(maxlen=window)
+        self.openedAt = None
+        self.trials = 0
+
+
+class CircuitBreaker(object):
+    """
+    Keeps a circuit breaker for each Solr endpoint.
+
+    While the breaker of an endpoint is closed, requests are sent normally.
+    It opens after C{maxFailures} consecutive failures or, if
+    C{failureRate} is given, when that fraction of the last C{window}
+    requests failed (once at least C{minRequests} are known). Then requests
+    fail immediately with L{CircuitOpen}.
+
+    After C{resetTimeout} seconds the breaker is half open: up to
+    C{trialRequests} requests are sent. If one succeeds the breaker closes,
+    and if one fails it opens again.
+
+    Connection errors, timeouts and 5xx status codes are failures. Other
+    status codes mean the endpoint is working, and cancelled requests are
+    not counted.
+
+    @param maxFailures: The number of consecutive failures that open a
+        breaker.
+    @param failureRate: The fraction of failed requests, between 0 and 1,
+        that opens a breaker, or C{None} to ignore the rate.
+    @param window: The number of recent requests used for the rate.
+    @param minRequests: The number of requests needed to use the rate.
+    @param resetTimeout: The seconds a breaker stays open.
+    @param trialRequests: The number of requests sent while half open.
+    @param clock: The L{IReactorTime} provider used to know the time. By
+        default the global reactor is used.
+    """
+
+    def __init__(self, maxFailures=5, failureRate=None, window=50,
+                 minRequests=20, resetTimeout=30, trialRequests=1,
+                 clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.maxFailures = maxFailures
+        self.failureRate = failureRate
+        self.window = window
+        self.minRequests = minRequests
+        self.resetTimeout = resetTimeout
+        self.trialRequests = trialRequests
+        self._clock = clock
+        self._endpoints = {}
+
+    def _endpoint(self, url):
+        endpoint = self._endpoints.get(url)
+        if endpoint is None:
+            endpoint = self._endpoints[url] = _Endpoint(self.window)
+        return endpoint
+
+    def state(self, url):
+        """@return: The state of the breaker of an endpoint."""
+        endpoint = self._endpoint(url)
+        if (endpoint.state == OPEN and
+            self._clock.seconds() - endpoint.openedAt >= self.resetTimeout):
+            endpoint.state = HALF_OPEN
+            endpoint.trials = 0
+        return endpoint.state
+
+    def run(self, url, request):
+        """
+        Call C{request} unless the breaker of C{url} is open.
+
+        @param url: The URL of the endpoint.
+        @param request: A callable returning a L{Deferred}.
+        @return: The L{Deferred} of the request, or one that fails with
+            L{CircuitOpen}.
+        """
+        state = self.state(url)
+        endpoint = self._endpoint(url)
+        if state == OPEN or (state == HALF_OPEN and
+                             endpoint.trials >= self.trialRequests):
+            return fail(CircuitOpen(url))
+
+        trial = state == HALF_OPEN
+        if trial:
+            endpoint.trials += 1
+        d = maybeDeferred(request)
+        return d.addBoth(self._done, endpoint, url, trial)
+
+    def _done(self, result, endpoint, url, trial):
+        if trial:
+            endpoint.trials -= 1
+        if not isinstance(result, Failure):
+            self._record(endpoint, url, False)
+        elif result.check(HTTPRequestError) or (
+                result.check(HTTPWrongStatus) and
+                result.value.args[0] >= 500):
+            self._record(endpoint, url, True)
+        elif not result.check(CancelledError):
+            self._record(endpoint, url, False)
+        return result
+
+    def _record(self, endpoint, url, failed):
+        if endpoint.state == OPEN:
+            # A request started before the breaker opened.
+            return
+        endpoint.outcomes.append(failed)
+        if not failed:
+            endpoint.failures = 0
+            if endpoint.state == HALF_OPEN:
+                _logger.info('Circuit closed for %s' % url)
+                endpoint.state = CLOSED
+                endpoint.outcomes.clear()
+            return
+
+        endpoint.failures += 1
+        if endpoint.state == HALF_OPEN or self._tripped(endpoint):
+            _logger.warning('Circuit open for %s' % url)
+            endpoint.state = OPEN
+            endpoint.openedAt = self._clock.seconds()
+
+    def _tripped(self, endpoint):
+        if endpoint.failures >= self.maxFailures:
+            return True
+        outcomes = endpoint.outcomes
+        if self.failureRate is None or len(outcomes) < self.minRequests:
+            return False
+        return sum(outcomes) >= self.failureRate * len(outcomes)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Client side cache of query results.
+"""
+import logging
+from collections import OrderedDict
+
+
+__all__ = ['QueryCache']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+class QueryCache(object):
+    """
+    A LRU cache of raw responses with a time to live for each entry.
+
+    The cache is bounded both in number of entries and in the total size of
+    the cached bodies. When a bound is exceeded, the least recently used
+    entries are evicted.
+
+    Every time the cache is invalidated its C{generation} changes. Values
+    obtained for an older generation are not stored, so a query that was
+    already running when the index changed doesn't fill the cache with stale
+    results.
+
+    @ivar hits: The number of lookups that found a valid entry.
+    @ivar misses: The number of lookups that didn't.
+    @ivar evictions: The number of entries removed to respect the bounds.
+    @ivar expirations: The number of entries found expired.
+    @ivar generation: A number that changes every time the cache is
+        invalidated.
+
+    @param maxEntries: The maximum number of entries.
+    @param maxBytes: The maximum total size of the cached bodies.
+    @param ttl: The default number of seconds an entry is valid.
+    @param clock: The L{IReactorTime} provider used to get the current time.
+        By default the global reactor is used.
+    """
+
+    def __init__(self, maxEntries=1000, maxBytes=10 * 1024 * 1024, ttl=60,
+                 clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.generation = 0
+
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        """The total size of the cached bodies."""
+        return self._bytes
+
+    def get(self, key):
+        """
+        Get a cached value, marking it as recently used.
+
+        @return: The cached value, or C{None} if it's missing or expired.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            expires, value, size = entry
+            if expires > self._clock.seconds():
+                self._entries[key] = entry
+                self.hits += 1
+                return value
+            self._bytes -= size
+            self.expirations += 1
+        self.misses += 1
+        return None
+
+    def put(self, key, value, size, ttl=None, generation=None):
+        """
+        Store a value.
+
+        @param size: The size of the value, in bytes.
+        @param ttl: The number of seconds the entry is valid. By default the
+            C{ttl} of the cache is used.
+        @param generation: The C{generation} of the cache when the value was
+            requested. If the cache has been invalidated since, the value is
+            not stored.
+        """
+        if generation is not None and generation != self.generation:
+            return
+        if size > self.maxBytes or self.maxEntries < 1:
+            return
+        if ttl is None:
+            ttl = self.ttl
+
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[2]
+        self._entries[key] = (self._clock.seconds() + ttl, value, size)
+        self._bytes += size
+
+        while (len(self._entries) > self.maxEntries or
+               self._bytes > self.maxBytes):
+            _, (_, _, evictedSize) = self._entries.popitem(last=False)
+            self._bytes -= evictedSize
+            self.evictions += 1
+
+    def invalidate(self):
+        """Remove all the entries."""
+        if self._entries:
+            _logger.debug('Invalidating %d cached results' %
+                          len(self._entries))
+        self._entries.clear()
+        self._bytes = 0
+        self.generation += 1
+
+    def stats(self):
+        """
+        @return: A C{dict} with the counters of the cache, its number of
+            entries, its size and its hit rate.
+        """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hitRate': float(self.hits) / lookups if lookups else 0.0}
@@ -23,27 +23,92 @@ txSolr can be used to add, update, delete and query documents in a Solr
 instance. All operations return Twisted's deferreds for asynchronous
 programming.
 """
+import copy
 import logging
 import urllib
 
 from twisted.internet import reactor
-from twisted.internet.defer import Deferred
-from twisted.web.client import Agent
+from twisted.internet.defer import (Deferred, DeferredList,
+                                    DeferredSemaphore, fail, gatherResults,
+                                    succeed)
+from twisted.internet.error import TimeoutError
+from twisted.python.failure import Failure
+from twisted.web.client import Agent, ContentDecoderAgent
 from twisted.web.http_headers import Headers
 
-from txsolr.input import SimpleXMLInputFactory, StringProducer
-from txsolr.errors import HTTPWrongStatus, HTTPRequestError
-from txsolr.response import (ResponseConsumer, DiscardingResponseConsumer,
-                             JSONSolrResponse)
+from txsolr.balancer import LoadBalancer, ROUND_ROBIN
+from txsolr.coalesce import RequestCoalescer
+from txsolr.codec import Codec, getCodec, getResponseClass
+from txsolr.compress import DECODERS, gzipBody
+from txsolr.input import FormProducer, StringProducer
+from txsolr.limiter import QUERY, UPDATE, ADMIN
+from txsolr.logs import clip
+from txsolr.metrics import RequestRecord
+from txsolr.paging import SearchIterator
+from txsolr.pool import SolrConnectionPool
+from txsolr.query import (PreparedQuery, VARIABLES, encodeParams,
+                          mergeSearches)
+from txsolr.schema import schemaFromSolr
+from txsolr.errors import HTTPWrongStatus, HTTPRequestError, RequestTimeout
+from txsolr.response import (ResponseConsumer, StreamingResponseConsumer,
+                             DiscardingResponseConsumer, JSONSolrResponse)
 
 
-__all__ = ['SolrClient']
+__all__ = ['SolrClient', 'LoadBalancingSolrClient']
 
 
 _logger = logging.getLogger('txsolr')
 
 
-# TODO: decouple from JSON
+# The maximum length of the URLs and queries in the debug messages.
+_URL_LOG_LIMIT = 1024
+
+# Status codes of servers rejecting a request line or headers too long.
+_URI_TOO_LONG = (414, 431)
+
+
+class _Lifecycle(object):
+    """
+    The state shared by a client and the clients derived from it, like the
+    ones of L{SolrClient.withTimeouts}: if they are closed and the requests
+    in progress.
+
+    @ivar closed: C{True} once the client is closed.
+    @ivar pending: The C{set} of L{Deferred}s of the requests in progress.
+    """
+
+    def __init__(self):
+        self.closed = False
+        self.pending = set()
+        self._waiters = []
+
+    def track(self, deferred):
+        """Keep a request in progress until its L{Deferred} fires."""
+        self.pending.add(deferred)
+        deferred.addBoth(self._done, deferred)
+
+    def _done(self, result, deferred):
+        self.pending.discard(deferred)
+        if not self.pending:
+            waiters, self._waiters = self._waiters, []
+            for waiter in waiters:
+                waiter.callback(None)
+        return result
+
+    def close(self):
+        """
+        Mark the client as closed.
+
+        @return: A L{Deferred} that fires when no request is in progress.
+        """
+        self.closed = True
+        if not self.pending:
+            return succeed(None)
+        d = Deferred()
+        self._waiters.append(d)
+        return d
+
+
 class SolrClient(object):
     """Solr client class used to perform requests to a Solr instance.
 
@@ -53,15 +118,199 @@ class SolrClient(object):
     @param url: The URL of the Solr server.
     @param inputFactory: The input body generator. For advanced uses this
         argument is used to create custom body generators for the requests
-        using Twisted's IProducer.
+        using Twisted's IProducer. It overrides the input factory of the
+        codec.
+    @param codec: The name of a registered codec (C{'xml'}, C{'json'},
+        C{'javabin'} or C{'csv'}) or a L{Codec}. It selects how the requests
+        are encoded and the response writer asked to Solr. See
+        L{txsolr.codec}.
+    @param responseClass: The L{SolrResponse} subclass used to decode the
+        responses. It overrides the response class of the codec, for
+        instance to use L{txsolr.response.LazyJSONSolrResponse}.
+    @param cache: Optionally, a L{txsolr.cache.QueryCache} for the results of
+        L{search}. It's invalidated when the client commits, rolls back or
+        optimizes.
+    @param coalesce: If C{True}, identical concurrent searches and pings
+        share a single request. Every caller gets its own response.
+    @param limiter: Optionally, a L{txsolr.limiter.RequestLimiter} that
+        bounds the number of concurrent requests. Queries are given priority
+        over updates, and updates over optimizations.
+    @param hedger: Optionally, a L{txsolr.hedge.RequestHedger} that sends a
+        duplicate of the searches that take longer than usual. It's most
+        useful with several nodes, like in L{LoadBalancingSolrClient}, where
+        the duplicate goes to another node.
+    @param retryPolicy: Optionally, a L{txsolr.retry.RetryPolicy} used to
+        retry the failed requests. Requests with bodies that can't be sent
+        again, without a true C{replayable} attribute like the streamed
+        ones, are never retried.
+    @param circuitBreaker: Optionally, a L{txsolr.breaker.CircuitBreaker}
+        that stops sending requests to the endpoints that keep failing.
+        Those requests fail with L{txsolr.errors.CircuitOpen}.
+    @param connectTimeout: The seconds to wait for a connection.
+    @param firstByteTimeout: The seconds to wait for the headers of the
+        response.
+    @param timeout: The seconds to wait for the whole response, including
+        the connection. Requests that take too long fail with
+        L{RequestTimeout}. C{None} means no limit.
+    @param observer: Optionally, an object providing
+        L{txsolr.metrics.IRequestObserver}, that receives the timing of every
+        request sent, like L{txsolr.metrics.RequestMetrics}.
+    @param bodyDump: Optionally, a L{txsolr.logs.BodyDump} that dumps the
+        bodies of a sample of the requests and responses to the debug log.
+        Otherwise bodies are never logged.
+    @param compression: If C{True}, Solr is asked to compress the responses
+        with gzip or deflate, and they are decompressed while they arrive.
+        It's worth it for large responses on slow links.
+    @param compressUpdates: The size, in bytes, from which the bodies of
+        updates are compressed with gzip, or C{None} to never compress them.
+        Solr, or the server in front of it, must accept gzip bodies.
+    @param persistent: If C{True}, the requests reuse HTTP connections kept
+        alive in a pool shared by the client.
+    @param maxConnectionsPerHost: The maximum number of idle persistent
+        connections kept open for each host.
+    @param idleTimeout: Number of seconds an idle persistent connection stays
+        open.
+    @param maxRequestsPerConnection: The number of requests a persistent
+        connection serves before being closed. C{None} means no limit.
+    @param maxGetLength: The length, in bytes, of the encoded searches from
+        which they are sent with POST instead of GET. It's lowered when Solr
+        rejects a GET as too long, and the search is sent again with POST.
+    @param resultSchema: Optionally, a L{txsolr.schema.ResultSchema} that
+        converts the values of the documents found to their types, and sets
+        the C{fl} parameter of the searches. See L{loadResultSchema}.
     """
 
-    def __init__(self, url, inputFactory=None):
+    def __init__(self, url, inputFactory=None, codec='xml',
+                 responseClass=None, persistent=True, maxConnectionsPerHost=2,
+                 idleTimeout=240, maxRequestsPerConnection=None, cache=None,
+                 coalesce=False, limiter=None, hedger=None, retryPolicy=None,
+                 circuitBreaker=None, connectTimeout=None,
+                 firstByteTimeout=None, timeout=None, compression=False,
+                 compressUpdates=None, observer=None, bodyDump=None,
+                 maxGetLength=1024, resultSchema=None):
         self.url = url.rstrip('/')
+        if not isinstance(codec, Codec):
+            codec = getCodec(codec)
+        self.codec = codec
+        if responseClass is None:
+            responseClass = codec.responseClass
+        self.responseClass = responseClass
         if inputFactory is None:
-            self.inputFactory = SimpleXMLInputFactory()
+            inputFactory = codec.inputFactory()
+        self.inputFactory = inputFactory
+        self.cache = cache
+        self.limiter = limiter
+        self.hedger = hedger
+        self.retryPolicy = retryPolicy
+        self.circuitBreaker = circuitBreaker
+        self.connectTimeout = connectTimeout
+        self.firstByteTimeout = firstByteTimeout
+        self.timeout = timeout
+        self.compression = compression
+        self.compressUpdates = compressUpdates
+        self.observer = observer
+        self.bodyDump = bodyDump
+        self.maxGetLength = maxGetLength
+        self.resultSchema = resultSchema
+        if coalesce:
+            self.coalescer = RequestCoalescer()
+        else:
+            self.coalescer = None
+
+        self.pool = SolrConnectionPool(
+            reactor, persistent=persistent,
+            maxConnectionsPerHost=maxConnectionsPerHost,
+            idleTimeout=idleTimeout,
+            maxRequestsPerConnection=maxRequestsPerConnection)
+        self._agent = self._createAgent(connectTimeout)
+        self._lifecycle = _Lifecycle()
+
+    def _createAgent(self, connectTimeout):
+        agent = Agent(reactor, connectTimeout=connectTimeout, pool=self.pool)
+        if self.compression:
+            agent = ContentDecoderAgent(agent, DECODERS)
+        return agent
+
+    def withTimeouts(self, connect=None, firstByte=None, total=None):
+        """Get a client with other timeouts for some requests.
 
-    def _request(self, method, path, headers, bodyProducer):
+        The returned client shares the connections, pending requests and the
+        rest of the options of this one. Only this client must be closed, and
+        closing it closes the returned client too.
+
+        @param connect: The connection timeout, or C{None} to keep the one of
+            this client.
+        @param firstByte: The first byte timeout, or C{None} to keep the one
+            of this client.
+        @param total: The total timeout, or C{None} to keep the one of this
+            client.
+        @return: A L{SolrClient}.
+        """
+        client = copy.copy(self)
+        if connect is not None:
+            client.connectTimeout = connect
+            client._agent = client._createAgent(connect)
+        if firstByte is not None:
+            client.firstByteTimeout = firstByte
+        if total is not None:
+            client.timeout = total
+        return client
+
+    def withResultSchema(self, resultSchema):
+        """Get a client with another result schema for some searches.
+
+        The returned client shares the connections, pending requests and the
+        rest of the options of this one. Only this client must be closed, and
+        closing it closes the returned client too.
+
+        @param resultSchema: A L{txsolr.schema.ResultSchema}, or C{None} to
+            get the documents as decoded.
+        @return: A L{SolrClient}.
+        """
+        client = copy.copy(self)
+        client.resultSchema = resultSchema
+        return client
+
+    def loadResultSchema(self, fields=None):
+        """Loads the types of the fields from the schema API of Solr.
+
+        @param fields: Optionally, the names of the fields requested by the
+            searches using the schema.
+        @return: A L{Deferred} that fires with a
+            L{txsolr.schema.ResultSchema}.
+        """
+        def get(path):
+            return self._request('GET', path + '?wt=json', {}, None,
+                                 responseClass=JSONSolrResponse,
+                                 idempotent=True)
+
+        def loaded((fieldsResponse, typesResponse, dynamicResponse)):
+            return schemaFromSolr(fieldsResponse.fields,
+                                  typesResponse.fieldTypes,
+                                  dynamicResponse.dynamicFields, fields)
+
+        d = gatherResults([get('/schema/fields'), get('/schema/fieldtypes'),
+                           get('/schema/dynamicfields')], consumeErrors=True)
+        d.addCallbacks(loaded, lambda failure: failure.value.subFailure)
+        return d
+
+    def close(self):
+        """Close the client and all its connections.
+
+        The requests already in progress are allowed to finish before the
+        connections are closed. New requests will fail with
+        L{HTTPRequestError}.
+
+        @return: A L{Deferred} that fires when the pending requests are done
+            and the idle connections are closed.
+        """
+        d = self._lifecycle.close()
+        d.addCallback(lambda _: self.pool.close())
+        return d
+
+    def _request(self, method, path, headers, bodyProducer,
+                 consumerFactory=None, responseClass=None, priority=QUERY,
+                 baseUrl=None, idempotent=False):
         """Performs a request to a Solr client
 
         The request examines the response to look for wrong header status.
@@ -74,89 +323,391 @@ class SolrClient(object):
         @param headers: The headers of the request.
         @bodyProducer: The L{IBodyProducer} that generates the body of the
             request.
+        @param consumerFactory: Optionally, a callable that receives the
+            result L{Deferred} and returns the L{Protocol} used to consume
+            the body. By default a L{ResponseConsumer} is used.
+        @param responseClass: The L{SolrResponse} subclass used by the
+            default consumer. By default the one of the codec is used.
+        @param priority: The priority of the request for the limiter, one of
+            L{QUERY}, L{UPDATE} or L{ADMIN}.
+        @param baseUrl: Optionally, the URL of the Solr server or core the
+            request is sent to, instead of the usual one.
+        @param idempotent: C{True} if sending the request twice has the same
+            effect as sending it once. See L{txsolr.retry.RetryPolicy}.
         @return: A L{Deferred} that fires with a L{SolrResponse} object.
         """
-        result = Deferred()
+        if self._lifecycle.closed:
+            return fail(HTTPRequestError('The client is closed'))
+        if responseClass is None:
+            responseClass = self.responseClass
+
+        def send():
+            if baseUrl is not None:
+                return self._sendTo(baseUrl, method, path, headers,
+                                    bodyProducer, consumerFactory,
+                                    responseClass)
+            return self._send(method, path, headers, bodyProducer,
+                              consumerFactory, responseClass)
 
-        url = self.url + path
+        def attempt():
+            if self.limiter is not None:
+                return self.limiter.run(priority, send)
+            return send()
+
+        replayable = (bodyProducer is None or
+                      getattr(bodyProducer, 'replayable', False))
+        if self.retryPolicy is not None and replayable:
+            result = self.retryPolicy.run(attempt, idempotent)
+        else:
+            result = attempt()
+        self._lifecycle.track(result)
+        return result
+
+    def _send(self, method, path, headers, bodyProducer, consumerFactory,
+              responseClass):
+        """Sends a request to Solr. See L{_request}."""
+        return self._sendTo(self.url, method, path, headers, bodyProducer,
+                            consumerFactory, responseClass)
+
+    def _sendTo(self, baseUrl, method, path, headers, bodyProducer,
+                consumerFactory, responseClass):
+        """Sends a request to the Solr node at C{baseUrl}, unless its
+        circuit breaker is open."""
+        if self.circuitBreaker is not None:
+            return self.circuitBreaker.run(
+                baseUrl,
+                lambda: self._transmit(baseUrl, method, path, headers,
+                                       bodyProducer, consumerFactory,
+                                       responseClass))
+        return self._transmit(baseUrl, method, path, headers, bodyProducer,
+                              consumerFactory, responseClass)
+
+    def _transmit(self, baseUrl, method, path, headers, bodyProducer,
+                  consumerFactory, responseClass):
+        """Sends a request to the Solr node at C{baseUrl}.
+
+        Cancelling the returned L{Deferred} aborts the request, closing its
+        connection if the response is already arriving. Timeouts abort the
+        request the same way.
+
+        If the client has an observer, it receives a L{RequestRecord} when
+        the request finishes.
+        """
+        consumers = []
+        timers = []
+        aborted = []
+
+        def abort():
+            aborted.append(True)
+            d.cancel()
+            if consumers and consumers[0].transport is not None:
+                consumers[0].transport.stopProducing()
+
+        def expire(name):
+            _logger.warning('Request to %s timed out (%s)' % (url, name))
+            result.errback(RequestTimeout(name))
+            abort()
+
+        def stopTimers(value):
+            for timer in timers:
+                if timer.active():
+                    timer.cancel()
+            return value
+
+        result = Deferred(lambda _: abort())
+        result.addBoth(stopTimers)
+        done = Deferred()
+
+        record = None
+        if self.observer is not None:
+            record = RequestRecord(baseUrl, method, path.split('?', 1)[0],
+                                   reactor.seconds())
+            length = getattr(bodyProducer, 'length', None)
+            if isinstance(length, (int, long)):
+                record.bytesSent = length
+
+            def connected(reused):
+                record.connected = reactor.seconds()
+                record.reused = reused
+
+            def bodyDone(value):
+                record.finished = reactor.seconds()
+                return value
+
+            self.pool.notifyNextConnection(connected)
+            done.addBoth(bodyDone)
+            result.addBoth(self._report, record, consumers)
+
+        def finished(value):
+            # The outcome of an aborted request is ignored.
+            if not aborted:
+                if isinstance(value, Failure):
+                    result.errback(value)
+                else:
+                    result.callback(value)
+
+        done.addBoth(finished)
+
+        url = baseUrl + path
         headers.update({'User-Agent': ['txSolr']})
+        debug = _logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            _logger.debug('Requesting: [%s] %s' %
+                          (method, clip(url, _URL_LOG_LIMIT)))
+            if self.bodyDump is not None and self.bodyDump.sample():
+                self._dumpBodies(bodyProducer, headers, result)
         headers = Headers(headers)
-        _logger.debug('Requesting: [%s] %s' % (method, url))
-        agent = Agent(reactor)
-        d = agent.request(method, url, headers, bodyProducer)
+        if self.timeout:
+            timers.append(reactor.callLater(self.timeout, expire, 'total'))
+        if self.firstByteTimeout:
+            firstByteTimer = reactor.callLater(self.firstByteTimeout, expire,
+                                               'firstByte')
+            timers.append(firstByteTimer)
+        d = self._agent.request(method, url, headers, bodyProducer)
+        if record is not None:
+            self.pool.notifyNextConnection(None)
 
         def responseCallback(response):
-            _logger.debug('Received response from ' + url)
+            if debug:
+                _logger.debug('Received response %d from %s' %
+                              (response.code, clip(url, _URL_LOG_LIMIT)))
+            if record is not None:
+                record.headersReceived = reactor.seconds()
+                record.status = response.code
+            if self.firstByteTimeout and firstByteTimer.active():
+                firstByteTimer.cancel()
             try:
                 if response.code == 200:
-                    deliveryProtocol = ResponseConsumer(result,
-                                                        JSONSolrResponse)
+                    if consumerFactory is None:
+                        deliveryProtocol = ResponseConsumer(done,
+                                                            responseClass)
+                    else:
+                        deliveryProtocol = consumerFactory(done)
+                    consumers.append(deliveryProtocol)
                     response.deliverBody(deliveryProtocol)
                 else:
                     deliveryProtocol = DiscardingResponseConsumer()
                     response.deliverBody(deliveryProtocol)
-                    result.errback(HTTPWrongStatus(response.code))
+                    done.errback(HTTPWrongStatus(response.code))
             except Exception as e:
-                result.errback(e)
+                done.errback(e)
 
         def responseErrback(failure):
             """Unknown error from Agent.request."""
-            result.errback(HTTPRequestError(failure.value))
+            if aborted:
+                return
             _logger.error(failure.value)
+            if failure.check(TimeoutError):
+                done.errback(RequestTimeout('connect'))
+            else:
+                done.errback(HTTPRequestError(failure.value))
 
         d.addCallbacks(responseCallback, responseErrback)
 
         return result
 
-    def _update(self, input):
+    def _dumpBodies(self, bodyProducer, headers, result):
+        """Log the body of a request and, when it arrives, its response."""
+        dump = self.bodyDump
+        body = getattr(bodyProducer, 'body', None)
+        if 'Content-Encoding' in headers:
+            _logger.debug('Request body: %d compressed bytes' % len(body))
+        elif body is not None:
+            _logger.debug('Request body:\n%s' % dump.format(body))
+        elif bodyProducer is not None:
+            _logger.debug('Request body: streamed')
+
+        def dumpResponse(response):
+            body = getattr(response, 'rawResponse', None)
+            if body is not None:
+                _logger.debug('Response body:\n%s' % dump.format(body))
+            return response
+
+        result.addCallback(dumpResponse)
+
+    def _report(self, result, record, consumers):
+        """Complete the record of a finished request and report it."""
+        if record.finished is None:
+            record.finished = reactor.seconds()
+        if consumers:
+            consumer = consumers[0]
+            record.bytesReceived = getattr(consumer, 'bytesReceived', None)
+            record.decode = getattr(consumer, 'decodeTime', None)
+        if isinstance(result, Failure):
+            record.error = result.type.__name__
+        else:
+            header = getattr(result, 'header', None)
+            if isinstance(header, dict):
+                record.qTime = header.get('QTime')
+        try:
+            self.observer.requestDone(record)
+        except Exception:
+            _logger.exception('Request observer failed')
+        return result
+
+    def _update(self, input, priority=UPDATE, baseUrl=None,
+                idempotent=False):
         """Performs a request to the /update method of Solr.
 
         @param input: The L{IBodyProducer} that generates the body of the
             request.
+        @param priority: The priority of the request. See L{_request}.
+        @param baseUrl: The URL the request is sent to. See L{_request}.
+        @param idempotent: C{True} if the update is idempotent. See
+            L{_request}.
         @return: A L{Deferred} that fires with a L{SolrResponse} object.
         """
         method = 'POST'
-        path = '/update?wt=json'
-        headers = {'Content-Type': [self.inputFactory.contentType]}
-        _logger.debug('Updating:\n%s' % input.body)
-        return self._request(method, path, headers, input)
+        params = {'wt': self.responseClass.writerType}
+        params.update(getattr(input, 'params', None) or {})
+        path = '/update?' + urllib.urlencode(sorted(params.items()))
+        contentType = (getattr(input, 'contentType', None) or
+                       self.inputFactory.contentType)
+        headers = {'Content-Type': [contentType]}
+        if (self.compressUpdates is not None and hasattr(input, 'body') and
+            len(input.body) >= self.compressUpdates):
+            body = gzipBody(input.body)
+            headers['Content-Encoding'] = ['gzip']
+            input = StringProducer(body, getattr(input, 'params', None),
+                                   contentType)
+        return self._request(method, path, headers, input, priority=priority,
+                             baseUrl=baseUrl, idempotent=idempotent)
+
+    def _invalidateCache(self, result=None):
+        if self.cache is not None:
+            self.cache.invalidate()
+        return result
 
-    def _select(self, params):
+    def _changeIndex(self, input, priority=UPDATE, idempotent=True):
+        """
+        Performs an update that changes the visible documents, invalidating
+        the cache before and after it.
+        """
+        self._invalidateCache()
+        d = self._update(input, priority, idempotent=idempotent)
+        return d.addBoth(self._invalidateCache)
+
+    def _responseClassFor(self, params):
+        """
+        Get the response class for a query, set in its C{wt} parameter or
+        by the codec.
+        """
+        if 'wt' in params:
+            return getResponseClass(params['wt'])
+        return self.responseClass
+
+    def _applyResultSchema(self, params, responseClass):
+        """
+        Set the C{fl} parameter of a search and get the response class that
+        converts the documents, according to the result schema.
+        """
+        schema = self.resultSchema
+        if schema is None:
+            return responseClass
+        if schema.fields is not None and 'fl' not in params:
+            params['fl'] = ','.join(schema.fields)
+        return schema.responseClass(responseClass)
+
+    def _select(self, params, consumerFactory=None, responseClass=None):
         """Performs a request to the /select method of Solr.
 
         @param params: A C{dict} with the request parameters as C{unicode}
-            used for the query.
+            used for the query. See L{encodeParams}.
+        @param consumerFactory: Optionally, a callable used to create the
+            body consumer. See L{_request}.
+        @param responseClass: The L{SolrResponse} subclass used to decode the
+            response. By default the one of the codec is used, unless a
+            C{wt} parameter selects the response writer.
         @return: A L{Deferred} that fires with a L{SolrResponse} object.
         """
-        # force JSON response for now
-        params.update(wt=u'json')
+        if responseClass is None:
+            responseClass = self._responseClassFor(params)
+        params.update(wt=responseClass.writerType)
+        responseClass = self._applyResultSchema(params, responseClass)
+        query = (encodeParams(params),)
 
-        encodedParameters = {}
-        for key, value in params.iteritems():
-            # Some solr params contains dots (i.e: ht.fl) We use underscores.
-            key = key.replace('_', '.')
-            if isinstance(value, unicode):
-                value = value.encode('UTF-8')
-            encodedParameters[key] = value
+        if consumerFactory is not None:
+            return self._sendSelect(query, consumerFactory, responseClass)
+        return self._sharedSelect(query, responseClass)
 
-        query = urllib.urlencode(encodedParameters)
+    def _sharedSelect(self, query, responseClass):
+        """
+        Get the response of a query from the cache, from an identical query
+        in flight or from Solr.
 
-        if len(query) < 1024:
-            method = 'GET'
-            path = '/select' + '?' + query
-            headers = {}
-            input = None
-        else:
-            method = 'POST'
-            path = '/select'
-            headers = {
-                'Content-type': [
-                    'application/x-www-form-urlencoded; charset=UTF-8'
-                ]
-            }
-            input = StringProducer(query)
+        @param query: A C{tuple} with the encoded parts of the query.
+        """
+        if self._lifecycle.closed:
+            return fail(HTTPRequestError('The client is closed'))
+
+        cache = self.cache
+        key = (responseClass, query)
+        if cache is not None:
+            body = cache.get(key)
+            if body is not None:
+                if _logger.isEnabledFor(logging.DEBUG):
+                    _logger.debug('Cached response for: %s' %
+                                  clip(''.join(query), _URL_LOG_LIMIT))
+                return succeed(responseClass(body))
+            generation = cache.generation
+
+        def store(response):
+            body = response.rawResponse
+            cache.put(key, body, len(body), generation=generation)
+            return response
+
+        def send():
+            if self.hedger is not None:
+                d = self.hedger.run(
+                    lambda: self._sendSelect(query, None, responseClass))
+            else:
+                d = self._sendSelect(query, None, responseClass)
+            if cache is not None:
+                d.addCallback(store)
+            return d
+
+        if self.coalescer is not None:
+            return self.coalescer.run(('select',) + key, send)
+        return send()
+
+    def _sendSelect(self, query, consumerFactory, responseClass):
+        """
+        Sends an encoded query to Solr using GET or, if long, POST.
+
+        @param query: A C{tuple} with the encoded parts of the query.
+        """
+        length = sum(len(part) for part in query)
+        if length >= self.maxGetLength:
+            return self._postSelect(query, length, consumerFactory,
+                                    responseClass)
+
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug('Select with GET: %d bytes of query' % length)
+        path = '/select?' + ''.join(query)
+        d = self._request('GET', path, {}, None, consumerFactory,
+                          responseClass, idempotent=True)
 
-        return self._request(method, path, headers, input)
+        def rejected(failure):
+            failure.trap(HTTPWrongStatus)
+            if failure.value.args[0] not in _URI_TOO_LONG:
+                return failure
+            if length < self.maxGetLength:
+                _logger.warning('Select of %d bytes rejected with status %d, '
+                                'using POST from that length' %
+                                (length, failure.value.args[0]))
+                self.maxGetLength = length
+            return self._postSelect(query, length, consumerFactory,
+                                    responseClass)
+
+        return d.addErrback(rejected)
+
+    def _postSelect(self, query, length, consumerFactory, responseClass):
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug('Select with POST: %d bytes of query' % length)
+        input = FormProducer(query)
+        headers = {'Content-type': [input.contentType]}
+        return self._request('POST', '/select', headers, input,
+                             consumerFactory, responseClass, idempotent=True)
 
     def add(self, documents, overwrite=None, commitWithin=None):
         """Add one or many documents to a Solr Instance.
@@ -172,6 +723,26 @@ class SolrClient(object):
         input = self.inputFactory.createAdd(documents, overwrite, commitWithin)
         return self._update(input)
 
+    def addStream(self, documents, overwrite=None, commitWithin=None,
+                  chunkSize=65536):
+        """Add any number of documents encoding them as they are sent.
+
+        Unlike L{add}, the body of the request is never held in memory. The
+        documents are taken from C{documents} and encoded in chunks only when
+        the connection is ready to send more data.
+
+        @param documents: An iterable, possibly a generator, of C{dict}
+            documents.
+        @param overwrite: Newer documents will replace previously added
+            documents with the same C{uniqueKey}.
+        @param commitWithin: the addition will be committed within that time.
+        @param chunkSize: The approximate size of the chunks of the body.
+        @return: A L{Deferred} that fires with a L{SolrResponse} object.
+        """
+        input = self.inputFactory.createStreamingAdd(documents, overwrite,
+                                                     commitWithin, chunkSize)
+        return self._update(input)
+
     def delete(self, ids):
         """Delete one or many documents given the ID or IDs of the documents.
 
@@ -181,7 +752,7 @@ class SolrClient(object):
         """
 
         input = self.inputFactory.createDelete(ids)
-        return self._update(input)
+        return self._update(input, idempotent=True)
 
     def deleteByQuery(self, query):
         """Delete all documents returned by a query.
@@ -191,7 +762,7 @@ class SolrClient(object):
         """
 
         input = self.inputFactory.createDeleteByQuery(query)
-        return self._update(input)
+        return self._update(input, idempotent=True)
 
     def commit(self, waitFlush=None, waitSearcher=None, expungeDeletes=None):
         """Issues a commit action to Sorl.
@@ -205,7 +776,7 @@ class SolrClient(object):
         """
         input = self.inputFactory.createCommit(waitFlush, waitSearcher,
                                                expungeDeletes)
-        return self._update(input)
+        return self._changeIndex(input)
 
     def rollback(self):
         """Withdraw all uncommitted changes.
@@ -213,7 +784,7 @@ class SolrClient(object):
         @return: A L{Deferred} that fires with a L{SolrResponse} object.
         """
         input = self.inputFactory.createRollback()
-        return self._update(input)
+        return self._changeIndex(input)
 
     def optimize(self, waitFlush=None, waitSearcher=None, maxSegments=None):
         """Issues an optimize action to Solr.
@@ -227,7 +798,8 @@ class SolrClient(object):
         """
         input = self.inputFactory.createOptimize(waitFlush, waitSearcher,
                                                  maxSegments)
-        return self._update(input)
+        # Retrying an optimization that timed out would start another one.
+        return self._changeIndex(input, ADMIN, idempotent=False)
 
     def search(self, query, **kwargs):
         """Performs a query to Solr.
@@ -235,7 +807,9 @@ class SolrClient(object):
         @param query: A C{unicode} query. (See Solr query syntax).
         @param *kwargs: Additional parameters for the server. For instance:
             'hl' for highlighting, 'sort' for sorting, etc. See Solr
-            documentation for all available options.
+            documentation for all available options. The response format can
+            be chosen for a single request with C{wt}, for instance
+            C{wt='javabin'}.
         @return: A L{Deferred} that fires with a L{SolrResponse} object.
         """
         params = {}
@@ -243,6 +817,155 @@ class SolrClient(object):
         params.update(q=query)
         return self._select(params)
 
+    def multiSearch(self, searches, concurrency=None, merge=False):
+        """Performs many searches at once.
+
+        At most C{concurrency} searches are in flight at the same time, so
+        they reuse the persistent connections of the pool instead of opening
+        new ones.
+
+        @param searches: A sequence of C{dict}s with the parameters of each
+            search, including C{q}. See L{search}.
+        @param concurrency: The maximum number of searches in flight. By
+            default, the number of persistent connections per host.
+        @param merge: If C{True}, the searches that differ only in their
+            C{facet_field} and C{facet_query} parameters are sent as a single
+            search asking for all the facets. They share the same response.
+            See L{txsolr.query.mergeSearches}.
+        @return: A L{Deferred} that fires with a C{list} with the
+            L{SolrResponse} of each search, or a L{Failure} if it failed, in
+            the order of C{searches}.
+        """
+        if concurrency is None:
+            concurrency = self.pool.maxPersistentPerHost
+        if merge:
+            groups = mergeSearches(searches)
+        else:
+            groups = [(dict(search), [index])
+                      for index, search in enumerate(searches)]
+
+        semaphore = DeferredSemaphore(max(concurrency, 1))
+        deferreds = [semaphore.run(self._select, params)
+                     for params, _ in groups]
+
+        def gathered(results):
+            responses = [None] * len(searches)
+            for (_, result), (_, indexes) in zip(results, groups):
+                for index in indexes:
+                    responses[index] = result
+            return responses
+
+        d = DeferredList(deferreds, consumeErrors=True)
+        return d.addCallback(gathered)
+
+    def prepare(self, query=None, variables=VARIABLES, **kwargs):
+        """Prepares a search to be performed many times.
+
+        The parameters that don't change between searches are encoded only
+        once. See L{searchPrepared}.
+
+        @param query: Optionally, a default C{unicode} query.
+        @param variables: The names of the parameters that can change
+            between searches. By default C{q}, C{start} and C{cursorMark}.
+        @param *kwargs: Additional parameters for the server. See L{search}.
+        @return: A L{PreparedQuery}.
+        """
+        params = {}
+        params.update(kwargs)
+        if query is not None:
+            params.update(q=query)
+        responseClass = self._responseClassFor(params)
+        params.update(wt=responseClass.writerType)
+        responseClass = self._applyResultSchema(params, responseClass)
+        return PreparedQuery(params, responseClass, variables)
+
+    def searchPrepared(self, prepared, query=None, **values):
+        """Performs a search prepared with L{prepare}.
+
+        @param prepared: A L{PreparedQuery}.
+        @param query: A C{unicode} query, unless the prepared query has one.
+        @param *values: Values for the variable parameters of the prepared
+            query, for instance C{start} or C{cursorMark}.
+        @raise ValueError: If a parameter is not variable in the prepared
+            query.
+        @return: A L{Deferred} that fires with a L{SolrResponse} object.
+        """
+        if query is not None:
+            values.update(q=query)
+        return self._sharedSelect(prepared.encodeParts(**values),
+                                  prepared.responseClass)
+
+    def searchStream(self, query, docCallback, **kwargs):
+        """Performs a query to Solr processing the documents as they arrive.
+
+        The body of the response is parsed incrementally. Each document found
+        is given to C{docCallback} as soon as it's decoded, without waiting for
+        the rest of the body. If C{docCallback} returns a L{Deferred}, the
+        reception of the body is paused until it fires.
+
+        @param query: A C{unicode} query. (See Solr query syntax).
+        @param docCallback: A callable that receives each document as a
+            C{dict}.
+        @param *kwargs: Additional parameters for the server. See L{search}.
+        @return: A L{Deferred} that fires with a L{SolrResponse} object when
+            all the documents were processed. The C{docs} of its results will
+            be empty.
+        """
+        params = {}
+        params.update(kwargs)
+        params.update(q=query)
+
+        schema = self.resultSchema
+        if schema is not None:
+            callback = docCallback
+
+            def docCallback(doc):
+                return callback(schema.decodeDocument(doc))
+
+        def consumerFactory(deferred):
+            return StreamingResponseConsumer(deferred, JSONSolrResponse,
+                                             docCallback)
+
+        # The streaming parser only understands JSON.
+        return self._select(params, consumerFactory, JSONSolrResponse)
+
+    def iterSearch(self, query, rows=100, prefetch=1, cursor=True,
+                   uniqueKey='id', **kwargs):
+        """Iterates lazily over all the documents matching a query.
+
+        Uses C{cursorMark} deep paging, falling back to C{start} based paging
+        if the server doesn't support cursors or a C{start} parameter is
+        given.
+
+        @param query: A C{unicode} query. (See Solr query syntax).
+        @param rows: The number of documents requested on each page.
+        @param prefetch: The number of pages requested ahead of the page being
+            consumed.
+        @param cursor: If C{False}, always use C{start} based paging.
+        @param uniqueKey: The unique key field of the schema. It's added to
+            the sort, as cursors require.
+        @param *kwargs: Additional parameters for the server. See L{search}.
+        @return: A L{SearchIterator}.
+        """
+        return SearchIterator(self, query, kwargs, rows=rows,
+                              prefetch=prefetch, cursor=cursor,
+                              uniqueKey=uniqueKey)
+
+    def searchAll(self, query, docCallback, rows=100, prefetch=1, cursor=True,
+                  uniqueKey='id', **kwargs):
+        """Calls C{docCallback} with every document matching a query.
+
+        If C{docCallback} returns a L{Deferred}, the next document is
+        processed after it fires. See L{iterSearch} for the arguments.
+
+        @return: A L{Deferred} that fires with the number of documents
+            processed.
+        """
+        iterator = self.iterSearch(query, rows=rows, prefetch=prefetch,
+                                   cursor=cursor, uniqueKey=uniqueKey,
+                                   **kwargs)
+        return iterator.forEach(docCallback)
+
     def ping(self):
         """Ping the server to know if it's alive.
 
@@ -251,6 +974,69 @@ class SolrClient(object):
         @return: A L{Deferred} that fires with a L{SolrResponse} object.
         """
         method = 'GET'
-        path = '/admin/ping?wt=json'
+        path = '/admin/ping?wt=' + self.responseClass.writerType
         headers = {}
-        return self._request(method, path, headers, None)
+        if self.coalescer is not None:
+            return self.coalescer.run(
+                ('ping', path),
+                lambda: self._request(method, path, headers, None,
+                                      idempotent=True))
+        return self._request(method, path, headers, None, idempotent=True)
+
+
+class LoadBalancingSolrClient(SolrClient):
+    """A Solr client that spreads the requests across several Solr nodes.
+
+    Reads are spread across the nodes using the given strategy. Writes go
+    to the C{leader}, if it's given. Nodes that fail are taken out of
+    rotation and pinged periodically until they answer again. See
+    L{txsolr.balancer.LoadBalancer}.
+
+    Only connection errors and 5xx status codes count as failures of a node.
+
+    @param urls: The URLs of the Solr nodes.
+    @param strategy: One of C{'round-robin'}, C{'least-outstanding'} or
+        C{'ewma'}.
+    @param leader: The URL of the node that receives the writes. If it's
+        also in C{urls} it serves reads too.
+    @param maxFailures: The number of consecutive failures that take a node
+        out of rotation.
+    @param probeInterval: The number of seconds between pings to a node out
+        of rotation.
+    @param kwargs: Other arguments for L{SolrClient}.
+    """
+
+    def __init__(self, urls, strategy=ROUND_ROBIN, leader=None, maxFailures=1,
+                 probeInterval=5, **kwargs):
+        SolrClient.__init__(self, urls[0], **kwargs)
+        self.balancer = LoadBalancer(urls, strategy=strategy, leader=leader,
+                                     maxFailures=maxFailures,
+                                     probeInterval=probeInterval,
+                                     probe=self._probe)
+
+    def _send(self, method, path, headers, bodyProducer, consumerFactory,
+              responseClass):
+        balancer = self.balancer
+        node = balancer.select(write=path.startswith('/update'))
+        startTime = balancer.started(node)
+
+        def done(result):
+            failed = (isinstance(result, Failure) and
+                      (result.check(HTTPRequestError) or
+                       (result.check(HTTPWrongStatus) and
+                        result.value.args[0] >= 500)))
+            balancer.finished(node, startTime, bool(failed))
+            return result
+
+        d = self._sendTo(node.url, method, path, headers, bodyProducer,
+                         consumerFactory, responseClass)
+        return d.addBoth(done)
+
+    def _probe(self, node):
+        path = '/admin/ping?wt=' + self.responseClass.writerType
+        return self._sendTo(node.url, 'GET', path, {}, None, None,
+                            self.responseClass)
+
+    def close(self):
+        self.balancer.stop()
+        return SolrClient.close(self)
@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+SolrCloud support.
+
+The L{CloudSolrClient} knows the layout of a collection and sends the
+updates of each document directly to the leader of its shard, saving the
+hop of a node forwarding them.
+"""
+import logging
+import struct
+import urllib
+
+from twisted.internet.defer import gatherResults, succeed
+
+from txsolr.client import SolrClient
+from txsolr.errors import HTTPRequestError, HTTPWrongStatus
+from txsolr.response import JSONSolrResponse
+
+
+__all__ = ['murmurHash3', 'compositeIdHash', 'ClusterState',
+           'CloudSolrClient']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+_MASK = 0xffffffff
+_BLOCK = struct.Struct('<I')
+
+
+def _signed(value):
+    """Convert an unsigned 32 bits integer to a signed one, as in Java."""
+    if value & 0x80000000:
+        return value - 0x100000000
+    return value
+
+
+def murmurHash3(data, seed=0):
+    """
+    Compute the 32 bits x86 variant of MurmurHash3, as Solr does.
+
+    @param data: A C{str}. C{unicode} values are encoded as UTF-8.
+    @return: The hash as a signed C{int}.
+    """
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+
+    c1 = 0xcc9e2d51
+    c2 = 0x1b873593
+    length = len(data)
+    h = seed & _MASK
+    roundedEnd = length & ~3
+
+    for i in xrange(0, roundedEnd, 4):
+        k = _BLOCK.unpack_from(data, i)[0]
+        k = (k * c1) & _MASK
+        k = ((k << 15) | (k >> 17)) & _MASK
+        k = (k * c2) & _MASK
+        h ^= k
+        h = ((h << 13) | (h >> 19)) & _MASK
+        h = (h * 5 + 0xe6546b64) & _MASK
+
+    tail = length & 3
+    if tail:
+        k = 0
+        if tail == 3:
+            k = ord(data[roundedEnd + 2]) << 16
+        if tail >= 2:
+            k |= ord(data[roundedEnd + 1]) << 8
+        k |= ord(data[roundedEnd])
+        k = (k * c1) & _MASK
+        k = ((k << 15) | (k >> 17)) & _MASK
+        k = (k * c2) & _MASK
+        h ^= k
+
+    h ^= length
+    h ^= h >> 16
+    h = (h * 0x85ebca6b) & _MASK
+    h ^= h >> 13
+    h = (h * 0xc2b2ae35) & _MASK
+    h ^= h >> 16
+    return _signed(h)
+
+
+def _splitKey(key):
+    """Split a compositeId key in up to three parts, as Solr does."""
+    first = key.find('!')
+    if first == -1:
+        return [key]
+    parts = [key[:first]]
+    last = len(key) - 1
+    if first < last:
+        second = key.find('!', first + 1)
+        if second == -1:
+            parts.append(key[first + 1:])
+        elif second == last:
+            if first < second - 1:
+                parts.append(key[first + 1:second])
+        else:
+            parts.append(key[first + 1:second])
+            parts.append(key[second + 1:])
+    return parts
+
+
+def _highBits(bits):
+    """A mask with the C{bits} most significant bits set."""
+    return (_MASK << (32 - bits)) & _MASK
+
+
+def compositeIdHash(key):
+    """
+    Compute the hash used by the compositeId router of Solr.
+
+    Keys like C{'tenant!doc'} combine the 16 high bits of the hash of the
+    prefix with the 16 low bits of the hash of the document, so the
+    documents with the same prefix live in the same shard. Keys with three
+    parts use 8, 8 and 16 bits. The number of bits of a prefix can be given
+    as in C{'tenant/4!doc'}.
+
+    @param key: The C{unicode} ID of a document.
+    @return: The hash as a signed C{int}.
+    """
+    if not isinstance(key, unicode):
+        key = unicode(key)
+    parts = _splitKey(key)
+    pieces = len(parts)
+    if key.endswith('!') and pieces < 3:
+        pieces += 1
+    if pieces == 1:
+        return murmurHash3(key)
+
+    bits = [8, 8] if pieces == 3 else [16]
+    hashes = []
+    for i in range(pieces):
+        part = parts[i] if i < len(parts) else u''
+        if i < pieces - 1:
+            slash = part.find('/')
+            if slash > 0:
+                try:
+                    bits[i] = int(part[slash + 1:])
+                except ValueError:
+                    raise ValueError('Invalid number of bits in %r' % key)
+                if not 0 <= bits[i] <= 16:
+                    raise ValueError('Invalid number of bits in %r' % key)
+                part = part[:slash]
+        hashes.append(murmurHash3(part) & _MASK)
+
+    if pieces == 3:
+        first = _highBits(bits[0]) if bits[0] else 0
+        both = _highBits(bits[0] + bits[1]) if bits[0] + bits[1] else 0
+        masks = [first, first ^ both,
+                 0 if bits[0] + bits[1] == 32 else ~(first | both) & _MASK]
+    else:
+        first = _highBits(bits[0]) if bits[0] else 0
+        masks = [first, 0 if bits[0] == 32 else _MASK >> bits[0]]
+
+    result = 0
+    for value, mask in zip(hashes, masks):
+        result |= value & mask
+    return _signed(result)
+
+
+def _parseRange(text):
+    """Parse a shard range like C{'80000000-ffffffff'}."""
+    low, high = text.split('-')
+    return _signed(int(low, 16)), _signed(int(high, 16))
+
+
+class _Shard(object):
+    """
+    A shard of a collection.
+
+    @ivar name: The name of the shard.
+    @ivar range: A C{(min, max)} tuple with the hash range, or C{None}.
+    @ivar leader: The URL of the core of the leader, or C{None}.
+    @ivar nodes: The base URLs of the nodes with active replicas.
+    """
+
+    def __init__(self, name, state):
+        self.name = name
+        self.range = None
+        if state.get('range'):
+            self.range = _parseRange(state['range'])
+        self.active = state.get('state', 'active') == 'active'
+        self.leader = None
+        self.nodes = []
+        for replica in state.get('replicas', {}).itervalues():
+            if replica.get('state', 'active') != 'active':
+                continue
+            baseUrl = str(replica['base_url']).rstrip('/')
+            self.nodes.append(baseUrl)
+            if replica.get('leader') in ('true', True):
+                self.leader = '%s/%s' % (baseUrl, str(replica['core']))
+
+
+class ClusterState(object):
+    """
+    The layout of a SolrCloud collection.
+
+    @ivar collection: The name of the collection.
+    @ivar router: The name of the router of the collection.
+    @ivar shards: The active shards of the collection.
+    @ivar version: The version of the state in ZooKeeper, if known.
+
+    @param state: The decoded result of a C{CLUSTERSTATUS} action of the
+        Collections API, or the decoded content of a C{clusterstate.json} or
+        C{state.json} file.
+    @param collection: The name of the collection.
+    @raise ValueError: If the collection is not in the state.
+    """
+
+    def __init__(self, state, collection):
+        if 'cluster' in state:
+            state = state['cluster'].get('collections', {})
+        if collection not in state:
+            raise ValueError('Unknown collection %r' % collection)
+
+        state = state[collection]
+        self.collection = collection
+        self.router = state.get('router', {}).get('name', 'compositeId')
+        self.version = state.get('znodeVersion')
+        self.shards = [_Shard(name, shard)
+                       for name, shard in sorted(state['shards'].iteritems())]
+        self.shards = [shard for shard in self.shards if shard.active]
+
+    def nodes(self):
+        """@return: The base URLs of the nodes with active replicas."""
+        nodes = set()
+        for shard in self.shards:
+            nodes.update(shard.nodes)
+        return sorted(nodes)
+
+    def leaderFor(self, id):
+        """
+        Find the leader of the shard of a document.
+
+        @param id: The ID of the document.
+        @return: The URL of the core of the leader, or C{None} if it can't be
+            known.
+        """
+        if self.router != 'compositeId':
+            return None
+        hash = compositeIdHash(id)
+        for shard in self.shards:
+            if shard.range is not None:
+                low, high = shard.range
+                if low <= hash <= high:
+                    return shard.leader
+        return None
+
+
+class CloudSolrClient(SolrClient):
+    """A Solr client that routes updates to the leaders of SolrCloud shards.
+
+    Added and deleted documents are grouped by the leader of their shard,
+    according to the compositeId router, and each group is sent directly to
+    its leader. Documents that can't be routed (for instance, without
+    ID or with other routers) are sent to the collection, and Solr forwards
+    them.
+
+    Searches and the rest of the requests are spread in turns across the
+    nodes with active replicas.
+
+    If a request to a leader fails because the leader is gone, the layout
+    is reloaded with C{CLUSTERSTATUS} and the request is routed again, once.
+
+    @ivar clusterState: The current L{ClusterState}, or C{None} if it has not
+        been loaded yet.
+
+    @param urls: The base URLs of some nodes of the cluster, like
+        C{'http://localhost:8983/solr'}.
+    @param collection: The name of the collection.
+    @param clusterState: Optionally, the decoded cluster state, as accepted
+        by L{ClusterState}. If it's not given, it's loaded with
+        C{CLUSTERSTATUS} before the first update.
+    @param idField: The name of the unique key field.
+    @param kwargs: Other arguments for L{SolrClient}.
+    """
+
+    def __init__(self, urls, collection, clusterState=None, idField='id',
+                 **kwargs):
+        if isinstance(urls, basestring):
+            urls = [urls]
+        self.baseUrls = [url.rstrip('/') for url in urls]
+        self.collection = collection
+        self.idField = idField
+        SolrClient.__init__(self, self._collectionUrl(self.baseUrls[0]),
+                            **kwargs)
+
+        self.clusterState = None
+        if clusterState is not None:
+            self.clusterState = ClusterState(clusterState, collection)
+        self._next = 0
+
+    def _collectionUrl(self, baseUrl):
+        return '%s/%s' % (baseUrl, self.collection)
+
+    def _nodes(self):
+        if self.clusterState is not None:
+            nodes = self.clusterState.nodes()
+            if nodes:
+                return nodes
+        return self.baseUrls
+
+    def refresh(self):
+        """
+        Reload the layout of the collection with C{CLUSTERSTATUS}.
+
+        @return: A L{Deferred} that fires with the new L{ClusterState}.
+        """
+        nodes = self._nodes()
+        node = nodes[self._next % len(nodes)]
+        self._next += 1
+        query = urllib.urlencode([('action', 'CLUSTERSTATUS'),
+                                  ('collection', self.collection),
+                                  ('wt', 'json')])
+        _logger.debug('Loading the cluster state from %s' % node)
+        d = self._request('GET', '/admin/collections?' + query, {}, None,
+                          responseClass=JSONSolrResponse, baseUrl=node)
+
+        def loaded(response):
+            state = ClusterState({'cluster': response.cluster},
+                                 self.collection)
+            if (self.clusterState is not None and
+                state.version != self.clusterState.version):
+                _logger.info('The layout of %s changed' % self.collection)
+            self.clusterState = state
+            return state
+
+        return d.addCallback(loaded)
+
+    def _send(self, method, path, headers, bodyProducer, consumerFactory,
+              responseClass):
+        nodes = self._nodes()
+        node = nodes[self._next % len(nodes)]
+        self._next += 1
+        return self._sendTo(self._collectionUrl(node), method, path, headers,
+                            bodyProducer, consumerFactory, responseClass)
+
+    def _route(self, items, getId):
+        """
+        Group items by the leader of their shard.
+
+        @return: A L{Deferred} that fires with a C{list} of C{(url, items)}
+            tuples. C{url} is C{None} for the items that can't be routed.
+        """
+        if self.clusterState is None:
+            d = self.refresh()
+        else:
+            d = succeed(self.clusterState)
+
+        def group(state):
+            groups = {}
+            for item in items:
+                id = getId(item)
+                leader = None
+                if id is not None:
+                    leader = state.leaderFor(id)
+                groups.setdefault(leader, []).append(item)
+            return sorted(groups.items())
+
+        return d.addCallback(group)
+
+    def _routedUpdate(self, items, getId, createInput, idempotent=False,
+                      retry=True):
+        """
+        Send the items to the leaders of their shards.
+
+        @param createInput: A callable that receives a C{list} of items and
+            returns the input of the update.
+        @param idempotent: C{True} if the update is idempotent.
+        @return: A L{Deferred} that fires with the L{SolrResponse} of the
+            first group, once all the groups are done.
+        """
+        def send(groups):
+            deferreds = []
+            for leader, group in groups:
+                input = createInput(group)
+                d = self._update(input, baseUrl=leader,
+                                 idempotent=idempotent)
+                if leader is not None and retry:
+                    d.addErrback(self._leaderFailed, group, getId,
+                                 createInput, idempotent)
+                deferreds.append(d)
+            d = gatherResults(deferreds, consumeErrors=True)
+            d.addErrback(lambda failure: failure.value.subFailure)
+            return d.addCallback(lambda responses: responses[0])
+
+        return self._route(items, getId).addCallback(send)
+
+    def _leaderFailed(self, failure, items, getId, createInput, idempotent):
+        """Reload the layout and route again if the leader is gone."""
+        if not (failure.check(HTTPRequestError) or
+                (failure.check(HTTPWrongStatus) and
+                 failure.value.args[0] in (404, 503))):
+            return failure
+        _logger.warning('Update to a leader failed, reloading the layout: '
+                        '%s' % failure.value)
+        d = self.refresh()
+        d.addCallback(lambda _: self._routedUpdate(items, getId, createInput,
+                                                   idempotent, retry=False))
+        return d
+
+    def add(self, documents, overwrite=None, commitWithin=None):
+        """Add one or many documents, sending them to their shard leaders.
+
+        See L{SolrClient.add}.
+
+        @return: A L{Deferred} that fires with the L{SolrResponse} of one of
+            the leaders when all of them have answered.
+        """
+        if isinstance(documents, dict):
+            documents = [documents]
+
+        def createInput(group):
+            return self.inputFactory.createAdd(group, overwrite,
+                                               commitWithin)
+
+        return self._routedUpdate(documents,
+                                  lambda doc: doc.get(self.idField),
+                                  createInput)
+
+    def delete(self, ids):
+        """Delete one or many documents, sending the IDs to their shard
+        leaders.
+
+        See L{SolrClient.delete}.
+
+        @return: A L{Deferred} that fires with the L{SolrResponse} of one of
+            the leaders when all of them have answered.
+        """
+        if not isinstance(ids, (tuple, list, set)):
+            ids = [ids]
+        return self._routedUpdate(list(ids), lambda id: id,
+                                  self.inputFactory.createDelete,
+                                  idempotent=True)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Coalescing of identical concurrent requests.
+"""
+import logging
+
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.python.failure import Failure
+
+
+__all__ = ['RequestCoalescer']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+def _copyResponse(response):
+    """Decode a new response from the body of another one."""
+    return response.__class__(response.rawResponse)
+
+
+class RequestCoalescer(object):
+    """
+    Makes identical concurrent requests share a single request.
+
+    The first caller for a key starts the request, and the callers that
+    arrive while it's in flight wait for the same result. Every caller gets
+    its own L{Deferred}: cancelling it or adding callbacks to it doesn't
+    affect the others. The first caller receives the original result and
+    the rest receive copies, so they can't see each other's changes.
+
+    @ivar coalesced: The number of requests that were not sent because an
+        identical request was in flight.
+
+    @param copy: A callable that returns a copy of a result. By default
+        responses are decoded again from their raw body.
+    """
+
+    def __init__(self, copy=_copyResponse):
+        self.coalesced = 0
+        self._copy = copy
+        self._inFlight = {}
+
+    def run(self, key, request):
+        """
+        Call C{request}, unless there is a request for C{key} in flight.
+
+        @param key: A hashable object identifying the request.
+        @param request: A callable returning a L{Deferred}.
+        @return: A L{Deferred} that fires with the result of the request.
+        """
+        waiter = Deferred()
+        waiters = self._inFlight.get(key)
+        if waiters is not None:
+            self.coalesced += 1
+            waiters.append(waiter)
+            return waiter
+
+        self._inFlight[key] = [waiter]
+        maybeDeferred(request).addBoth(self._done, key)
+        return waiter
+
+    def _done(self, result, key):
+        waiters = self._inFlight.pop(key)
+        if len(waiters) > 1:
+            _logger.debug('Request shared by %d callers' % len(waiters))
+
+        if isinstance(result, Failure):
+            for waiter in waiters:
+                waiter.errback(result)
+            return None
+
+        waiters[0].callback(result)
+        for waiter in waiters[1:]:
+            try:
+                copy = self._copy(result)
+            except Exception:
+                waiter.errback()
+            else:
+                waiter.callback(copy)
+        return None
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Registry of the formats used to talk to Solr.
+
+A L{Codec} pairs an input factory, which encodes the update requests, with a
+L{SolrResponse} class, which decodes the responses and tells Solr which
+response writer (C{wt}) to use. The client selects a codec by name.
+"""
+from txsolr.input import (SimpleXMLInputFactory, JSONInputFactory,
+                          JavabinInputFactory, CSVInputFactory)
+from txsolr.response import JSONSolrResponse, JavabinSolrResponse
+
+
+__all__ = ['Codec', 'registerCodec', 'getCodec', 'getResponseClass']
+
+
+class Codec(object):
+    """
+    A named pair of request encoder and response decoder.
+
+    @param name: The name used to select the codec.
+    @param inputFactory: A callable returning a new input factory.
+    @param responseClass: The L{SolrResponse} subclass used to decode the
+        responses. Its C{writerType} is sent to Solr as the C{wt} parameter.
+    """
+
+    def __init__(self, name, inputFactory, responseClass):
+        self.name = name
+        self.inputFactory = inputFactory
+        self.responseClass = responseClass
+
+    def __repr__(self):
+        return 'Codec(%r)' % self.name
+
+
+_codecs = {}
+
+
+def registerCodec(codec):
+    """Register a L{Codec}, replacing any other codec with the same name."""
+    _codecs[codec.name] = codec
+
+
+def getCodec(name):
+    """
+    Get a registered L{Codec} by name.
+
+    @raise ValueError: If there is no codec with that name.
+    """
+    try:
+        return _codecs[name]
+    except KeyError:
+        raise ValueError('Unknown codec %r, use one of: %s' %
+                         (name, ', '.join(sorted(_codecs))))
+
+
+def getResponseClass(writerType):
+    """
+    Get the response class of a registered codec by its writer type.
+
+    @raise ValueError: If no codec uses that writer type.
+    """
+    for codec in _codecs.itervalues():
+        if codec.responseClass.writerType == writerType:
+            return codec.responseClass
+    raise ValueError('Unknown response writer %r' % writerType)
+
+
+registerCodec(Codec('xml', SimpleXMLInputFactory, JSONSolrResponse))
+registerCodec(Codec('json', JSONInputFactory, JSONSolrResponse))
+registerCodec(Codec('javabin', JavabinInputFactory, JavabinSolrResponse))
+registerCodec(Codec('csv', CSVInputFactory, JSONSolrResponse))
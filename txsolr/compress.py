@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compression of the bodies of requests and responses.
+
+Responses are decompressed while they arrive, before they reach the
+consumer, with the decoders of L{twisted.web.client.ContentDecoderAgent}.
+"""
+import zlib
+from cStringIO import StringIO
+from gzip import GzipFile
+
+from twisted.internet.protocol import Protocol
+from twisted.python.components import proxyForInterface
+from twisted.python.failure import Failure
+from twisted.web.client import GzipDecoder, ResponseFailed
+from twisted.web.iweb import IResponse, UNKNOWN_LENGTH
+
+
+__all__ = ['DeflateDecoder', 'DECODERS', 'gzipBody']
+
+
+class _DeflateProtocol(Protocol):
+    """
+    Wraps a protocol, decompressing the data it receives.
+
+    Servers disagree on the meaning of C{deflate}: some send a zlib stream,
+    as the standard says, and some a raw deflate stream. The kind of stream
+    is detected from its first two bytes.
+    """
+
+    def __init__(self, protocol, response):
+        self.original = protocol
+        self._response = response
+        self._decompress = None
+        self._head = ''
+
+    def makeConnection(self, transport):
+        self.original.makeConnection(transport)
+
+    def dataReceived(self, data):
+        if self._decompress is None:
+            self._head += data
+            if len(self._head) < 2:
+                return
+            data, self._head = self._head, ''
+            first, second = ord(data[0]), ord(data[1])
+            if first & 0x0f == 8 and (first << 8 | second) % 31 == 0:
+                self._decompress = zlib.decompressobj()
+            else:
+                self._decompress = zlib.decompressobj(-zlib.MAX_WBITS)
+        try:
+            rawData = self._decompress.decompress(data)
+        except zlib.error:
+            raise ResponseFailed([Failure()], self._response)
+        if rawData:
+            self.original.dataReceived(rawData)
+
+    def connectionLost(self, reason):
+        if self._decompress is not None:
+            try:
+                rawData = self._decompress.flush()
+            except zlib.error:
+                raise ResponseFailed([reason, Failure()], self._response)
+            if rawData:
+                self.original.dataReceived(rawData)
+        self.original.connectionLost(reason)
+
+
+class DeflateDecoder(proxyForInterface(IResponse)):
+    """A wrapper for a L{Response} with a deflate compressed body."""
+
+    def __init__(self, response):
+        self.original = response
+        self.length = UNKNOWN_LENGTH
+
+    def deliverBody(self, protocol):
+        self.original.deliverBody(_DeflateProtocol(protocol, self.original))
+
+
+# The decoders for ContentDecoderAgent, in order of preference.
+DECODERS = [('gzip', GzipDecoder), ('deflate', DeflateDecoder)]
+
+
+def gzipBody(body, level=6):
+    """
+    Compress the body of a request with gzip.
+
+    @param body: A C{str}.
+    @param level: The compression level, from 1 (fastest) to 9 (smallest).
+    @return: The compressed C{str}.
+    """
+    buffer = StringIO()
+    gzipFile = GzipFile(fileobj=buffer, mode='wb', compresslevel=level,
+                        mtime=0)
+    gzipFile.write(body)
+    gzipFile.close()
+    return buffer.getvalue()
@@ -20,7 +20,8 @@ Exception classes for txSolr.
 
 
 __all__ = ['HTTPWrongStatus', 'SolrResponseError', 'HTTPRequestError',
-           'InputError']
+           'InputError', 'RequestQueueFull', 'RequestTimeout',
+           'CircuitOpen']
 
 
 class InputError(ValueError):
@@ -40,3 +41,25 @@ class SolrResponseError(Exception):
 
 class HTTPRequestError(Exception):
     """Raised when a problem is found when performing a request to Solr."""
+
+
+class RequestQueueFull(HTTPRequestError):
+    """
+    Raised when a request can't wait for its turn because the queue of its
+    priority is full.
+    """
+
+
+class RequestTimeout(HTTPRequestError):
+    """
+    Raised when a request takes longer than one of the timeouts of the
+    client. The first argument is the name of the timeout: C{'connect'},
+    C{'firstByte'} or C{'total'}.
+    """
+
+
+class CircuitOpen(HTTPRequestError):
+    """
+    Raised when a request is not sent because the circuit breaker of its
+    endpoint is open. The first argument is the URL of the endpoint.
+    """
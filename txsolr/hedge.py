@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Hedging of slow requests.
+
+A small fraction of the requests are much slower than the rest, because of
+a busy replica, a garbage collection pause or a lost packet. Sending a
+duplicate of the requests that take longer than usual, and using whichever
+answer arrives first, removes most of that tail latency for a small extra
+load.
+"""
+import logging
+from collections import deque
+
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.python.failure import Failure
+
+
+__all__ = ['RequestHedger']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+class _HedgedRequest(object):
+    """
+    The attempts of a single hedged request.
+
+    @ivar result: The L{Deferred} given to the caller.
+    @ivar attempts: The L{Deferred}s of the attempts in flight.
+    """
+
+    def __init__(self, hedger, request):
+        self.hedger = hedger
+        self.request = request
+        self.result = Deferred(self._cancel)
+        self.attempts = []
+        self.finished = False
+        self.timer = None
+
+    def attempt(self):
+        startTime = self.hedger._clock.seconds()
+        d = maybeDeferred(self.request)
+        self.attempts.append(d)
+        d.addBoth(self._attemptDone, d, startTime)
+
+    def hedge(self):
+        self.timer = None
+        if self.hedger._spend():
+            _logger.debug('Hedging a slow request')
+            self.attempt()
+
+    def _attemptDone(self, result, d, startTime):
+        self.attempts.remove(d)
+        if self.finished:
+            # A cancelled attempt or a slower duplicate.
+            return None
+        if isinstance(result, Failure) and self.attempts:
+            # Another attempt may still succeed.
+            return None
+
+        self._stop()
+        if isinstance(result, Failure):
+            self.result.errback(result)
+        else:
+            self.hedger._record(self.hedger._clock.seconds() - startTime)
+            self.result.callback(result)
+        return None
+
+    def _stop(self):
+        self.finished = True
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        for d in list(self.attempts):
+            d.cancel()
+
+    def _cancel(self, _):
+        self._stop()
+
+
+class RequestHedger(object):
+    """
+    Sends a duplicate of the requests that take longer than usual.
+
+    If a request has not answered after the C{percentile} of the latencies
+    of the recent requests, the same request is sent again. The first
+    answer wins and the other attempt is cancelled. Only idempotent
+    requests should be hedged.
+
+    The extra load is capped by a budget: each request earns C{budget}
+    percent of a hedge, and a hedge is only sent when a whole one has been
+    earned.
+
+    @ivar requests: The number of hedged requests.
+    @ivar hedged: The number of duplicates sent.
+
+    @param percentile: The percentile of the latencies used as the delay
+        before sending a duplicate.
+    @param budget: The maximum extra load, as a percentage of the requests.
+    @param initialDelay: The delay, in seconds, used until C{minSamples}
+        latencies are known.
+    @param minSamples: The number of latencies needed to use the percentile.
+    @param window: The number of recent latencies kept.
+    @param clock: The L{IReactorTime} provider used to schedule the
+        duplicates. By default the global reactor is used.
+    """
+
+    def __init__(self, percentile=95, budget=5, initialDelay=0.05,
+                 minSamples=20, window=500, clock=None):
+        if not 0 < percentile < 100:
+            raise ValueError('percentile must be between 0 and 100')
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.percentile = percentile
+        self.budget = budget
+        self.initialDelay = initialDelay
+        self.minSamples = minSamples
+        self.requests = 0
+        self.hedged = 0
+        self._latencies = deque(maxlen=window)
+        self._tokens = 0.0
+        self._maxTokens = max(1.0, budget / 10.0)
+        self._clock = clock
+
+    def delay(self):
+        """@return: The seconds a request waits before being duplicated."""
+        if len(self._latencies) < self.minSamples:
+            return self.initialDelay
+        latencies = sorted(self._latencies)
+        index = int(len(latencies) * self.percentile / 100.0)
+        return latencies[min(index, len(latencies) - 1)]
+
+    def run(self, request):
+        """
+        Call C{request}, and call it again if it's slow.
+
+        @param request: A callable returning a cancellable L{Deferred}.
+        @return: A L{Deferred} that fires with the first successful result,
+            or with the failure of the last attempt if all of them fail.
+        """
+        self.requests += 1
+        self._tokens = min(self._maxTokens,
+                           self._tokens + self.budget / 100.0)
+
+        hedged = _HedgedRequest(self, request)
+        hedged.attempt()
+        if not hedged.finished:
+            hedged.timer = self._clock.callLater(self.delay(), hedged.hedge)
+        return hedged.result
+
+    def _spend(self):
+        """Take a hedge from the budget, if there is one."""
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        self.hedged += 1
+        return True
+
+    def _record(self, latency):
+        self._latencies.append(latency)
@@ -19,16 +19,22 @@
 Encoders and decoders for Solr requests and responses
 """
 
+import csv
+import json
+from cStringIO import StringIO
 from xml.etree import cElementTree as ElementTree
 from datetime import date, datetime
 
 from zope.interface import implements
-from twisted.internet import defer
-from twisted.web.iweb import IBodyProducer
+from twisted.internet import defer, task
+from twisted.web.iweb import IBodyProducer, UNKNOWN_LENGTH
 
 from txsolr.errors import InputError
+from txsolr.javabin import JavabinEncoder
 
-__all__ = ['StringProducer', 'SimpleXMLInputFactory', 'escapeTerm']
+__all__ = ['StringProducer', 'IterableProducer', 'SimpleXMLInputFactory',
+           'JSONInputFactory', 'JavabinInputFactory', 'CSVInputFactory',
+           'escapeTerm']
 
 
 def escapeTerm(term):
@@ -45,13 +51,24 @@ def escapeTerm(term):
 class StringProducer(object):
     """
     Very basic producer used for Agent requests
+
+    @cvar replayable: C{True}, the body can be sent again, for instance to
+        retry a request.
+    @ivar params: A C{dict} of parameters for the URL of the request, for
+        options that can't be expressed in the body.
+    @ivar contentType: The content type of the body, if it's different from
+        the one of the input factory that created it.
     """
 
     implements(IBodyProducer)
 
-    def __init__(self, body):
+    replayable = True
+
+    def __init__(self, body, params=None, contentType=None):
         self.body = str(body)
         self.length = len(body)
+        self.params = params or {}
+        self.contentType = contentType
 
     def startProducing(self, consumer):
         consumer.write(self.body)
@@ -64,6 +81,103 @@ class StringProducer(object):
         pass
 
 
+class FormProducer(object):
+    """
+    Producer of a form encoded body made of already encoded parts.
+
+    The parts are written one after the other without joining them, so a
+    large part, like the static parameters of a
+    L{txsolr.query.PreparedQuery}, is sent without being copied. The same
+    producer can be used for several requests.
+
+    @cvar replayable: C{True}, the body can be sent again, for instance to
+        retry a request.
+    @ivar parts: The C{tuple} of C{str} parts of the body.
+    """
+
+    implements(IBodyProducer)
+
+    contentType = 'application/x-www-form-urlencoded; charset=UTF-8'
+    replayable = True
+
+    def __init__(self, parts):
+        self.parts = tuple(parts)
+        self.length = sum(len(part) for part in self.parts)
+        self.params = {}
+
+    @property
+    def body(self):
+        return ''.join(self.parts)
+
+    def startProducing(self, consumer):
+        for part in self.parts:
+            consumer.write(part)
+        return defer.succeed(None)
+
+    def pauseProducing(self):
+        pass
+
+    def stopProducing(self):
+        pass
+
+
+class IterableProducer(object):
+    """
+    Producer that writes the chunks given by an iterable, one at a time.
+
+    The chunks are only generated when the transport is ready to send them,
+    so the body is never held completely in memory. The length of the body
+    is unknown, which makes the Agent use chunked transfer encoding.
+
+    @param chunks: An iterable of C{str} chunks.
+    @param cooperator: The L{task.Cooperator} used to schedule the writes.
+        By default the global cooperator is used.
+    @param params: A C{dict} of parameters for the URL of the request.
+    """
+
+    implements(IBodyProducer)
+
+    length = UNKNOWN_LENGTH
+    contentType = None
+    replayable = False
+
+    def __init__(self, chunks, cooperator=task, params=None):
+        self._chunks = chunks
+        self._cooperator = cooperator
+        self._task = None
+        self.params = params or {}
+
+    def _writeChunks(self, consumer):
+        for chunk in self._chunks:
+            consumer.write(chunk)
+            yield None
+
+    def startProducing(self, consumer):
+        self._task = self._cooperator.cooperate(self._writeChunks(consumer))
+        d = self._task.whenDone()
+
+        def maybeStopped(reason):
+            # If the task was stopped, the request was aborted. In that case
+            # the Deferred must never fire.
+            reason.trap(task.TaskStopped)
+            return defer.Deferred()
+
+        d.addCallbacks(lambda ignored: None, maybeStopped)
+        return d
+
+    def pauseProducing(self):
+        self._task.pause()
+
+    def resumeProducing(self):
+        self._task.resume()
+
+    def stopProducing(self):
+        try:
+            self._task.stop()
+        except task.TaskFinished:
+            pass
+
+
 class SimpleXMLInputFactory(object):
     """
     Creates XML input messages for Solr
@@ -109,26 +223,67 @@ class SimpleXMLInputFactory(object):
             addElement.set('commitWithin', commitWithin)
 
         for doc in documents:
+            addElement.append(self._createDocElement(doc))
 
-            docElement = ElementTree.Element('doc')
-            for key, value in doc.iteritems():
+        result = ElementTree.tostring(addElement, encoding='utf-8')
+        return StringProducer(result)
 
-                if isinstance(value, (tuple, list, set)):
-                    values = value
-                else:
-                    values = [value]
+    def _createDocElement(self, doc):
+        docElement = ElementTree.Element('doc')
+        for key, value in doc.iteritems():
 
-                for v in values:
-                    if v is None:
-                        continue
+            if isinstance(value, (tuple, list, set)):
+                values = value
+            else:
+                values = [value]
 
-                    fieldElement = ElementTree.Element('field', name=key)
-                    fieldElement.text = self._encodeValue(v)
-                    docElement.append(fieldElement)
-            addElement.append(docElement)
+            for v in values:
+                if v is None:
+                    continue
 
-        result = ElementTree.tostring(addElement, encoding='utf-8')
-        return StringProducer(result)
+                fieldElement = ElementTree.Element('field', name=key)
+                fieldElement.text = self._encodeValue(v)
+                docElement.append(fieldElement)
+        return docElement
+
+    def createStreamingAdd(self, documents, overwrite=None, commitWithin=None,
+                           chunkSize=65536):
+        """
+        Create an add request in XML format that is encoded incrementally.
+
+        The documents are consumed and encoded only when the body is being
+        sent, so C{documents} can be a generator producing any number of
+        documents.
+
+        @param documents: An iterable of C{dict} documents.
+        @param chunkSize: The approximate size of the chunks written to the
+            transport.
+        @return: An L{IterableProducer}.
+        """
+        # Attributes sorted by name, as ElementTree does.
+        attributes = ''
+        if commitWithin is not None:
+            attributes += ' commitWithin="%d"' % int(commitWithin)
+        if overwrite is not None:
+            overwrite = 'true' if overwrite else 'false'
+            attributes += ' overwrite="%s"' % overwrite
+
+        def generateChunks():
+            parts = ['<add%s>' % attributes]
+            size = len(parts[0])
+            for doc in documents:
+                part = ElementTree.tostring(self._createDocElement(doc),
+                                            encoding='utf-8')
+                parts.append(part)
+                size += len(part)
+                if size >= chunkSize:
+                    yield ''.join(parts)
+                    parts = []
+                    size = 0
+            parts.append('</add>')
+            yield ''.join(parts)
+
+        return IterableProducer(generateChunks())
 
     def createDelete(self, id):
         if isinstance(id, (tuple, list, set)):
@@ -201,3 +356,423 @@ class SimpleXMLInputFactory(object):
 
         result = ElementTree.tostring(optimizeElement)
         return StringProducer(result)
+
+
+class JSONInputFactory(object):
+    """
+    Creates JSON input messages for Solr.
+
+    Encoding JSON is considerably cheaper than building an ElementTree for
+    every field, and the payloads are smaller. This requires a Solr version
+    whose C{/update} handler accepts C{application/json} bodies.
+    """
+
+    def __init__(self):
+        self.contentType = 'application/json'
+        self._encoder = json.JSONEncoder(default=self._encodeValue)
+
+    def _encodeValue(self, value):
+        """Encode the values that JSON doesn't support natively."""
+        if isinstance(value, datetime):
+            return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        elif isinstance(value, date):
+            return value.strftime('%Y-%m-%dT00:00:00Z')
+
+        try:
+            return unicode(value)
+        except UnicodeError:
+            raise InputError('Unable to decode value %r' % value)
+
+    def _encode(self, value):
+        try:
+            return self._encoder.encode(value)
+        except UnicodeError:
+            raise InputError('Unable to encode value %r' % value)
+
+    def _encodeDocument(self, doc):
+        fields = {}
+        for key, value in doc.iteritems():
+            if isinstance(value, (tuple, list, set)):
+                value = [v for v in value if v is not None]
+                if not value:
+                    continue
+            elif value is None:
+                continue
+            fields[key] = value
+        return self._encode(fields)
+
+    def _addOptions(self, overwrite, commitWithin):
+        options = ''
+        if overwrite is not None:
+            options += ',"overwrite":%s' % ('true' if overwrite else 'false')
+        if commitWithin is not None:
+            options += ',"commitWithin":%d' % int(commitWithin)
+        return options
+
+    def _commandOptions(self, **options):
+        values = {}
+        for key, value in options.iteritems():
+            if value is not None:
+                values[key] = value
+        return self._encode(values)
+
+    def createAdd(self, document, overwrite=None, commitWithin=None):
+        """
+        Create an add request in JSON format
+        """
+
+        if isinstance(document, (tuple, list, set)):
+            documents = document
+        else:
+            documents = [document]
+
+        options = self._addOptions(overwrite, commitWithin)
+        commands = ['"add":{"doc":%s%s}' % (self._encodeDocument(doc),
+                                            options)
+                    for doc in documents]
+        return StringProducer('{%s}' % ','.join(commands))
+
+    def createStreamingAdd(self, documents, overwrite=None, commitWithin=None,
+                           chunkSize=65536):
+        """
+        Create an add request in JSON format that is encoded incrementally.
+
+        See L{SimpleXMLInputFactory.createStreamingAdd}.
+        """
+        options = self._addOptions(overwrite, commitWithin)
+
+        def generateChunks():
+            parts = ['{']
+            size = 1
+            separator = ''
+            for doc in documents:
+                part = '%s"add":{"doc":%s%s}' % (
+                    separator, self._encodeDocument(doc), options)
+                separator = ','
+                parts.append(part)
+                size += len(part)
+                if size >= chunkSize:
+                    yield ''.join(parts)
+                    parts = []
+                    size = 0
+            parts.append('}')
+            yield ''.join(parts)
+
+        return IterableProducer(generateChunks())
+
+    def createDelete(self, id):
+        if isinstance(id, (tuple, list, set)):
+            ids = id
+        else:
+            ids = [id]
+
+        commands = ['"delete":{"id":%s}' % self._encode(self._encodeValue(i))
+                    for i in ids]
+        return StringProducer('{%s}' % ','.join(commands))
+
+    def createDeleteByQuery(self, query):
+        return StringProducer('{"delete":{"query":%s}}' % self._encode(query))
+
+    def createCommit(self, waitFlush=None,
+                           waitSearcher=None,
+                           expungeDeletes=None):
+        options = self._commandOptions(waitFlush=waitFlush,
+                                       waitSearcher=waitSearcher,
+                                       expungeDeletes=expungeDeletes)
+        return StringProducer('{"commit":%s}' % options)
+
+    def createRollback(self):
+        return StringProducer('{"rollback":{}}')
+
+    def createOptimize(self, waitFlush=None,
+                             waitSearcher=None,
+                             maxSegments=None):
+        options = self._commandOptions(waitFlush=waitFlush,
+                                       waitSearcher=waitSearcher,
+                                       maxSegments=maxSegments)
+        return StringProducer('{"optimize":%s}' % options)
+
+
+class JavabinInputFactory(object):
+    """
+    Creates javabin input messages for Solr.
+
+    The messages have the same format used by SolrJ's
+    C{BinaryRequestWriter}. Commit, optimize and rollback actions are sent as
+    parameters of the request, with an empty update message as the body.
+    """
+
+    def __init__(self):
+        self.contentType = 'application/javabin'
+
+    def _createUpdate(self, params=(), ids=None, queries=None,
+                      documents=None):
+        """
+        Create the encoder for an update message, leaving the documents
+        iterator open if C{documents} is not C{None}.
+        """
+        encoder = JavabinEncoder()
+        encoder.writeVersion()
+        encoder.writeTag(0xc0, 4)  # NamedList with 4 entries
+        encoder.writeExternString('params')
+        encoder.writeNamedList(params)
+        encoder.writeExternString('delById')
+        encoder.writeValue(ids)
+        encoder.writeExternString('delByQ')
+        encoder.writeValue(queries)
+        encoder.writeExternString('docs')
+        if documents is None:
+            encoder.writeValue(None)
+        else:
+            encoder.writeIteratorStart()
+        return encoder
+
+    def _addParams(self, overwrite, commitWithin):
+        params = []
+        if overwrite is not None:
+            params.append(('overwrite', 'true' if overwrite else 'false'))
+        if commitWithin is not None:
+            params.append(('commitWithin', str(commitWithin)))
+        return params
+
+    def createAdd(self, document, overwrite=None, commitWithin=None):
+        """
+        Create an add request in javabin format
+        """
+        if isinstance(document, (tuple, list, set)):
+            documents = document
+        else:
+            documents = [document]
+
+        encoder = self._createUpdate(self._addParams(overwrite, commitWithin),
+                                     documents=documents)
+        for doc in documents:
+            encoder.writeInputDocument(doc)
+        encoder.writeEnd()
+        return StringProducer(encoder.flush())
+
+    def createStreamingAdd(self, documents, overwrite=None, commitWithin=None,
+                           chunkSize=65536):
+        """
+        Create an add request in javabin format that is encoded
+        incrementally.
+
+        See L{SimpleXMLInputFactory.createStreamingAdd}.
+        """
+        params = self._addParams(overwrite, commitWithin)
+
+        def generateChunks():
+            encoder = self._createUpdate(params, documents=documents)
+            chunks = []
+            size = 0
+            for doc in documents:
+                encoder.writeInputDocument(doc)
+                chunk = encoder.flush()
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= chunkSize:
+                    yield ''.join(chunks)
+                    chunks = []
+                    size = 0
+            encoder.writeEnd()
+            chunks.append(encoder.flush())
+            yield ''.join(chunks)
+
+        return IterableProducer(generateChunks())
+
+    def createDelete(self, id):
+        if isinstance(id, (tuple, list, set)):
+            ids = id
+        else:
+            ids = [id]
+
+        ids = [unicode(i) if not isinstance(i, basestring) else i
+               for i in ids]
+        return StringProducer(self._createUpdate(ids=ids).flush())
+
+    def createDeleteByQuery(self, query):
+        return StringProducer(self._createUpdate(queries=[query]).flush())
+
+    def _createAction(self, action, **options):
+        params = {action: 'true'}
+        for key, value in options.iteritems():
+            if isinstance(value, bool):
+                params[key] = 'true' if value else 'false'
+            elif value is not None:
+                params[key] = str(value)
+        return StringProducer(self._createUpdate().flush(), params=params)
+
+    def createCommit(self, waitFlush=None,
+                           waitSearcher=None,
+                           expungeDeletes=None):
+        return self._createAction('commit', waitFlush=waitFlush,
+                                  waitSearcher=waitSearcher,
+                                  expungeDeletes=expungeDeletes)
+
+    def createRollback(self):
+        return self._createAction('rollback')
+
+    def createOptimize(self, waitFlush=None,
+                             waitSearcher=None,
+                             maxSegments=None):
+        return self._createAction('optimize', waitFlush=waitFlush,
+                                  waitSearcher=waitSearcher,
+                                  maxSegments=maxSegments)
+
+
+class CSVInputFactory(object):
+    """
+    Creates CSV input messages for Solr.
+
+    CSV is a compact format for adding many flat documents. The values of
+    multi-valued fields are joined with C{multiValueSeparator} and Solr is
+    told to split them using request parameters.
+
+    CSV can't express the other update actions, so deletes, commits,
+    rollbacks and optimizations are created in XML, by a
+    L{SimpleXMLInputFactory}.
+
+    @param multiValueSeparator: The separator used for multi-valued fields.
+    """
+
+    def __init__(self, multiValueSeparator='|'):
+        self.contentType = 'application/csv; charset=utf-8'
+        self.multiValueSeparator = multiValueSeparator
+        self._xml = SimpleXMLInputFactory()
+
+    def _encodeValue(self, value):
+        value = self._xml._encodeValue(value)
+        return value.encode('utf-8')
+
+    def createAdd(self, document, overwrite=None, commitWithin=None):
+        """
+        Create an add request in CSV format
+        """
+        if isinstance(document, (tuple, list, set)):
+            documents = document
+        else:
+            documents = [document]
+
+        fields = set()
+        multiValued = set()
+        for doc in documents:
+            for key, value in doc.iteritems():
+                fields.add(key)
+                if isinstance(value, (tuple, list, set)):
+                    multiValued.add(key)
+        fields = sorted(fields)
+
+        output = StringIO()
+        writer = csv.writer(output, lineterminator='\n')
+        writer.writerow([self._encodeValue(field) for field in fields])
+        for doc in documents:
+            writer.writerow(self._encodeRow(doc, fields, multiValued))
+
+        params = self._addParams(multiValued, overwrite, commitWithin)
+        return StringProducer(output.getvalue(), params=params)
+
+    def _encodeRow(self, doc, fields, multiValued):
+        row = []
+        separator = self.multiValueSeparator
+        for field in fields:
+            value = doc.get(field)
+            if value is None:
+                row.append('')
+            elif field in multiValued:
+                if not isinstance(value, (tuple, list, set)):
+                    value = [value]
+                values = [self._encodeValue(v) for v in value
+                          if v is not None]
+                for v in values:
+                    if separator in v:
+                        raise InputError('Value %r of %r contains the '
+                                         'separator' % (v, field))
+                row.append(separator.join(values))
+            else:
+                row.append(self._encodeValue(value))
+        return row
+
+    def _addParams(self, multiValued, overwrite, commitWithin):
+        params = {}
+        for field in multiValued:
+            params['f.%s.split' % field] = 'true'
+            params['f.%s.separator' % field] = self.multiValueSeparator
+        if overwrite is not None:
+            params['overwrite'] = 'true' if overwrite else 'false'
+        if commitWithin is not None:
+            params['commitWithin'] = str(commitWithin)
+        return params
+
+    def createStreamingAdd(self, documents, overwrite=None, commitWithin=None,
+                           chunkSize=65536):
+        """
+        Create an add request in CSV format that is encoded incrementally.
+
+        The columns and the multi-valued fields have to be known before the
+        body is sent, so they are taken from the first document, which is
+        consumed right away. Documents with other fields, or with lists of
+        values for other fields, make the request fail with L{InputError}.
+
+        See L{SimpleXMLInputFactory.createStreamingAdd}.
+        """
+        documents = iter(documents)
+        first = next(documents, None)
+        if first is None:
+            return IterableProducer(iter([]))
+
+        fields = sorted(first)
+        multiValued = set(key for key, value in first.iteritems()
+                          if isinstance(value, (tuple, list, set)))
+        params = self._addParams(multiValued, overwrite, commitWithin)
+        known = set(fields)
+
+        def generateChunks():
+            output = StringIO()
+            writer = csv.writer(output, lineterminator='\n')
+            writer.writerow([self._encodeValue(field) for field in fields])
+            writer.writerow(self._encodeRow(first, fields, multiValued))
+            for doc in documents:
+                unknown = set(doc) - known
+                if unknown:
+                    raise InputError('Fields %s are not in the first '
+                                     'document' % ', '.join(sorted(unknown)))
+                for field, value in doc.iteritems():
+                    if (isinstance(value, (tuple, list, set)) and
+                            field not in multiValued):
+                        raise InputError('Field %r is not multi-valued in '
+                                         'the first document' % field)
+                writer.writerow(self._encodeRow(doc, fields, multiValued))
+                if output.tell() >= chunkSize:
+                    yield output.getvalue()
+                    output = StringIO()
+                    writer = csv.writer(output, lineterminator='\n')
+            yield output.getvalue()
+
+        return IterableProducer(generateChunks(), params=params)
+
+    def _delegate(self, producer):
+        producer.contentType = self._xml.contentType
+        return producer
+
+    def createDelete(self, id):
+        return self._delegate(self._xml.createDelete(id))
+
+    def createDeleteByQuery(self, query):
+        return self._delegate(self._xml.createDeleteByQuery(query))
+
+    def createCommit(self, waitFlush=None,
+                           waitSearcher=None,
+                           expungeDeletes=None):
+        return self._delegate(self._xml.createCommit(waitFlush, waitSearcher,
+                                                     expungeDeletes))
+
+    def createRollback(self):
+        return self._delegate(self._xml.createRollback())
+
+    def createOptimize(self, waitFlush=None,
+                             waitSearcher=None,
+                             maxSegments=None):
+        return self._delegate(self._xml.createOptimize(waitFlush,
+                                                       waitSearcher,
+                                                       maxSegments))
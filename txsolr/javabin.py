@@ -0,0 +1,509 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Support for javabin, the native binary format of Solr.
+
+This is a port of the parts of C{org.apache.solr.common.util.JavaBinCodec}
+needed by txSolr.
+"""
+import calendar
+import codecs
+import struct
+import time
+from datetime import date, datetime
+
+from txsolr.errors import InputError, SolrResponseError
+
+
+__all__ = ['JavabinEncoder', 'JavabinDecoder']
+
+
+VERSION = 2
+
+# Simple tags, stored in a whole byte.
+NULL = 0
+BOOL_TRUE = 1
+BOOL_FALSE = 2
+BYTE = 3
+SHORT = 4
+DOUBLE = 5
+INT = 6
+LONG = 7
+FLOAT = 8
+DATE = 9
+MAP = 10
+SOLRDOC = 11
+SOLRDOCLST = 12
+BYTEARR = 13
+ITERATOR = 14
+END = 15
+SOLRINPUTDOC = 16
+MAP_ENTRY_ITER = 17
+ENUM_FIELD_VALUE = 18
+MAP_ENTRY = 19
+
+# Tags stored in the 3 most significant bits, the rest of the byte holds a
+# size or a small value.
+TAG_AND_LEN = 1 << 5
+STR = 1 << 5
+SINT = 2 << 5
+SLONG = 3 << 5
+ARR = 4 << 5
+ORDERED_MAP = 5 << 5
+NAMED_LST = 6 << 5
+EXTERN_STRING = 7 << 5
+
+_INT = struct.Struct('>i')
+_LONG = struct.Struct('>q')
+_FLOAT = struct.Struct('>f')
+_DOUBLE = struct.Struct('>d')
+_SHORT = struct.Struct('>h')
+_BYTE = struct.Struct('>b')
+_decodeUTF8 = codecs.utf_8_decode
+
+
+def _toMilliseconds(value):
+    """Convert a naive UTC C{datetime} or a C{date} to epoch milliseconds."""
+    if isinstance(value, datetime):
+        seconds = calendar.timegm(value.utctimetuple())
+        return seconds * 1000 + value.microsecond // 1000
+    return calendar.timegm(value.timetuple()) * 1000
+
+
+class JavabinEncoder(object):
+    """
+    Encodes Python values in javabin format.
+
+    The encoder accumulates the encoded data until L{flush} is called, so a
+    big message can be produced in several chunks. Field names and keys are
+    written as I{extern strings}: after the first time, a repeated name only
+    takes one byte.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._strings = {}
+
+    def flush(self):
+        """Return the data encoded since the last call and forget it."""
+        data = ''.join(self._parts)
+        self._parts = []
+        return data
+
+    def _writeByte(self, value):
+        self._parts.append(chr(value))
+
+    def _writeVInt(self, value):
+        parts = []
+        while value & ~0x7f:
+            parts.append(chr((value & 0x7f) | 0x80))
+            value >>= 7
+        parts.append(chr(value))
+        self._parts.append(''.join(parts))
+
+    def writeTag(self, tag, size=None):
+        """Write a tag, with its size if it's needed."""
+        if tag & 0xe0:
+            if size < 0x1f:
+                self._writeByte(tag | size)
+            else:
+                self._writeByte(tag | 0x1f)
+                self._writeVInt(size - 0x1f)
+        else:
+            self._writeByte(tag)
+            if size is not None:
+                self._writeVInt(size)
+
+    def writeVersion(self):
+        """Write the version byte that starts every javabin message."""
+        self._writeByte(VERSION)
+
+    def writeString(self, value):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        else:
+            try:
+                value.decode('utf-8')
+            except UnicodeError:
+                raise InputError('Unable to decode value %r' % value)
+        self.writeTag(STR, len(value))
+        self._parts.append(value)
+
+    def writeExternString(self, value):
+        """Write a string that is likely to be repeated in the message."""
+        if value is None:
+            self._writeByte(NULL)
+            return
+        index = self._strings.get(value, 0)
+        self.writeTag(EXTERN_STRING, index)
+        if index == 0:
+            self.writeString(value)
+            self._strings[value] = len(self._strings) + 1
+
+    def writeInt(self, value):
+        if value > 0:
+            tag = SINT | (value & 0x0f)
+            if value >= 0x0f:
+                self._writeByte(tag | 0x10)
+                self._writeVInt(value >> 4)
+            else:
+                self._writeByte(tag)
+        else:
+            self._writeByte(INT)
+            self._parts.append(_INT.pack(value))
+
+    def writeLong(self, value):
+        if 0 <= value < (1 << 56):
+            tag = SLONG | (value & 0x0f)
+            if value >= 0x0f:
+                self._writeByte(tag | 0x10)
+                self._writeVInt(value >> 4)
+            else:
+                self._writeByte(tag)
+        else:
+            self._writeByte(LONG)
+            self._parts.append(_LONG.pack(value))
+
+    def writeFloat(self, value):
+        self._writeByte(FLOAT)
+        self._parts.append(_FLOAT.pack(value))
+
+    def writeNamedList(self, pairs):
+        """Write a sequence of C{(name, value)} pairs as a NamedList."""
+        self.writeTag(NAMED_LST, len(pairs))
+        for name, value in pairs:
+            self.writeExternString(name)
+            self.writeValue(value)
+
+    def writeInputDocument(self, document):
+        """Write a C{dict} as a SolrInputDocument."""
+        fields = []
+        for name, value in document.iteritems():
+            if isinstance(value, (tuple, list, set)):
+                value = [v for v in value if v is not None]
+                if not value:
+                    continue
+            elif value is None:
+                continue
+            fields.append((name, value))
+
+        self.writeTag(SOLRINPUTDOC, len(fields))
+        # The document boost.
+        self.writeFloat(1.0)
+        for name, value in fields:
+            self.writeExternString(name)
+            self.writeValue(value)
+
+    def writeIteratorStart(self):
+        self._writeByte(ITERATOR)
+
+    def writeEnd(self):
+        self._writeByte(END)
+
+    def writeValue(self, value):
+        """Write any supported Python value."""
+        if value is None:
+            self._writeByte(NULL)
+        elif isinstance(value, basestring):
+            self.writeString(value)
+        elif isinstance(value, bool):
+            self._writeByte(BOOL_TRUE if value else BOOL_FALSE)
+        elif isinstance(value, (int, long)):
+            if -0x80000000 <= value <= 0x7fffffff:
+                self.writeInt(value)
+            elif -(1 << 63) <= value < (1 << 63):
+                self.writeLong(value)
+            else:
+                raise InputError('Integer out of range %r' % value)
+        elif isinstance(value, float):
+            self._writeByte(DOUBLE)
+            self._parts.append(_DOUBLE.pack(value))
+        elif isinstance(value, (datetime, date)):
+            self._writeByte(DATE)
+            self._parts.append(_LONG.pack(_toMilliseconds(value)))
+        elif isinstance(value, (tuple, list, set)):
+            self.writeTag(ARR, len(value))
+            for v in value:
+                self.writeValue(v)
+        elif isinstance(value, dict):
+            self.writeTag(MAP, len(value))
+            for k, v in value.iteritems():
+                if isinstance(k, basestring):
+                    self.writeExternString(k)
+                else:
+                    self.writeValue(k)
+                self.writeValue(v)
+        else:
+            try:
+                self.writeString(unicode(value))
+            except UnicodeError:
+                raise InputError('Unable to decode value %r' % value)
+
+
+def _formatDate(milliseconds):
+    """Format epoch milliseconds the way the JSON response writer does."""
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    text = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds))
+    if milliseconds:
+        return '%s.%03dZ' % (text, milliseconds)
+    return text + 'Z'
+
+
+def _shortFloat(data):
+    """
+    Convert a 4 bytes float to the shortest Python C{float} that has the same
+    representation, as Java does when printing it.
+    """
+    value = _FLOAT.unpack(data)[0]
+    for precision in (6, 7, 8):
+        candidate = float('%.*g' % (precision, value))
+        if _FLOAT.pack(candidate) == data:
+            return candidate
+    return value
+
+
+class _JavabinReader(object):
+    """
+    Decodes a single javabin message.
+
+    Strings and keys are the most common values, so they are decoded inline
+    instead of using the generic methods.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.strings = []
+
+    def readVInt(self):
+        data = self.data
+        pos = self.pos
+        byte = ord(data[pos])
+        value = byte & 0x7f
+        shift = 7
+        while byte & 0x80:
+            pos += 1
+            byte = ord(data[pos])
+            value |= (byte & 0x7f) << shift
+            shift += 7
+        self.pos = pos + 1
+        return value
+
+    def readSize(self, tag):
+        size = tag & 0x1f
+        if size == 0x1f:
+            size += self.readVInt()
+        return size
+
+    def readSmall(self, tag):
+        value = tag & 0x0f
+        if tag & 0x10:
+            value |= self.readVInt() << 4
+        return value
+
+    def readBytes(self, size):
+        pos = self.pos
+        self.pos = pos + size
+        return self.data[pos:self.pos]
+
+    def readString(self, tag):
+        size = tag & 0x1f
+        if size == 0x1f:
+            size += self.readVInt()
+        pos = self.pos
+        self.pos = end = pos + size
+        return _decodeUTF8(self.data[pos:end], 'strict', True)[0]
+
+    def readExternString(self, tag):
+        index = tag & 0x1f
+        if index == 0x1f:
+            index += self.readVInt()
+        if index:
+            return self.strings[index - 1]
+        string = self.readValue()
+        self.strings.append(string)
+        return string
+
+    def readKey(self):
+        """Read a key of a map or NamedList, usually an extern string."""
+        tag = ord(self.data[self.pos])
+        self.pos += 1
+        kind = tag & 0xe0
+        if kind == EXTERN_STRING:
+            index = tag & 0x1f
+            if index and index != 0x1f:
+                return self.strings[index - 1]
+            return self.readExternString(tag)
+        if kind == STR:
+            return self.readString(tag)
+        self.pos -= 1
+        return self.readValue()
+
+    def readMap(self, size):
+        result = {}
+        readKey = self.readKey
+        readValue = self.readValue
+        for _ in xrange(size):
+            key = readKey()
+            result[key] = readValue()
+        return result
+
+    def readFlatList(self, size):
+        result = []
+        for _ in xrange(size):
+            result.append(self.readKey())
+            result.append(self.readValue())
+        return result
+
+    def readArray(self, size):
+        readValue = self.readValue
+        return [readValue() for _ in xrange(size)]
+
+    def readDocument(self):
+        tag = ord(self.data[self.pos])
+        self.pos += 1
+        if tag & 0xe0 not in (ORDERED_MAP, NAMED_LST):
+            raise SolrResponseError('Wrong javabin document')
+        return self.readMap(self.readSize(tag))
+
+    def readDocumentList(self):
+        header = self.readValue()
+        docs = self.readValue()
+        result = {'numFound': header[0], 'start': header[1], 'docs': docs}
+        if header[2] is not None:
+            result['maxScore'] = header[2]
+        return result
+
+    def readIterator(self):
+        result = []
+        data = self.data
+        while ord(data[self.pos]) != END:
+            result.append(self.readValue())
+        self.pos += 1
+        return result
+
+    def readValue(self):
+        data = self.data
+        pos = self.pos
+        tag = ord(data[pos])
+        self.pos = pos + 1
+
+        kind = tag & 0xe0
+        if kind:
+            if kind == STR:
+                size = tag & 0x1f
+                if size == 0x1f:
+                    size += self.readVInt()
+                pos = self.pos
+                self.pos = end = pos + size
+                return _decodeUTF8(data[pos:end], 'strict', True)[0]
+            elif kind == EXTERN_STRING:
+                return self.readExternString(tag)
+            elif kind == SINT or kind == SLONG:
+                value = tag & 0x0f
+                if tag & 0x10:
+                    value |= self.readVInt() << 4
+                return value
+            elif kind == ARR:
+                return self.readArray(self.readSize(tag))
+            elif kind == ORDERED_MAP:
+                return self.readMap(self.readSize(tag))
+            else:
+                return self.readFlatList(self.readSize(tag))
+
+        if tag == NULL:
+            return None
+        elif tag == BOOL_TRUE:
+            return True
+        elif tag == BOOL_FALSE:
+            return False
+        elif tag == SOLRDOC:
+            return self.readDocument()
+        elif tag == DATE:
+            return _formatDate(_LONG.unpack(self.readBytes(8))[0])
+        elif tag == INT:
+            return _INT.unpack(self.readBytes(4))[0]
+        elif tag == LONG:
+            return _LONG.unpack(self.readBytes(8))[0]
+        elif tag == FLOAT:
+            return _shortFloat(self.readBytes(4))
+        elif tag == DOUBLE:
+            return _DOUBLE.unpack(self.readBytes(8))[0]
+        elif tag == SOLRDOCLST:
+            return self.readDocumentList()
+        elif tag == MAP:
+            return self.readMap(self.readVInt())
+        elif tag == ITERATOR:
+            return self.readIterator()
+        elif tag == SHORT:
+            return _SHORT.unpack(self.readBytes(2))[0]
+        elif tag == BYTE:
+            return _BYTE.unpack(self.readBytes(1))[0]
+        elif tag == BYTEARR:
+            return self.readBytes(self.readVInt())
+        elif tag == SOLRINPUTDOC:
+            size = self.readVInt()
+            self.readValue()  # The document boost.
+            return self.readMap(size)
+        elif tag == ENUM_FIELD_VALUE:
+            self.readValue()  # The ordinal of the value.
+            return self.readValue()
+        elif tag == MAP_ENTRY:
+            return (self.readKey(), self.readValue())
+        elif tag == MAP_ENTRY_ITER:
+            result = {}
+            while ord(data[self.pos]) != END:
+                key = self.readKey()
+                result[key] = self.readValue()
+            self.pos += 1
+            return result
+
+        raise SolrResponseError('Unknown javabin tag %d' % tag)
+
+
+class JavabinDecoder(object):
+    """
+    Decodes javabin responses into the same structures the JSON response
+    writer produces with the default C{json.nl=flat}: maps become C{dict}s,
+    NamedLists become flat lists of names and values (except the top level
+    one, which becomes a C{dict}), document lists become C{dict}s with
+    C{numFound}, C{start}, C{maxScore} and C{docs}, and dates become
+    ISO 8601 strings.
+    """
+
+    def decode(self, data):
+        """
+        Decode a javabin message.
+
+        @raise ValueError: If the message is not valid javabin.
+        """
+        if not data or ord(data[0]) != VERSION:
+            raise ValueError('Unknown javabin version')
+        reader = _JavabinReader(data)
+        reader.pos = 1
+        try:
+            tag = ord(data[1])
+            if tag & 0xe0 in (NAMED_LST, ORDERED_MAP):
+                reader.pos = 2
+                result = reader.readMap(reader.readSize(tag))
+            else:
+                result = reader.readValue()
+        except (IndexError, struct.error, UnicodeError, SolrResponseError), e:
+            raise ValueError('Invalid javabin message: %s' % e)
+        if reader.pos != len(data):
+            raise ValueError('Unexpected data after javabin message')
+        return result
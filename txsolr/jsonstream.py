@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Incremental parsing of JSON Solr responses.
+
+The parser in this module extracts the documents of a response while the
+body is still arriving, so the documents can be processed one at a time
+without keeping the whole body in memory.
+"""
+import json
+import re
+
+from txsolr.errors import SolrResponseError
+
+
+__all__ = ['DocumentStreamParser']
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_STRING = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_SCALAR = re.compile(r'[^ \t\n\r{}\[\]:,"]+')
+_STRUCTURE = re.compile(r'[{}\[\]"]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+
+class DocumentStreamParser(object):
+    """
+    Incremental parser for JSON Solr responses.
+
+    The body is given in chunks using L{feed}. Each call to L{nextDocument}
+    returns the next complete document found in the array given by C{path}.
+    Everything else in the response is kept as a I{skeleton}: the original
+    body with an empty documents array, which is available from L{skeleton}
+    once L{end} has been called and all the documents were consumed.
+
+    @param path: The sequence of keys that leads to the documents array.
+    """
+
+    def __init__(self, path=('response', 'docs')):
+        self.path = tuple(path)
+        self._decoder = json.JSONDecoder()
+
+        self._buffer = ''
+        self._pos = 0
+        self._mark = 0
+        self._parts = []
+        self._ended = False
+
+        # Each frame of the stack is [kind, key, state]
+        self._stack = []
+        self._complete = False
+
+        self._inDocs = False
+        self._docStart = None
+        self._scanPos = 0
+        self._depth = 0
+        self._inString = False
+
+    def feed(self, data):
+        """Add a chunk of the body to the parser."""
+        self._compact()
+        self._buffer += data
+
+    def end(self):
+        """Tell the parser that the whole body has been given."""
+        self._ended = True
+
+    def nextDocument(self):
+        """
+        Parse the available data up to the next document.
+
+        @return: The decoded document, or C{None} if more data is needed.
+        """
+        while True:
+            if self._inDocs:
+                if self._docStart is None:
+                    if not self._startDocument():
+                        return None
+                    continue
+
+                end = self._scanDocument()
+                if end is None:
+                    return None
+                return self._decodeDocument(end)
+
+            if not self._parseToken():
+                return None
+
+    def skeleton(self):
+        """
+        Return the body of the response without the documents.
+
+        @raise SolrResponseError: If the body is truncated or there are still
+            documents to be consumed.
+        """
+        if (not self._ended or not self._complete or self._inDocs or
+            self._stack):
+            raise SolrResponseError('Truncated response')
+        self._parts.append(self._buffer[self._mark:])
+        self._buffer = ''
+        self._pos = self._mark = 0
+        return ''.join(self._parts)
+
+    def _compact(self):
+        """Move the parsed data to the skeleton and discard it."""
+        if self._docStart is not None:
+            keep = self._docStart
+        else:
+            keep = self._pos
+
+        if not self._inDocs:
+            self._parts.append(self._buffer[self._mark:keep])
+
+        if keep:
+            self._buffer = self._buffer[keep:]
+            self._pos -= keep
+            self._scanPos -= keep
+            if self._docStart is not None:
+                self._docStart -= keep
+        self._mark = 0
+
+    def _nextToken(self):
+        buffer = self._buffer
+        pos = _WHITESPACE.match(buffer, self._pos).end()
+        self._pos = pos
+        if pos >= len(buffer):
+            return None
+
+        char = buffer[pos]
+        if char in '{}[]:,':
+            self._pos = pos + 1
+            return char
+
+        if char == '"':
+            match = _STRING.match(buffer, pos)
+            if match is None:
+                if self._ended:
+                    raise SolrResponseError('Unterminated string')
+                return None
+        else:
+            match = _SCALAR.match(buffer, pos)
+            if match.end() == len(buffer) and not self._ended:
+                return None
+
+        self._pos = match.end()
+        return match.group()
+
+    def _valueDone(self):
+        if self._stack:
+            frame = self._stack[-1]
+            if frame[0] == '{':
+                frame[2] = 'comma'
+        else:
+            self._complete = True
+
+    def _atDocuments(self):
+        stack = self._stack
+        if len(stack) != len(self.path):
+            return False
+        for (kind, key, _), expected in zip(stack, self.path):
+            if kind != '{' or key != expected:
+                return False
+        return True
+
+    def _parseToken(self):
+        token = self._nextToken()
+        if token is None:
+            return False
+
+        stack = self._stack
+        if token == '{':
+            stack.append(['{', None, 'key'])
+        elif token == '[':
+            if self._atDocuments():
+                self._inDocs = True
+                self._parts.append(self._buffer[self._mark:self._pos])
+            stack.append(['[', None, None])
+        elif token in '}]':
+            if not stack:
+                raise SolrResponseError('Unbalanced response')
+            stack.pop()
+            self._valueDone()
+        elif token == ':':
+            if stack:
+                stack[-1][2] = 'value'
+        elif token == ',':
+            if stack and stack[-1][0] == '{':
+                stack[-1][2] = 'key'
+        elif token[0] == '"' and stack and stack[-1][2] == 'key':
+            stack[-1][1] = self._decoder.decode(token)
+            stack[-1][2] = 'colon'
+        else:
+            self._valueDone()
+        return True
+
+    def _startDocument(self):
+        """Find the beginning of the next document or the end of the array."""
+        buffer = self._buffer
+        while True:
+            pos = _WHITESPACE.match(buffer, self._pos).end()
+            self._pos = pos
+            if pos >= len(buffer):
+                if self._ended:
+                    raise SolrResponseError('Truncated response')
+                return False
+
+            char = buffer[pos]
+            if char == ',':
+                self._pos = pos + 1
+            elif char == ']':
+                self._mark = pos
+                self._pos = pos + 1
+                self._inDocs = False
+                self._stack.pop()
+                self._valueDone()
+                return True
+            elif char == '{':
+                self._docStart = self._scanPos = pos
+                self._depth = 0
+                self._inString = False
+                return True
+            else:
+                raise SolrResponseError('Unexpected document: %r' % char)
+
+    def _scanDocument(self):
+        """
+        Look for the end of the current document.
+
+        @return: The position after the end of the document, or C{None} if
+            more data is needed.
+        """
+        buffer = self._buffer
+        pos = self._scanPos
+        depth = self._depth
+        inString = self._inString
+        end = None
+
+        while True:
+            if inString:
+                match = _STRING_SPECIAL.search(buffer, pos)
+                if match is None:
+                    pos = len(buffer)
+                    break
+                pos = match.start()
+                if buffer[pos] == '\\':
+                    if pos + 1 >= len(buffer):
+                        break
+                    pos += 2
+                else:
+                    inString = False
+                    pos += 1
+                continue
+
+            match = _STRUCTURE.search(buffer, pos)
+            if match is None:
+                pos = len(buffer)
+                break
+            pos = match.end()
+            char = match.group()
+            if char == '"':
+                inString = True
+            elif char in '{[':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    end = pos
+                    break
+
+        self._scanPos = pos
+        self._depth = depth
+        self._inString = inString
+        if end is None and self._ended:
+            raise SolrResponseError('Truncated response')
+        return end
+
+    def _decodeDocument(self, end):
+        text = self._buffer[self._docStart:end]
+        self._pos = end
+        self._docStart = None
+        try:
+            return self._decoder.decode(text)
+        except ValueError:
+            raise SolrResponseError('Unable to decode document %r' % text)
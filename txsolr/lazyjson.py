@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+On demand decoding of JSON documents.
+
+The containers in this module decode the members of a JSON object or the
+items of a JSON array in order, only as far as needed to answer what is
+asked. Every container works on the same body string using offsets, so no
+part of the body is copied.
+"""
+import re
+from collections import Mapping
+
+from txsolr.errors import SolrResponseError
+
+
+__all__ = ['LazyObject', 'LazyArray', 'plain']
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+_MISSING = object()
+
+
+def _skip(body, pos):
+    return _WHITESPACE.match(body, pos).end()
+
+
+def _opening(body, pos, char):
+    """Check that a container starts at C{pos} and return the next offset."""
+    if body[pos:pos + 1] != char:
+        raise SolrResponseError('Expected %r at offset %d' % (char, pos))
+    return pos + 1
+
+
+def plain(value):
+    """Convert a value with lazy containers to plain C{dict}s and C{list}s."""
+    if isinstance(value, LazyObject):
+        return dict((key, plain(v)) for key, v in value.iteritems())
+    if isinstance(value, LazyArray):
+        return [plain(v) for v in value]
+    if isinstance(value, Mapping) and not isinstance(value, dict):
+        return dict(value.iteritems())
+    return value
+
+
+class LazyArray(object):
+    """
+    A JSON array whose items are decoded one at a time, when they are needed.
+
+    @param body: The C{str} containing the array.
+    @param pos: The offset of the opening bracket.
+    @param decoder: The L{json.JSONDecoder} used to decode the items.
+    @param wrap: Optionally, a callable applied to each decoded item.
+    """
+
+    def __init__(self, body, pos, decoder, wrap=None):
+        self._body = body
+        self._pos = _opening(body, pos, '[')
+        self._decoder = decoder
+        self._wrap = wrap
+        self._items = []
+        self._end = None
+
+    def _decodeNext(self):
+        body = self._body
+        pos = _skip(body, self._pos)
+        char = body[pos:pos + 1]
+        if char == ']':
+            self._end = pos + 1
+            self._body = None
+            return
+        if self._items:
+            if char != ',':
+                raise SolrResponseError('Expected "," at offset %d' % pos)
+            pos = _skip(body, pos + 1)
+
+        try:
+            value, self._pos = self._decoder.raw_decode(body, pos)
+        except ValueError, e:
+            raise SolrResponseError('Unable to decode item: %s' % e)
+        if self._wrap is not None:
+            value = self._wrap(value)
+        self._items.append(value)
+
+    def end(self):
+        """Decode the rest of the array and return the offset after it."""
+        while self._end is None:
+            self._decodeNext()
+        return self._end
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if (index.stop is None or index.stop < 0 or
+                (index.start is not None and index.start < 0)):
+                self.end()
+            else:
+                self._decodeUntil(index.stop)
+        elif index < 0:
+            self.end()
+        else:
+            self._decodeUntil(index + 1)
+        return self._items[index]
+
+    def _decodeUntil(self, count):
+        while len(self._items) < count and self._end is None:
+            self._decodeNext()
+
+    def __len__(self):
+        self.end()
+        return len(self._items)
+
+    def __iter__(self):
+        index = 0
+        items = self._items
+        while True:
+            if index < len(items):
+                yield items[index]
+                index += 1
+            elif self._end is None:
+                self._decodeNext()
+            else:
+                return
+
+    def __eq__(self, other):
+        return list(self) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class LazyObject(object):
+    """
+    A JSON object whose members are decoded in order, when they are needed.
+
+    Members whose name is in C{lazyMembers} are not decoded either: they
+    become lazy containers themselves.
+
+    @param body: The C{str} containing the object.
+    @param pos: The offset of the opening brace.
+    @param decoder: The L{json.JSONDecoder} used to decode the members.
+    @param lazyMembers: A C{dict} mapping member names to callables that
+        receive C{body}, the offset of the value and C{decoder}, and return a
+        lazy container.
+    """
+
+    def __init__(self, body, pos, decoder, lazyMembers=None):
+        self._body = body
+        self._pos = _opening(body, pos, '{')
+        self._decoder = decoder
+        self._lazyMembers = lazyMembers or {}
+        self._members = {}
+        self._keys = []
+        self._pending = None
+        self._end = None
+
+    def _decodeNext(self):
+        body = self._body
+        if self._pending is not None:
+            self._pos = self._pending.end()
+            self._pending = None
+
+        pos = _skip(body, self._pos)
+        char = body[pos:pos + 1]
+        if char == '}':
+            self._end = pos + 1
+            self._body = None
+            return
+        if self._keys:
+            if char != ',':
+                raise SolrResponseError('Expected "," at offset %d' % pos)
+            pos = _skip(body, pos + 1)
+
+        decoder = self._decoder
+        try:
+            if body[pos:pos + 1] != '"':
+                raise ValueError('Expected a name at offset %d' % pos)
+            key, pos = decoder.raw_decode(body, pos)
+            pos = _skip(body, pos)
+            if body[pos:pos + 1] != ':':
+                raise ValueError('Expected ":" at offset %d' % pos)
+            pos = _skip(body, pos + 1)
+
+            factory = self._lazyMembers.get(key)
+            if factory is not None:
+                value = self._pending = factory(body, pos, decoder)
+            else:
+                value, pos = decoder.raw_decode(body, pos)
+        except ValueError, e:
+            raise SolrResponseError('Unable to decode member: %s' % e)
+
+        self._members[key] = value
+        self._keys.append(key)
+        self._pos = pos
+
+    def end(self):
+        """Decode the rest of the object and return the offset after it."""
+        while self._end is None:
+            self._decodeNext()
+        return self._end
+
+    def get(self, key, default=None):
+        while key not in self._members and self._end is None:
+            self._decodeNext()
+        return self._members.get(key, default)
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def keys(self):
+        self.end()
+        return list(self._keys)
+
+    def iteritems(self):
+        for key in self.keys():
+            yield key, self._members[key]
+
+    def __len__(self):
+        self.end()
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __repr__(self):
+        return repr(plain(self))
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Limits the number of concurrent requests, with priorities.
+"""
+import logging
+from collections import deque
+
+from twisted.internet.defer import Deferred, fail, maybeDeferred
+from twisted.python.failure import Failure
+
+from txsolr.errors import RequestQueueFull
+
+
+__all__ = ['RequestLimiter', 'QUERY', 'UPDATE', 'ADMIN']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+# Priorities of the requests, from the most to the least urgent.
+QUERY = 0
+UPDATE = 1
+ADMIN = 2
+
+_PRIORITIES = (QUERY, UPDATE, ADMIN)
+
+
+class RequestLimiter(object):
+    """
+    Runs at most C{maxConcurrent} requests at the same time.
+
+    The requests that can't run wait in a FIFO queue for their priority.
+    When a request finishes, the oldest request of the most urgent priority
+    is started: queries go before updates, and updates before admin actions
+    like optimize.
+
+    @ivar active: The number of requests running.
+
+    @param maxConcurrent: The maximum number of requests running at the same
+        time.
+    @param maxQueued: The maximum number of requests waiting in each queue.
+        Either an C{int} for all the priorities or a C{dict} mapping
+        priorities to C{int}s. C{None} means no limit. When a queue is full,
+        new requests of its priority fail with L{RequestQueueFull}.
+    """
+
+    def __init__(self, maxConcurrent=10, maxQueued=None):
+        if maxConcurrent < 1:
+            raise ValueError('maxConcurrent must be a positive number')
+        if not isinstance(maxQueued, dict):
+            maxQueued = dict((priority, maxQueued)
+                             for priority in _PRIORITIES)
+
+        self.maxConcurrent = maxConcurrent
+        self.maxQueued = maxQueued
+        self.active = 0
+        self._queues = dict((priority, deque()) for priority in _PRIORITIES)
+
+    def queued(self, priority=None):
+        """
+        @return: The number of requests waiting with the given priority, or
+            with any priority if it's C{None}.
+        """
+        if priority is None:
+            return sum(len(queue) for queue in self._queues.itervalues())
+        return len(self._queues[priority])
+
+    def run(self, priority, request):
+        """
+        Call C{request} when there is a free slot.
+
+        @param priority: One of L{QUERY}, L{UPDATE} or L{ADMIN}.
+        @param request: A callable returning a L{Deferred}. The slot is
+            released when the L{Deferred} fires.
+        @return: A L{Deferred} that fires with the result of the request.
+            Cancelling it before the request starts removes it from the
+            queue, and after cancels the L{Deferred} of the request.
+        """
+        if self.active < self.maxConcurrent and not self.queued():
+            return self._start(request)
+
+        queue = self._queues[priority]
+        limit = self.maxQueued.get(priority)
+        if limit is not None and len(queue) >= limit:
+            return fail(RequestQueueFull('Too many requests waiting with '
+                                         'priority %d' % priority))
+
+        def cancel(waiter):
+            if started:
+                started[0].cancel()
+            else:
+                queue.remove(entry)
+
+        # Holds the Deferred of the request once it's started.
+        started = []
+        waiter = Deferred(cancel)
+        entry = (waiter, request, started)
+        queue.append(entry)
+        _logger.debug('Request queued with priority %d, %d waiting' %
+                      (priority, len(queue)))
+        return waiter
+
+    def _start(self, request):
+        self.active += 1
+        return maybeDeferred(request).addBoth(self._release)
+
+    def _release(self, result):
+        self.active -= 1
+        self._startNext()
+        return result
+
+    def _relay(self, result, waiter):
+        """Give the result of a started request to its waiter."""
+        if waiter.called:
+            # The waiter was cancelled, and the request failed or finished
+            # later.
+            return None
+        if isinstance(result, Failure):
+            waiter.errback(result)
+        else:
+            waiter.callback(result)
+
+    def _startNext(self):
+        while self.active < self.maxConcurrent:
+            for priority in _PRIORITIES:
+                queue = self._queues[priority]
+                if queue:
+                    waiter, request, started = queue.popleft()
+                    d = self._start(request)
+                    started.append(d)
+                    d.addBoth(self._relay, waiter)
+                    break
+            else:
+                return
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Helpers to log requests without slowing them down.
+
+Bodies can be huge, so they are never formatted in the normal debug
+messages. They are only dumped by a L{BodyDump}, for a sample of the
+requests, truncated and with the secrets redacted.
+"""
+import random
+import re
+
+
+__all__ = ['BodyDump', 'clip', 'truncate', 'redact', 'SECRETS']
+
+
+# Values of parameters or fields that look like secrets, in URLs, forms,
+# JSON and XML.
+SECRETS = re.compile(
+    r'''((?:password|passwd|secret|token|api[_-]?key)'''
+    r'''(?:["']?\s*[=:]\s*["']?|">))'''
+    r'''([^&"'\s<,}]+)''', re.IGNORECASE)
+
+
+def truncate(text, limit):
+    """
+    Cut a text to C{limit} characters, saying how much was left out.
+
+    @param text: A C{str}.
+    @param limit: The maximum length kept, or C{None} for no limit.
+    """
+    if limit is None or len(text) <= limit:
+        return text
+    return '%s... (%d more bytes)' % (text[:limit], len(text) - limit)
+
+
+def redact(text, pattern=SECRETS):
+    """
+    Hide the values that look like secrets.
+
+    @param text: A C{str}.
+    @param pattern: A compiled regular expression with two groups: the name
+        of the secret, kept, and its value, hidden.
+    """
+    if pattern is None:
+        return text
+    return pattern.sub(r'\1***', text)
+
+
+def clip(text, limit, pattern=SECRETS):
+    """
+    Prepare a text for the log: truncate it and redact the part kept.
+
+    @param text: A C{str}.
+    @param limit: The maximum length kept, or C{None} for no limit.
+    @param pattern: The secrets to redact. See L{redact}.
+    """
+    if limit is None or len(text) <= limit:
+        return redact(text, pattern)
+    return '%s... (%d more bytes)' % (redact(text[:limit], pattern),
+                                      len(text) - limit)
+
+
+class BodyDump(object):
+    """
+    Dumps the bodies of a sample of the requests and responses to the debug
+    log.
+
+    Only requests sent while the C{txsolr} logger has the C{DEBUG} level
+    enabled are considered.
+
+    @param rate: The fraction of the requests dumped, between 0 and 1.
+    @param maxBytes: The maximum number of bytes of each body that are
+        dumped, or C{None} for no limit.
+    @param pattern: A compiled regular expression that finds secrets to
+        redact, like L{SECRETS}, or C{None} to dump the bodies as they are.
+    @param random: A callable returning a random C{float} in [0, 1).
+    """
+
+    def __init__(self, rate=0.01, maxBytes=4096, pattern=SECRETS,
+                 random=random.random):
+        self.rate = rate
+        self.maxBytes = maxBytes
+        self.pattern = pattern
+        self._random = random
+
+    def sample(self):
+        """@return: C{True} if the next request should be dumped."""
+        return self._random() < self.rate
+
+    def format(self, body):
+        """@return: The truncated and redacted body, ready to be logged."""
+        return clip(body, self.maxBytes, self.pattern)
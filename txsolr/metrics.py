@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Timing and metrics of the requests.
+
+The client reports a L{RequestRecord} for every request to an object
+providing L{IRequestObserver}. L{RequestMetrics} keeps histograms of the
+records in memory, and L{toPrometheus} exports them in the text format of
+Prometheus.
+"""
+from bisect import bisect_left
+
+from zope.interface import Interface, implements
+
+
+__all__ = ['IRequestObserver', 'RequestRecord', 'Histogram',
+           'RequestMetrics', 'toPrometheus', 'PHASES']
+
+
+# The phases of a request, in the order they happen. qTime is the time
+# reported by Solr in the header of the response.
+PHASES = ('connect', 'firstByte', 'transfer', 'decode', 'total', 'qTime')
+
+
+class IRequestObserver(Interface):
+    """An object that receives the records of the requests of a client."""
+
+    def requestDone(record):
+        """
+        Called when a request is finished, successfully or not.
+
+        @param record: A L{RequestRecord}.
+        """
+
+
+def _elapsed(start, end):
+    if start is None or end is None:
+        return None
+    return end - start
+
+
+class RequestRecord(object):
+    """
+    The timing of a request, split in phases, and its sizes.
+
+    Times are in seconds. The phases that didn't happen, like the transfer
+    of a request that failed to connect, are C{None}.
+
+    @ivar url: The base URL of the Solr node.
+    @ivar method: The HTTP method.
+    @ivar handler: The path of the request, without the query string, like
+        C{'/select'}.
+    @ivar status: The HTTP status code, or C{None} if there was no response.
+    @ivar error: The name of the exception class if the request failed.
+    @ivar reused: C{True} if the connection came from the pool.
+    @ivar bytesSent: The size of the body of the request, if it's known.
+    @ivar bytesReceived: The size of the body of the response, after
+        decompressing it.
+    @ivar qTime: The C{QTime} reported by Solr, in milliseconds.
+    @ivar started: The time the request started.
+    @ivar connected: The time the connection was ready.
+    @ivar headersReceived: The time the headers of the response arrived.
+    @ivar finished: The time the request finished.
+    @ivar decode: The time spent decoding the body of the response.
+    """
+
+    __slots__ = ('url', 'method', 'handler', 'status', 'error', 'reused',
+                 'bytesSent', 'bytesReceived', 'qTime', 'started',
+                 'connected', 'headersReceived', 'finished', 'decode')
+
+    def __init__(self, url, method, handler, started):
+        self.url = url
+        self.method = method
+        self.handler = handler
+        self.started = started
+        self.status = None
+        self.error = None
+        self.reused = None
+        self.bytesSent = None
+        self.bytesReceived = None
+        self.qTime = None
+        self.connected = None
+        self.headersReceived = None
+        self.finished = None
+        self.decode = None
+
+    @property
+    def connect(self):
+        """The time spent resolving the host and connecting."""
+        return _elapsed(self.started, self.connected)
+
+    @property
+    def firstByte(self):
+        """The time from the connection to the headers of the response."""
+        return _elapsed(self.connected, self.headersReceived)
+
+    @property
+    def transfer(self):
+        """The time receiving the body of the response, without decoding."""
+        transfer = _elapsed(self.headersReceived, self.finished)
+        if transfer is not None and self.decode is not None:
+            transfer = max(0.0, transfer - self.decode)
+        return transfer
+
+    @property
+    def total(self):
+        """The time from the start to the end of the request."""
+        return _elapsed(self.started, self.finished)
+
+    def phases(self):
+        """
+        @return: A C{dict} mapping the names of the phases that happened to
+            their duration in seconds.
+        """
+        phases = {}
+        for name in PHASES:
+            if name == 'qTime':
+                value = self.qTime
+                if value is not None:
+                    value = value / 1000.0
+            else:
+                value = getattr(self, name)
+            if value is not None:
+                phases[name] = value
+        return phases
+
+
+class Histogram(object):
+    """
+    A histogram with fixed buckets.
+
+    @ivar buckets: The upper bounds of the buckets, in increasing order.
+    @ivar counts: The number of values in each bucket, and a last one for
+        the values above all the bounds. They are not cumulative.
+    @ivar count: The number of values.
+    @ivar sum: The sum of the values.
+    """
+
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                       0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        Estimate a quantile, interpolating inside its bucket.
+
+        @param q: The quantile, between 0 and 1.
+        @return: The estimated value, or C{None} if there are no values.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                low = self.buckets[i - 1] if i else 0.0
+                return low + (self.buckets[i] - low) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class RequestMetrics(object):
+    """
+    Keeps histograms of the phases of the requests, and counters of the
+    requests and bytes, by handler.
+
+    @ivar histograms: A C{dict} mapping C{(handler, phase)} to L{Histogram}.
+    @ivar requests: A C{dict} mapping C{(handler, status)} to the number of
+        requests. The status is the HTTP code or the name of the error.
+    @ivar bytes: A C{dict} mapping C{(handler, direction)} to the number of
+        bytes, where the direction is C{'sent'} or C{'received'}.
+
+    @param buckets: The bounds of the buckets of the histograms.
+    """
+
+    implements(IRequestObserver)
+
+    def __init__(self, buckets=Histogram.DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.requests = {}
+        self.bytes = {}
+
+    def requestDone(self, record):
+        handler = record.handler
+        for phase, value in record.phases().iteritems():
+            histogram = self.histograms.get((handler, phase))
+            if histogram is None:
+                histogram = Histogram(self.buckets)
+                self.histograms[(handler, phase)] = histogram
+            histogram.observe(value)
+
+        if record.status is not None:
+            status = str(record.status)
+        else:
+            status = record.error or 'unknown'
+        key = (handler, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+        for direction, size in (('sent', record.bytesSent),
+                                ('received', record.bytesReceived)):
+            if size:
+                key = (handler, direction)
+                self.bytes[key] = self.bytes.get(key, 0) + size
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _labels(**labels):
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value))
+                             for name, value in sorted(labels.iteritems()))
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def toPrometheus(metrics, prefix='txsolr'):
+    """
+    Export L{RequestMetrics} in the text exposition format of Prometheus.
+
+    @param metrics: A L{RequestMetrics}.
+    @param prefix: The prefix of the names of the metrics.
+    @return: A C{str}.
+    """
+    lines = []
+    name = prefix + '_request_phase_seconds'
+    lines.append('# HELP %s Time spent in each phase of the requests.' %
+                 name)
+    lines.append('# TYPE %s histogram' % name)
+    for (handler, phase), histogram in sorted(metrics.histograms.items()):
+        cumulative = 0
+        bounds = [_number(bound) for bound in histogram.buckets] + ['+Inf']
+        for bound, count in zip(bounds, histogram.counts):
+            cumulative += count
+            lines.append('%s_bucket%s %d' % (
+                name, _labels(handler=handler, phase=phase, le=bound),
+                cumulative))
+        labels = _labels(handler=handler, phase=phase)
+        lines.append('%s_sum%s %s' % (name, labels, _number(histogram.sum)))
+        lines.append('%s_count%s %d' % (name, labels, histogram.count))
+
+    name = prefix + '_requests_total'
+    lines.append('# HELP %s Requests by handler and status.' % name)
+    lines.append('# TYPE %s counter' % name)
+    for (handler, status), count in sorted(metrics.requests.items()):
+        lines.append('%s%s %d' % (name, _labels(handler=handler,
+                                                status=status), count))
+
+    name = prefix + '_body_bytes_total'
+    lines.append('# HELP %s Bytes of the bodies of requests and responses.' %
+                 name)
+    lines.append('# TYPE %s counter' % name)
+    for (handler, direction), count in sorted(metrics.bytes.items()):
+        lines.append('%s%s %d' % (name, _labels(handler=handler,
+                                                direction=direction), count))
+    return '\n'.join(lines) + '\n'
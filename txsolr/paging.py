@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Iteration over large result sets.
+
+Deep paging with a growing C{start} gets slower with every page because Solr
+has to collect and skip all the previous documents. Solr 4.7 and newer
+support I{cursors} (the C{cursorMark} parameter) that avoid this cost. The
+L{SearchIterator} uses cursors when possible and falls back to C{start}
+based paging with older servers.
+"""
+import logging
+from collections import deque
+
+from twisted.internet.defer import DeferredLock, fail, maybeDeferred, succeed
+from twisted.python.failure import Failure
+
+
+__all__ = ['SearchIterator']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+class SearchIterator(object):
+    """
+    Lazily walks over all the documents matching a query, page by page.
+
+    Pages are only requested when they are about to be consumed: at most
+    C{prefetch} pages are fetched ahead of the page being consumed, so a slow
+    consumer does not make the iterator accumulate results in memory.
+
+    With cursors each page depends on the previous one, so only one page can
+    be in flight. With C{start} based paging up to C{prefetch} pages are
+    requested concurrently.
+
+    @ivar numFound: The total number of documents matching the query, or
+        C{None} if the first page has not arrived yet.
+
+    @param client: The L{SolrClient} used to perform the queries.
+    @param query: A C{unicode} query.
+    @param params: A C{dict} with additional query parameters.
+    @param rows: The number of documents of each page.
+    @param prefetch: The number of pages fetched ahead of the page being
+        consumed.
+    @param cursor: If C{True}, use C{cursorMark} deep paging if the server
+        supports it.
+    @param uniqueKey: The name of the unique key field of the schema. Cursors
+        need the sort to include it.
+    """
+
+    def __init__(self, client, query, params=None, rows=100, prefetch=1,
+                 cursor=True, uniqueKey='id'):
+        if rows < 1:
+            raise ValueError('rows must be a positive number')
+        if prefetch < 0:
+            raise ValueError('prefetch must not be negative')
+
+        self.numFound = None
+        self.rows = rows
+        self.prefetch = prefetch
+
+        self._client = client
+        self._query = query
+        self._params = dict(params or {})
+        self._start = int(self._params.pop('start', 0))
+        self._cursor = cursor and self._start == 0
+
+        if self._cursor:
+            sort = self._params.get('sort')
+            if not sort:
+                self._params['sort'] = '%s asc' % uniqueKey
+            elif uniqueKey not in [part.split()[0]
+                                   for part in sort.split(',')]:
+                self._params['sort'] = '%s, %s asc' % (sort, uniqueKey)
+            self._cursorMark = '*'
+        else:
+            self._cursorMark = None
+        # Only the query, start and cursorMark change between pages.
+        self._prepared = client.prepare(rows=rows, **self._params)
+
+        self._pages = {}
+        self._requested = 0
+        self._inFlight = 0
+        self._pageIndex = 0
+        self._lastPage = None
+        self._failure = None
+        self._docs = deque()
+        self._lock = DeferredLock()
+
+    def _fill(self):
+        """Request pages up to C{prefetch} pages ahead of the current one."""
+        if self._failure is not None:
+            return
+        while self._requested < self._pageIndex + self.prefetch:
+            if (self._lastPage is not None and
+                self._requested > self._lastPage):
+                break
+            if self._cursor:
+                if self._inFlight or self._cursorMark is None:
+                    break
+            elif self._requested > 0 and self._lastPage is None:
+                # Wait for the first page to know the number of pages.
+                break
+            self._requestPage(self._requested)
+
+    def _requestPage(self, index):
+        if self._cursor:
+            cursorMark = self._cursorMark
+            values = {'cursorMark': cursorMark}
+            self._cursorMark = None
+        else:
+            cursorMark = None
+            values = {'start': self._start + index * self.rows}
+
+        _logger.debug('Requesting page %d of %r' % (index, self._query))
+        self._requested += 1
+        self._inFlight += 1
+        d = self._client.searchPrepared(self._prepared, self._query,
+                                        **values)
+        d.addBoth(self._requestDone)
+        d.addCallback(self._gotPage, index, cursorMark)
+        self._pages[index] = d
+
+    def _requestDone(self, result):
+        self._inFlight -= 1
+        if isinstance(result, Failure):
+            self._failure = result
+        return result
+
+    def _gotPage(self, response, index, cursorMark):
+        results = response.results
+        docs = results.docs
+        if self.numFound is None:
+            self.numFound = results.numFound
+
+        if self._cursor:
+            nextCursorMark = getattr(response, 'nextCursorMark', None)
+            if nextCursorMark is None:
+                # The server does not support cursors. The first page is the
+                # same using start, so continue from there.
+                _logger.debug('Cursors not supported, using start paging')
+                self._cursor = False
+                self._setLastPage(results.numFound)
+            elif nextCursorMark == cursorMark or len(docs) < self.rows:
+                self._lastPage = index
+            else:
+                self._cursorMark = nextCursorMark
+        else:
+            self._setLastPage(results.numFound)
+
+        self._fill()
+        return docs
+
+    def _setLastPage(self, numFound):
+        remaining = max(numFound - self._start, 0)
+        self._lastPage = max((remaining + self.rows - 1) // self.rows - 1, 0)
+
+    def nextPage(self):
+        """
+        Get the documents of the next page.
+
+        @return: A L{Deferred} that fires with a C{list} of documents, or with
+            C{None} when there are no more pages.
+        """
+        return self._lock.run(self._nextPage)
+
+    def _nextPage(self):
+        if self._docs:
+            docs = list(self._docs)
+            self._docs.clear()
+            return succeed(docs)
+        return self._fetchPage()
+
+    def _fetchPage(self):
+        index = self._pageIndex
+        if self._lastPage is not None and index > self._lastPage:
+            return succeed(None)
+
+        self._pageIndex += 1
+        self._fill()
+        d = self._pages.pop(index, None)
+        if d is None:
+            # A previous page failed and the following pages can't be known.
+            return fail(self._failure)
+
+        def pageArrived(docs):
+            self._fill()
+            return docs
+
+        return d.addCallback(pageArrived)
+
+    def next(self):
+        """
+        Get the next document.
+
+        @return: A L{Deferred} that fires with the next document, or with
+            C{None} when all the documents have been consumed.
+        """
+        return self._lock.run(self._next)
+
+    def _next(self):
+        if self._docs:
+            return succeed(self._docs.popleft())
+
+        def pageArrived(docs):
+            if docs is None:
+                return None
+            self._docs.extend(docs)
+            if not self._docs:
+                return self._fetchPage().addCallback(pageArrived)
+            return self._docs.popleft()
+
+        return self._fetchPage().addCallback(pageArrived)
+
+    def forEach(self, docCallback):
+        """
+        Call C{docCallback} with every document.
+
+        If C{docCallback} returns a L{Deferred}, the next document is
+        processed after it fires.
+
+        @return: A L{Deferred} that fires with the number of documents
+            processed.
+        """
+        count = [0]
+
+        def processPage(docs):
+            if docs is None:
+                return count[0]
+            return processDocs(iter(docs))
+
+        def processDocs(docs):
+            for doc in docs:
+                count[0] += 1
+                d = maybeDeferred(docCallback, doc)
+                if not d.called:
+                    return d.addCallback(lambda _: processDocs(docs))
+                # Propagate errors from synchronous callbacks.
+                failures = []
+                d.addErrback(failures.append)
+                if failures:
+                    return failures[0]
+            return self.nextPage().addCallback(processPage)
+
+        return self.nextPage().addCallback(processPage)
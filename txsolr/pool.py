@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Persistent HTTP connection pool used by L{txsolr.client.SolrClient}.
+"""
+import logging
+
+from twisted.web.client import HTTPConnectionPool
+
+
+__all__ = ['SolrConnectionPool']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+class SolrConnectionPool(HTTPConnectionPool):
+    """
+    A keep-alive L{HTTPConnectionPool} shared by all the requests of a client.
+
+    On top of the standard Twisted pool, it can retire a connection after it
+    has served a given number of requests. This is useful to spread the load
+    when Solr runs behind a load balancer and to limit the effect of leaks in
+    long living server connections.
+
+    @param reactor: The reactor used to create connections and timeouts.
+    @param persistent: If C{False}, every request uses a new connection which
+        is closed when the response is received.
+    @param maxConnectionsPerHost: The maximum number of idle persistent
+        connections kept open for each host.
+    @param idleTimeout: Number of seconds an idle connection stays open
+        before being closed.
+    @param maxRequestsPerConnection: The number of requests a connection will
+        serve before being closed. C{None} means no limit.
+    """
+
+    def __init__(self, reactor, persistent=True, maxConnectionsPerHost=2,
+                 idleTimeout=240, maxRequestsPerConnection=None):
+        HTTPConnectionPool.__init__(self, reactor, persistent=persistent)
+        self.maxPersistentPerHost = maxConnectionsPerHost
+        self.cachedConnectionTimeout = idleTimeout
+        self.maxRequestsPerConnection = maxRequestsPerConnection
+        self.closed = False
+        self._connectionCallback = None
+
+    def notifyNextConnection(self, callback):
+        """
+        Call C{callback} when the connection of the next request is ready.
+
+        The L{Agent} asks for the connection as soon as a request is made, so
+        this must be called right before the request.
+
+        @param callback: A callable that receives C{True} if the connection
+            was reused from the pool or C{False} if it's a new one.
+        """
+        self._connectionCallback = callback
+
+    def getConnection(self, key, endpoint):
+        callback, self._connectionCallback = self._connectionCallback, None
+        d = HTTPConnectionPool.getConnection(self, key, endpoint)
+        if callback is not None:
+            reused = d.called
+
+            def ready(connection):
+                callback(reused)
+                return connection
+
+            d.addCallback(ready)
+        return d
+
+    def _putConnection(self, key, connection):
+        """
+        Return a connection to the pool, or close it if it already served
+        C{maxRequestsPerConnection} requests.
+        """
+        if self.closed:
+            connection.transport.loseConnection()
+            return
+
+        count = getattr(connection, '_txsolrRequestCount', 0) + 1
+        connection._txsolrRequestCount = count
+        if (self.maxRequestsPerConnection is not None and
+            count >= self.maxRequestsPerConnection):
+            _logger.debug('Retiring connection after %d requests' % count)
+            connection.transport.loseConnection()
+            return
+
+        HTTPConnectionPool._putConnection(self, key, connection)
+
+    def close(self):
+        """
+        Close all the idle connections and stop caching the connections that
+        are still in use.
+
+        @return: A L{Deferred} that fires when the idle connections are closed.
+        """
+        self.closed = True
+        return self.closeCachedConnections()
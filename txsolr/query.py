@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Encoding of the query parameters of searches.
+
+Parameter names use underscores where Solr uses dots (C{facet_field} for
+C{facet.field}) so they can be given as keyword arguments. A C{list} or
+C{tuple} value repeats the parameter once for each item, as needed by C{fq}
+or C{facet.field}.
+
+A L{PreparedQuery} encodes the parameters that stay the same between
+searches only once, and only the ones that change, like C{q}, C{start} or
+C{cursorMark}, are encoded for each search.
+"""
+import urllib
+from operator import itemgetter
+
+
+__all__ = ['PreparedQuery', 'encodeParams', 'mergeSearches', 'VARIABLES']
+
+
+VARIABLES = ('q', 'start', 'cursorMark')
+
+# Parameters whose values can be joined in a single search without
+# changing the results of the others.
+MERGEABLE = ('facet.field', 'facet.query')
+
+
+def _encodeValue(value):
+    if isinstance(value, unicode):
+        return value.encode('UTF-8')
+    return value
+
+
+def encodeParams(params):
+    """
+    Encode query parameters as an C{application/x-www-form-urlencoded}
+    string.
+
+    The parameters are sorted by name, so equal parameters always give the
+    same string. Repeated values keep their order. C{None} values are left
+    out.
+
+    @param params: A C{dict} mapping parameter names to values or lists of
+        values.
+    @return: The encoded C{str}.
+    """
+    pairs = []
+    for key, value in params.iteritems():
+        # Some solr params contains dots (i.e: ht.fl) We use underscores.
+        key = key.replace('_', '.')
+        if isinstance(value, (list, tuple)):
+            pairs.extend((key, _encodeValue(item)) for item in value
+                         if item is not None)
+        elif value is not None:
+            pairs.append((key, _encodeValue(value)))
+    pairs.sort(key=itemgetter(0))
+    return urllib.urlencode(pairs)
+
+
+def _hashable(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(value)
+    return value
+
+
+def mergeSearches(searches):
+    """
+    Join the searches that differ only in their C{facet.field} and
+    C{facet.query} parameters.
+
+    The results of the joined search are the same as the ones of each
+    search, with the facets of all of them.
+
+    @param searches: A sequence of C{dict}s with the parameters of each
+        search.
+    @return: A C{list} of C{(params, indexes)} tuples, with the parameters
+        of each search to send and the positions in C{searches} of the
+        searches it answers.
+    """
+    groups = {}
+    merged = []
+    for index, search in enumerate(searches):
+        params = {}
+        for key, value in search.iteritems():
+            params[key.replace('_', '.')] = value
+        key = tuple(sorted((name, _hashable(value))
+                           for name, value in params.iteritems()
+                           if name not in MERGEABLE))
+        group = groups.get(key)
+        if group is None:
+            groups[key] = group = (params, [])
+            merged.append(group)
+        else:
+            for name in MERGEABLE:
+                values = params.get(name)
+                if values is None:
+                    continue
+                if not isinstance(values, (list, tuple)):
+                    values = [values]
+                current = group[0].get(name, [])
+                if not isinstance(current, (list, tuple)):
+                    current = [current]
+                group[0][name] = list(current) + [
+                    value for value in values if value not in current]
+        group[1].append(index)
+    return merged
+
+
+class PreparedQuery(object):
+    """
+    The parameters of a search encoded once to be used many times.
+
+    Values given for the variable parameters when the query is prepared are
+    used as defaults.
+
+    @ivar responseClass: The L{SolrResponse} subclass used to decode the
+        responses, or C{None} to let the client decide.
+    @ivar variables: A C{frozenset} with the names of the parameters that
+        can change between searches.
+
+    @param params: A C{dict} mapping parameter names to values or lists of
+        values. See L{encodeParams}.
+    @param responseClass: The L{SolrResponse} subclass used to decode the
+        responses.
+    @param variables: The names of the parameters that can change between
+        searches.
+    """
+
+    def __init__(self, params, responseClass=None, variables=VARIABLES):
+        self.responseClass = responseClass
+        self.variables = frozenset(variables)
+        static = {}
+        self._defaults = {}
+        for key, value in params.iteritems():
+            if key in self.variables:
+                self._defaults[key] = value
+            else:
+                static[key] = value
+        self._static = encodeParams(static)
+
+    def encode(self, **values):
+        """
+        Encode the query with the given values for the variable parameters.
+
+        @param values: Values for the variable parameters. C{None} leaves a
+            parameter out.
+        @raise ValueError: If a parameter is not variable.
+        @return: The encoded C{str}.
+        """
+        return ''.join(self.encodeParts(**values))
+
+    def encodeParts(self, **values):
+        """
+        Encode the query like L{encode}, without joining the static and the
+        variable parts.
+
+        @return: A C{tuple} of C{str} that joined give the query.
+        """
+        unknown = [key for key in values if key not in self.variables]
+        if unknown:
+            raise ValueError('Parameters not variable in the prepared query: '
+                             '%s' % ', '.join(sorted(unknown)))
+        if self._defaults:
+            params = dict(self._defaults)
+            params.update(values)
+        else:
+            params = values
+        variable = encodeParams(params)
+        if not variable:
+            return (self._static,)
+        if not self._static:
+            return (variable,)
+        return (self._static, '&' + variable)
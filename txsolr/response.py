@@ -23,16 +23,27 @@ Requests.
 """
 import json
 import logging
+import re
+import time
+from collections import Mapping
+from itertools import izip
 
+from twisted.internet.defer import maybeDeferred
 from twisted.internet.protocol import Protocol
 from twisted.web.client import ResponseDone
 from twisted.web.http import PotentialDataLoss
 
 from txsolr.errors import SolrResponseError
+from txsolr.javabin import JavabinDecoder
+from txsolr.jsonstream import DocumentStreamParser
+from txsolr.lazyjson import LazyArray, LazyObject, plain
+from txsolr.logs import clip
 
 
-__all__ = ['ResponseConsumer', 'DiscardingResponseConsumer', 'QueryResults',
-           'SolrResponse', 'JSONSolrResponse']
+__all__ = ['ResponseConsumer', 'StreamingResponseConsumer',
+           'DiscardingResponseConsumer', 'QueryResults', 'SolrResponse',
+           'JSONSolrResponse', 'JavabinSolrResponse', 'LazyJSONSolrResponse',
+           'CompactJSONSolrResponse', 'CompactDocument', 'compactDocuments']
 
 
 _logger = logging.getLogger('txsolr')
@@ -48,6 +59,9 @@ class ResponseConsumer(Protocol):
 
     The consumer should implement a Twisted L{Protocol}.
 
+    @ivar bytesReceived: The size of the body received so far.
+    @ivar decodeTime: The seconds spent decoding the body, once decoded.
+
     @param deferred: A L{Deferred} that will be fired when all the body is
         consumed.
     @param responseClass: A L{SolrResponse} subclass able to parse the body.
@@ -57,20 +71,26 @@ class ResponseConsumer(Protocol):
         self.bodyParts = []
         self.deferred = deferred
         self.responseClass = responseClass
+        self.bytesReceived = 0
+        self.decodeTime = None
 
     def dataReceived(self, bytes):
-        _logger.debug('Consumer data received:\n' + bytes)
         self.bodyParts.append(bytes)
+        self.bytesReceived += len(bytes)
 
     def connectionLost(self, reason):
-        # FIXME: With solr 3.3, we'll always get PotentialDataLoss because the
-        # Agent sends a Connection: close header.
+        # NOTE: Non persistent connections make the Agent send a
+        # Connection: close header, in that case Solr 3.3 ends the body with
+        # PotentialDataLoss instead of ResponseDone.
         if reason.check(ResponseDone, PotentialDataLoss):
+            start = time.time()
             try:
                 body = ''.join(self.bodyParts)
                 response = self.responseClass(body)
+                self.decodeTime = time.time() - start
             except Exception, e:
-                _logger.error("Can't decode response body: %r" % body)
+                _logger.error("Can't decode response body: %r" %
+                              clip(body, 1024))
                 self.deferred.errback(e)
             else:
                 self.deferred.callback(response)
@@ -78,6 +98,114 @@ class ResponseConsumer(Protocol):
             self.deferred.errback(reason)
 
 
+class StreamingResponseConsumer(Protocol):
+    """
+    A Consumer that parses a JSON body while it arrives and gives the
+    documents of the results, one at a time, to a callback.
+
+    Only the document being parsed and the rest of the response (header,
+    facets, etc.) are kept in memory, so the memory used does not depend on
+    the number of documents in the body.
+
+    If the callback returns a L{Deferred}, the body transport is paused until
+    the L{Deferred} fires.
+
+    @ivar bytesReceived: The size of the body received so far.
+
+    @param deferred: A L{Deferred} that will be fired when all the body is
+        consumed and every document has been processed. It fires with a
+        L{SolrResponse} whose results have an empty C{docs} list.
+    @param responseClass: A L{SolrResponse} subclass able to parse the body
+        without the documents.
+    @param docCallback: A callable that receives each document.
+    """
+
+    def __init__(self, deferred, responseClass, docCallback):
+        self.bytesReceived = 0
+        self.deferred = deferred
+        self.responseClass = responseClass
+        self.docCallback = docCallback
+        self._parser = DocumentStreamParser()
+        self._waiting = None
+        self._blocked = False
+        self._paused = False
+        self._reason = None
+        self._finished = False
+
+    def dataReceived(self, bytes):
+        if self._finished:
+            return
+        self.bytesReceived += len(bytes)
+        self._parser.feed(bytes)
+        self._process()
+
+    def connectionLost(self, reason):
+        if self._finished:
+            return
+        self._reason = reason
+        if not reason.check(ResponseDone, PotentialDataLoss):
+            self._fail(reason)
+            return
+        self._parser.end()
+        self._process()
+
+    def _process(self):
+        while self._waiting is None and not self._finished:
+            try:
+                doc = self._parser.nextDocument()
+            except Exception, e:
+                self._fail(e)
+                return
+
+            if doc is None:
+                break
+
+            d = maybeDeferred(self.docCallback, doc)
+            self._waiting = d
+            d.addCallbacks(self._documentDone, self._fail)
+            if self._waiting is not None:
+                # The callback is not done yet, wait for it.
+                self._blocked = True
+                if self.transport is not None and self._reason is None:
+                    self._paused = True
+                    self.transport.pauseProducing()
+                return
+
+        if self._reason is not None and self._waiting is None:
+            self._finish()
+
+    def _documentDone(self, _):
+        self._waiting = None
+        if self._blocked:
+            self._blocked = False
+            if self._paused:
+                self._paused = False
+                self.transport.resumeProducing()
+            self._process()
+
+    def _finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        try:
+            response = self.responseClass(self._parser.skeleton())
+        except Exception, e:
+            self.deferred.errback(e)
+        else:
+            self.deferred.callback(response)
+
+    def _fail(self, reason):
+        if self._finished:
+            return
+        self._finished = True
+        self._waiting = None
+        if self.transport is not None and self._reason is None:
+            # Close the connection, that may be paused, instead of leaving
+            # the rest of the body unread.
+            self.transport.stopProducing()
+        self.deferred.errback(reason)
+
+
 class DiscardingResponseConsumer(Protocol):
     """
     This is a Consumer that does nothing. This is used for cases when we don't
@@ -86,7 +214,7 @@ class DiscardingResponseConsumer(Protocol):
     """
 
     def dataReceived(self, bytes):
-        _logger.debug('Consumer data received:\n' + bytes)
+        pass
 
 
 class QueryResults(object):
@@ -100,6 +228,8 @@ class QueryResults(object):
     @ivar: docs: A C{dict} representing the documents found.
     """
 
+    __slots__ = ('numFound', 'start', 'docs')
+
     def __init__(self, numFound, start, docs):
         self.numFound = numFound
         self.start = start
@@ -117,6 +247,14 @@ class SolrResponse(object):
 
     @cvar: decoder: An object with a C{decode} method able to decode a raw
         response in a given format.
+    @cvar writerType: The name of the Solr response writer (the C{wt}
+        parameter) that produces the format understood by the class.
+    @cvar compactDocuments: If C{True}, the documents of the results are
+        stored as L{CompactDocument}s instead of C{dict}s.
+    @cvar resultSchema: Optionally, a L{txsolr.schema.ResultSchema} that
+        converts the values of the documents of the results to their types.
+    @ivar retries: The number of times the request was retried to get this
+        response. See L{txsolr.retry.RetryPolicy}.
     @ivar responseDict: The full response as a dict. This is usefull when you
         need an object very similar to the real response issued by the server
     @ivar header: The header of the response. This is usually represented as
@@ -128,6 +266,10 @@ class SolrResponse(object):
     """
 
     decoder = None
+    writerType = None
+    compactDocuments = False
+    resultSchema = None
+    retries = 0
 
     def __init__(self, response):
         assert self.decoder is not None
@@ -156,10 +298,16 @@ class SolrResponse(object):
 
         if 'response' in response:
             try:
-                self.results = QueryResults(response['response']['numFound'],
-                                       response['response']['start'],
-                                       response['response']['docs'])
-            except KeyError:
+                results = response['response']
+                if self.resultSchema is not None:
+                    self.resultSchema.decode(results['docs'])
+                if self.compactDocuments:
+                    # Replace the dicts to really release their memory.
+                    results['docs'] = compactDocuments(results['docs'])
+                self.results = QueryResults(results['numFound'],
+                                            results['start'],
+                                            results['docs'])
+            except (KeyError, TypeError):
                 raise SolrResponseError('Wrong results')
 
         for key, value in response.iteritems():
@@ -187,3 +335,222 @@ class JSONSolrResponse(SolrResponse):
     """
 
     decoder = json.JSONDecoder()
+    writerType = 'json'
+
+
+class JavabinSolrResponse(SolrResponse):
+    """
+    A SolrResponse that decodes javabin, the binary format of Solr. The
+    responses are smaller than their JSON equivalent and they are decoded
+    into the same structures as L{JSONSolrResponse}.
+    """
+
+    decoder = JavabinDecoder()
+    writerType = 'javabin'
+
+
+def _lazyDocuments(body, pos, decoder):
+    schemas = {}
+    return LazyArray(body, pos, decoder,
+                     lambda doc: _compactDocument(doc, schemas))
+
+
+def _lazyResults(body, pos, decoder):
+    return LazyObject(body, pos, decoder, {'docs': _lazyDocuments})
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+_MISSING = object()
+
+
+class LazyJSONSolrResponse(JSONSolrResponse):
+    """
+    A JSON response decoded on demand.
+
+    Only the header is decoded when the response is created. The rest of the
+    parts of the response (results, facets, highlighting, etc.) are decoded
+    the first time they are accessed, and the documents of the results are
+    decoded one by one as they are read. Reading C{results.numFound} or the
+    first documents of a big response only decodes the beginning of the
+    body.
+
+    Every part is decoded from the same body, kept in C{rawResponse}. The
+    documents are given as L{CompactDocument}s, and the ones with the same
+    fields share a single schema.
+
+    Errors in the parts that are not decoded yet are raised as
+    L{SolrResponseError} when they are accessed.
+    """
+
+    def __init__(self, response):
+        self.rawResponse = response
+        self._results = None
+        pos = _WHITESPACE.match(response).end()
+        try:
+            self._root = LazyObject(response, pos, self.decoder,
+                                    {'response': _lazyResults})
+            header = self._root.get('responseHeader')
+        except SolrResponseError, e:
+            raise SolrResponseError('Unable to decode response: %s' % e)
+
+        if header is None:
+            raise SolrResponseError('Response does not have header')
+        if not 'status' in header:
+            raise SolrResponseError('Response does not have status')
+        if header['status'] != 0:
+            raise SolrResponseError('Response status != 0')
+        self.header = header
+
+    @property
+    def results(self):
+        if self._results is None:
+            response = self._root.get('response')
+            if response is None:
+                return None
+            try:
+                self._results = QueryResults(response['numFound'],
+                                             response['start'],
+                                             response['docs'])
+            except KeyError:
+                raise SolrResponseError('Wrong results')
+        return self._results
+
+    @property
+    def responseDict(self):
+        """The whole response decoded as plain C{dict}s and C{list}s."""
+        return plain(self._root)
+
+    def __getattr__(self, name):
+        # Called for the parts of the response that are not attributes yet.
+        if name.startswith('_') or name in ('response', 'responseHeader'):
+            raise AttributeError(name)
+        value = self._root.get(name, _MISSING)
+        if value is _MISSING:
+            raise AttributeError(name)
+        setattr(self, name, value)
+        return value
+
+
+class _Schema(object):
+    """
+    The field names of a group of L{CompactDocument}s.
+
+    @ivar fields: A C{tuple} with the field names.
+    @ivar index: A C{dict} mapping each field name to its position.
+    """
+
+    __slots__ = ('fields', 'index')
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.index = dict((name, i) for i, name in enumerate(fields))
+
+
+class CompactDocument(object):
+    """
+    A read-only mapping with the fields of a document, stored compactly.
+
+    The field names are kept in a schema shared by all the documents with
+    the same fields and the values in a C{tuple}, so a document takes a
+    fraction of the memory of a C{dict}. Use L{compactDocuments} to create
+    them and C{dict(document)} to get a mutable copy.
+    """
+
+    __slots__ = ('_schema', '_values')
+
+    def __init__(self, schema, values):
+        self._schema = schema
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._schema.index[key]]
+
+    def get(self, key, default=None):
+        index = self._schema.index.get(key)
+        if index is None:
+            return default
+        return self._values[index]
+
+    def __contains__(self, key):
+        return key in self._schema.index
+
+    def __iter__(self):
+        return iter(self._schema.fields)
+
+    def __len__(self):
+        return len(self._values)
+
+    def keys(self):
+        return list(self._schema.fields)
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return zip(self._schema.fields, self._values)
+
+    def iterkeys(self):
+        return iter(self._schema.fields)
+
+    def itervalues(self):
+        return iter(self._values)
+
+    def iteritems(self):
+        return izip(self._schema.fields, self._values)
+
+    def __eq__(self, other):
+        if not isinstance(other, Mapping):
+            return False
+        return dict(self.iteritems()) == dict(other.iteritems())
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'CompactDocument(%r)' % (dict(self.iteritems()),)
+
+
+Mapping.register(CompactDocument)
+
+
+def compactDocuments(docs):
+    """
+    Convert a list of C{dict} documents to L{CompactDocument}s.
+
+    Documents with the same fields share a single schema, so the field names
+    are stored once.
+
+    @param docs: A C{list} of C{dict}s.
+    @return: A C{list} of L{CompactDocument}s.
+    """
+    schemas = {}
+    return [_compactDocument(doc, schemas) for doc in docs]
+
+
+def _compactDocument(doc, schemas):
+    """
+    Convert a C{dict} document to a L{CompactDocument}.
+
+    @param doc: A C{dict}.
+    @param schemas: A C{dict} mapping field names to the L{_Schema}s already
+        created. The new schema is added to it if needed.
+    """
+    fields = tuple(doc)
+    schema = schemas.get(fields)
+    if schema is None:
+        schema = schemas[fields] = _Schema(fields)
+    return CompactDocument(schema, tuple(doc.itervalues()))
+
+
+class CompactJSONSolrResponse(JSONSolrResponse):
+    """
+    A L{JSONSolrResponse} whose documents are L{CompactDocument}s.
+
+    Other response classes can store compact documents setting
+    C{compactDocuments} to C{True} in a subclass.
+    """
+
+    compactDocuments = True
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Retries of failed requests.
+"""
+import logging
+import random
+
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.internet.error import ConnectError
+from twisted.python.failure import Failure
+
+from txsolr.errors import (CircuitOpen, HTTPRequestError, HTTPWrongStatus,
+                           RequestQueueFull, RequestTimeout)
+
+
+__all__ = ['RetryPolicy']
+
+
+_logger = logging.getLogger('txsolr')
+
+
+class RetryPolicy(object):
+    """
+    Retries failed requests, waiting an exponential backoff with jitter
+    between the attempts.
+
+    Requests that never reached Solr, because the connection could not be
+    established, are always safe to retry. Idempotent requests, like
+    searches and deletions, are also retried after timeouts, lost
+    connections and the status codes in C{retryStatus}.
+
+    The delay before the retry C{n} (starting at 0) is a random number
+    between 0 and C{min(maxDelay, initialDelay * multiplier ** n)}, so
+    clients failing at the same time don't retry at the same time.
+
+    @ivar retries: The total number of retries made.
+
+    @param maxRetries: The maximum number of retries of a request.
+    @param initialDelay: The maximum delay, in seconds, before the first
+        retry.
+    @param maxDelay: The maximum delay, in seconds, before any retry.
+    @param multiplier: The growth of the maximum delay after every retry.
+    @param retryStatus: The HTTP status codes retried for idempotent
+        requests.
+    @param clock: The L{IReactorTime} provider used to wait between the
+        attempts. By default the global reactor is used.
+    @param random: A callable returning a random C{float} in [0, 1).
+    """
+
+    def __init__(self, maxRetries=3, initialDelay=0.1, maxDelay=5,
+                 multiplier=2, retryStatus=(502, 503, 504), clock=None,
+                 random=random.random):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.maxRetries = maxRetries
+        self.initialDelay = initialDelay
+        self.maxDelay = maxDelay
+        self.multiplier = multiplier
+        self.retryStatus = retryStatus
+        self.retries = 0
+        self._clock = clock
+        self._random = random
+
+    def shouldRetry(self, failure, idempotent):
+        """
+        Decide if a failed request can be sent again.
+
+        @param failure: The L{Failure} of the request.
+        @param idempotent: C{True} if sending the request twice has the same
+            effect as sending it once.
+        """
+        if failure.check(RequestQueueFull, CircuitOpen):
+            return False
+        if failure.check(RequestTimeout):
+            return idempotent or failure.value.args[0] == 'connect'
+        if failure.check(HTTPRequestError):
+            cause = failure.value.args[0] if failure.value.args else None
+            return idempotent or isinstance(cause, ConnectError)
+        if failure.check(HTTPWrongStatus):
+            return idempotent and failure.value.args[0] in self.retryStatus
+        return False
+
+    def backoff(self, retry):
+        """@return: The seconds to wait before the retry number C{retry}."""
+        limit = min(self.maxDelay,
+                    self.initialDelay * self.multiplier ** retry)
+        return self._random() * limit
+
+    def run(self, request, idempotent=False):
+        """
+        Call C{request} until it succeeds, can't be retried or has been
+        retried C{maxRetries} times.
+
+        The number of retries is stored in the C{retries} attribute of the
+        result, or of the exception of the failure.
+
+        @param request: A callable returning a L{Deferred}.
+        @param idempotent: C{True} if the request is idempotent.
+        @return: A L{Deferred} that fires with the result of the last
+            attempt. Cancelling it cancels the attempt in progress or the
+            wait for the next one.
+        """
+        state = {'retries': 0, 'current': None}
+
+        def cancel(_):
+            current = state['current']
+            if current is not None:
+                current.cancel()
+
+        result = Deferred(cancel)
+
+        def attempt():
+            if result.called:
+                return
+            d = maybeDeferred(request)
+            state['current'] = d
+            d.addBoth(done)
+
+        def done(outcome):
+            state['current'] = None
+            if result.called:
+                return None
+            retries = state['retries']
+            if (isinstance(outcome, Failure) and retries < self.maxRetries and
+                self.shouldRetry(outcome, idempotent)):
+                delay = self.backoff(retries)
+                _logger.warning('Retrying request in %.3f seconds: %s' %
+                                (delay, outcome.value))
+                state['retries'] = retries + 1
+                self.retries += 1
+                state['current'] = self._clock.callLater(delay, attempt)
+                return None
+
+            if isinstance(outcome, Failure):
+                target = outcome.value
+            else:
+                target = outcome
+            try:
+                target.retries = retries
+            except AttributeError:
+                pass
+            if isinstance(outcome, Failure):
+                result.errback(outcome)
+            else:
+                result.callback(outcome)
+            return None
+
+        attempt()
+        return result
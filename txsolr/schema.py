@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Typed decoding of the documents of search results.
+
+Solr gives dates as strings in its responses, in JSON and in javabin alike.
+A L{ResultSchema} knows the type of the fields and converts their values
+once for each page of results, field by field. It's the decoding
+counterpart of the conversion of values done by the input factories.
+
+A L{ResultSchema} can also set the C{fl} parameter of the searches from the
+fields requested, so Solr doesn't send the stored fields that are not used.
+"""
+from datetime import datetime
+from fnmatch import fnmatchcase
+
+
+__all__ = ['ResultSchema', 'schemaFromSolr', 'DATE', 'INT', 'FLOAT',
+           'BOOL']
+
+
+DATE = 'date'
+INT = 'int'
+FLOAT = 'float'
+BOOL = 'bool'
+
+
+# Solr field type classes with values that need a conversion.
+_SOLR_CLASSES = {
+    'solr.DatePointField': DATE,
+    'solr.TrieDateField': DATE,
+    'solr.DateField': DATE,
+    'solr.IntPointField': INT,
+    'solr.LongPointField': INT,
+    'solr.TrieIntField': INT,
+    'solr.TrieLongField': INT,
+    'solr.IntField': INT,
+    'solr.LongField': INT,
+    'solr.FloatPointField': FLOAT,
+    'solr.DoublePointField': FLOAT,
+    'solr.TrieFloatField': FLOAT,
+    'solr.TrieDoubleField': FLOAT,
+    'solr.FloatField': FLOAT,
+    'solr.DoubleField': FLOAT,
+    'solr.BoolField': BOOL,
+}
+
+
+def _decodeDate(value):
+    """Convert a Solr date, like C{2010-01-01T12:00:00.5Z}, to C{datetime}."""
+    if not isinstance(value, basestring):
+        return value
+    try:
+        microsecond = 0
+        if len(value) > 20:
+            # The fraction of a second, between the dot and the Z.
+            microsecond = int(value[20:-1].ljust(6, '0')[:6])
+        return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                        int(value[11:13]), int(value[14:16]),
+                        int(value[17:19]), microsecond)
+    except ValueError:
+        return value
+
+
+def _decodeInt(value):
+    if isinstance(value, basestring):
+        try:
+            return int(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _decodeFloat(value):
+    if isinstance(value, basestring):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _decodeBool(value):
+    if isinstance(value, basestring):
+        if value == 'true':
+            return True
+        if value == 'false':
+            return False
+    return value
+
+
+_DECODERS = {
+    DATE: _decodeDate,
+    INT: _decodeInt,
+    FLOAT: _decodeFloat,
+    BOOL: _decodeBool,
+}
+
+
+class ResultSchema(object):
+    """
+    The types of the fields of the documents found by searches.
+
+    Values that are already of the right type, like the numbers of JSON
+    responses, are kept as they are. Values that can't be converted are kept
+    as strings. Dates are given as naive UTC C{datetime}s.
+
+    The documents of L{txsolr.response.LazyJSONSolrResponse}s are read-only
+    and are not converted.
+
+    @ivar fields: A C{tuple} with the names of the fields requested, or
+        C{None} to request the default fields.
+
+    @param types: A C{dict} mapping field names to one of L{DATE}, L{INT},
+        L{FLOAT} or L{BOOL}, or to the class of a Solr field type, like
+        C{'solr.DatePointField'}. Names can be patterns of dynamic fields,
+        like C{'*_dt'}. Fields of other types are not converted.
+    @param fields: Optionally, the names of the fields requested, or their
+        patterns. They are given as the C{fl} parameter of the searches that
+        don't have one. The fields found are converted in any case.
+    """
+
+    def __init__(self, types, fields=None):
+        self._types = dict(types)
+        self._decoders = {}
+        self._patterns = []
+        for name, type in self._types.iteritems():
+            decoder = _DECODERS.get(_SOLR_CLASSES.get(type, type))
+            if decoder is None:
+                continue
+            if '*' in name:
+                self._patterns.append((name, decoder))
+            else:
+                self._decoders[name] = decoder
+        # Longer patterns are more specific.
+        self._patterns.sort(key=lambda pattern: -len(pattern[0]))
+        if fields is not None:
+            fields = tuple(fields)
+        self.fields = fields
+        self._responseClasses = {}
+
+    def project(self, fields):
+        """
+        Get a schema with the same types that requests only some fields.
+
+        @param fields: The names of the fields requested.
+        @return: A L{ResultSchema}.
+        """
+        return ResultSchema(self._types, fields)
+
+    def _decoderFor(self, name):
+        try:
+            return self._decoders[name]
+        except KeyError:
+            decoder = None
+            for pattern, patternDecoder in self._patterns:
+                if fnmatchcase(name, pattern):
+                    decoder = patternDecoder
+                    break
+            self._decoders[name] = decoder
+            return decoder
+
+    def decode(self, docs):
+        """
+        Convert the values of the typed fields of some documents in place.
+
+        @param docs: A C{list} of C{dict} documents.
+        @return: C{docs}.
+        """
+        # The fields found can differ from the requested ones, because of
+        # patterns in them or another fl given to a search.
+        names = set()
+        for doc in docs:
+            names.update(doc)
+        for name in names:
+            decoder = self._decoderFor(name)
+            if decoder is None:
+                continue
+            for doc in docs:
+                value = doc.get(name)
+                if value is None:
+                    continue
+                if isinstance(value, list):
+                    doc[name] = [decoder(item) for item in value]
+                else:
+                    doc[name] = decoder(value)
+        return docs
+
+    def decodeDocument(self, doc):
+        """
+        Convert the values of the typed fields of a document in place.
+
+        @param doc: A C{dict} document.
+        @return: C{doc}.
+        """
+        return self.decode([doc])[0]
+
+    def responseClass(self, baseClass):
+        """
+        Get a subclass of a response class that converts the documents of
+        the results with this schema.
+
+        @param baseClass: A L{txsolr.response.SolrResponse} subclass.
+        @return: A subclass of C{baseClass}, always the same one.
+        """
+        responseClass = self._responseClasses.get(baseClass)
+        if responseClass is None:
+            responseClass = type(baseClass.__name__, (baseClass,),
+                                 {'resultSchema': self})
+            self._responseClasses[baseClass] = responseClass
+        return responseClass
+
+
+def schemaFromSolr(fields, fieldTypes, dynamicFields=(), projection=None):
+    """
+    Create a L{ResultSchema} from the description of a Solr schema, as given
+    by the Solr schema API.
+
+    @param fields: The C{list} of fields of C{/schema/fields}.
+    @param fieldTypes: The C{list} of field types of C{/schema/fieldtypes}.
+    @param dynamicFields: The C{list} of dynamic fields of
+        C{/schema/dynamicfields}.
+    @param projection: Optionally, the names of the fields requested.
+    @return: A L{ResultSchema}.
+    """
+    classes = dict((fieldType['name'], fieldType['class'])
+                   for fieldType in fieldTypes)
+    types = {}
+    for field in list(dynamicFields) + list(fields):
+        fieldClass = classes.get(field['type'])
+        if fieldClass in _SOLR_CLASSES:
+            types[field['name']] = fieldClass
+    return ResultSchema(types, projection)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+A fake Solr server running on a local port. It is used to test the client
+without a real Solr instance.
+"""
+import json
+import os
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, succeed, gatherResults
+from twisted.protocols.policies import WrappingFactory
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET, Site
+
+
+EMPTY_RESPONSE = json.dumps({
+    'responseHeader': {'status': 0, 'QTime': 1},
+    'response': {'numFound': 0, 'start': 0, 'docs': []}})
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'fixtures')
+
+
+def loadFixture(name):
+    """Return the content of a recorded response in the fixtures directory."""
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return f.read()
+
+
+class FakeRequest(object):
+    """
+    A record of a request received by L{FakeSolrResource}.
+
+    @ivar method: The HTTP method of the request.
+    @ivar path: The path of the request, without the query string.
+    @ivar args: A C{dict} mapping argument names to lists of values.
+    @ivar headers: The L{Headers} of the request.
+    @ivar body: The body of the request.
+    @ivar peerPort: The client port, used to identify the connection.
+    """
+
+    def __init__(self, request):
+        self.method = request.method
+        self.path = request.path
+        self.args = request.args
+        self.headers = request.requestHeaders
+        self.body = request.content.read()
+        self.peerPort = request.transport.getPeer().port
+
+
+class FakeSolrResource(Resource):
+    """
+    A resource that records the received requests and answers with canned
+    responses.
+
+    @ivar requests: A C{list} of L{FakeRequest} in the order they arrived.
+    @ivar responses: A C{list} of C{(code, body)} tuples used to answer the
+        next requests. When it's empty, C{defaultResponse} is used.
+    @ivar encoding: Optionally, a C{(name, encode)} tuple used to encode the
+        answers, where C{encode} is a callable that receives and returns a
+        C{str}.
+    @ivar hold: If C{True}, the answers are held until L{release} is called.
+    @ivar aborted: A C{list} of L{Deferred}s, one for each held request,
+        that fire when the client closes the connection before the answer.
+    """
+
+    isLeaf = True
+
+    def __init__(self):
+        Resource.__init__(self)
+        self.requests = []
+        self.responses = []
+        self.defaultResponse = (200, EMPTY_RESPONSE)
+        self.encoding = None
+        self.hold = False
+        self.aborted = []
+        self._held = []
+
+    def render(self, request):
+        self.requests.append(FakeRequest(request))
+        if self.responses:
+            code, body = self.responses.pop(0)
+        else:
+            code, body = self.defaultResponse
+        request.setResponseCode(code)
+        request.setHeader('Content-Type', 'text/plain; charset=utf-8')
+        if self.encoding is not None:
+            name, encode = self.encoding
+            request.setHeader('Content-Encoding', name)
+            body = encode(body)
+        if self.hold:
+            aborted = Deferred()
+            request.notifyFinish().addErrback(
+                lambda _: aborted.callback(None))
+            self.aborted.append(aborted)
+            self._held.append((request, body))
+            return NOT_DONE_YET
+        return body
+
+    def release(self):
+        """Send the answers of the held requests still connected."""
+        self.hold = False
+        held, self._held = self._held, []
+        for request, body in held:
+            if not request._disconnected:
+                request.write(body)
+                request.finish()
+
+
+class _TrackingFactory(WrappingFactory):
+    """A L{WrappingFactory} that notifies when all its connections are gone."""
+
+    def __init__(self, wrappedFactory):
+        WrappingFactory.__init__(self, wrappedFactory)
+        self._waiters = []
+
+    def unregisterProtocol(self, p):
+        WrappingFactory.unregisterProtocol(self, p)
+        if not self.protocols:
+            waiters, self._waiters = self._waiters, []
+            for d in waiters:
+                d.callback(None)
+
+    def disconnectAll(self):
+        if not self.protocols:
+            return succeed(None)
+        d = Deferred()
+        self._waiters.append(d)
+        for p in list(self.protocols):
+            p.transport.loseConnection()
+        return d
+
+
+class FakeSolrServer(object):
+    """
+    A local HTTP server serving a L{FakeSolrResource} under C{/solr}.
+
+    @ivar url: The base URL of the server, once started.
+    """
+
+    def __init__(self, resource=None):
+        if resource is None:
+            resource = FakeSolrResource()
+        self.resource = resource
+        self.url = None
+        self._factory = _TrackingFactory(Site(resource))
+        self._port = None
+
+    def start(self):
+        self._port = reactor.listenTCP(0, self._factory,
+                                       interface='127.0.0.1')
+        self.url = 'http://127.0.0.1:%d/solr' % self._port.getHost().port
+        return self.url
+
+    def stop(self):
+        return gatherResults([self._factory.disconnectAll(),
+                              self._port.stopListening()])
+
+    @property
+    def requests(self):
+        return self.resource.requests
@@ -0,0 +1,173 @@
+from twisted.internet.defer import fail, inlineCallbacks, succeed
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from txsolr.balancer import (LoadBalancer, ROUND_ROBIN, LEAST_OUTSTANDING,
+                             EWMA)
+from txsolr.client import LoadBalancingSolrClient
+from txsolr.errors import HTTPWrongStatus
+from txsolr.test.fakesolr import FakeSolrServer
+
+
+URLS = ['http://a/solr', 'http://b/solr', 'http://c/solr']
+
+
+class LoadBalancerTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.probes = []
+
+    def createBalancer(self, strategy=ROUND_ROBIN, **kwargs):
+        return LoadBalancer(URLS, strategy=strategy, clock=self.clock,
+                            **kwargs)
+
+    def select(self, balancer, count, write=False):
+        return [balancer.select(write).url[7] for _ in range(count)]
+
+    def testRoundRobin(self):
+        """The nodes are used in turns."""
+        balancer = self.createBalancer()
+        self.assertEqual(self.select(balancer, 4), list('abca'))
+
+    def testLeastOutstanding(self):
+        """The node with less requests in flight is chosen."""
+        balancer = self.createBalancer(LEAST_OUTSTANDING)
+        balancer.started(balancer.nodes[0])
+        balancer.started(balancer.nodes[0])
+        balancer.started(balancer.nodes[1])
+        self.assertEqual(self.select(balancer, 3), list('ccc'))
+
+    def testEWMA(self):
+        """The node with the lowest average latency is chosen."""
+        balancer = self.createBalancer(EWMA, decay=0.5)
+        for node, latency in zip(balancer.nodes, [2, 1, 3]):
+            start = balancer.started(node)
+            self.clock.advance(latency)
+            balancer.finished(node, start)
+        self.assertEqual([node.latency for node in balancer.nodes],
+                         [1.0, 0.5, 1.5])
+        self.assertEqual(self.select(balancer, 2), list('bb'))
+        # Requests in flight make a node less attractive.
+        balancer.started(balancer.nodes[1])
+        balancer.started(balancer.nodes[1])
+        self.assertEqual(self.select(balancer, 1), list('a'))
+
+    def testLeader(self):
+        """Writes go to the leader."""
+        balancer = self.createBalancer(leader='http://d/solr/')
+        self.assertEqual(self.select(balancer, 2, write=True), list('dd'))
+        self.assertEqual(self.select(balancer, 3), list('abc'))
+
+    def testWritesWithoutLeader(self):
+        """Without a leader, writes are balanced like reads."""
+        balancer = self.createBalancer()
+        self.assertEqual(self.select(balancer, 2, write=True), list('ab'))
+
+    def testEjection(self):
+        """
+        Nodes that fail C{maxFailures} consecutive requests are taken out
+        of rotation.
+        """
+        balancer = self.createBalancer(maxFailures=2)
+        node = balancer.nodes[0]
+        balancer.finished(node, balancer.started(node), failed=True)
+        balancer.finished(node, balancer.started(node))
+        balancer.finished(node, balancer.started(node), failed=True)
+        self.assertTrue(node.healthy)
+        balancer.finished(node, balancer.started(node), failed=True)
+        self.assertFalse(node.healthy)
+        self.assertEqual(self.select(balancer, 4), list('bcbc'))
+
+    def testAllEjected(self):
+        """If all the nodes are out of rotation, all of them are used."""
+        balancer = self.createBalancer()
+        for node in balancer.nodes:
+            balancer.finished(node, balancer.started(node), failed=True)
+        self.assertEqual(self.select(balancer, 3), list('abc'))
+
+    def testProbe(self):
+        """
+        Nodes out of rotation are probed until they answer, and then put
+        back.
+        """
+        results = [fail(Exception()), succeed(None)]
+
+        def probe(node):
+            self.probes.append(node)
+            return results.pop(0)
+
+        balancer = self.createBalancer(probe=probe, probeInterval=5)
+        node = balancer.nodes[0]
+        balancer.finished(node, balancer.started(node), failed=True)
+        self.clock.advance(5)
+        self.assertEqual(self.probes, [node])
+        self.assertFalse(node.healthy)
+        self.clock.advance(5)
+        self.assertEqual(self.probes, [node, node])
+        self.assertTrue(node.healthy)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def testStop(self):
+        """L{LoadBalancer.stop} cancels the scheduled probes."""
+        balancer = self.createBalancer(probe=self.probes.append)
+        node = balancer.nodes[0]
+        balancer.finished(node, balancer.started(node), failed=True)
+        balancer.stop()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+class LoadBalancingSolrClientTest(TestCase):
+
+    def setUp(self):
+        self.servers = [FakeSolrServer(), FakeSolrServer()]
+        urls = [server.start() for server in self.servers]
+        self.client = LoadBalancingSolrClient(urls, leader=urls[1])
+
+    @inlineCallbacks
+    def tearDown(self):
+        yield self.client.close()
+        for server in self.servers:
+            yield server.stop()
+
+    @inlineCallbacks
+    def testSpreadReads(self):
+        """Searches are spread across the nodes."""
+        for _ in range(4):
+            yield self.client.search('*:*')
+        self.assertEqual([len(server.requests) for server in self.servers],
+                         [2, 2])
+
+    @inlineCallbacks
+    def testWritesToLeader(self):
+        """Updates are sent to the leader."""
+        yield self.client.add({'id': 1})
+        yield self.client.commit()
+        self.assertEqual([len(server.requests) for server in self.servers],
+                         [0, 2])
+
+    @inlineCallbacks
+    def testFailingNode(self):
+        """A node answering with errors is taken out of rotation."""
+        self.servers[0].resource.responses.append((503, ''))
+        yield self.assertFailure(self.client.search('*:*'), HTTPWrongStatus)
+        for _ in range(3):
+            yield self.client.search('*:*')
+        self.assertEqual([len(server.requests) for server in self.servers],
+                         [1, 3])
+        self.assertFalse(self.client.balancer.nodes[0].healthy)
+
+    @inlineCallbacks
+    def testClientErrors(self):
+        """Errors caused by the request don't take a node out of rotation."""
+        self.servers[0].resource.responses.append((400, ''))
+        yield self.assertFailure(self.client.search('*:*'), HTTPWrongStatus)
+        self.assertTrue(self.client.balancer.nodes[0].healthy)
+
+    @inlineCallbacks
+    def testProbe(self):
+        """Nodes out of rotation are probed with a ping."""
+        node = self.client.balancer.nodes[0]
+        yield self.client._probe(node)
+        self.assertEqual(self.servers[0].requests[0].path,
+                         '/solr/admin/ping')
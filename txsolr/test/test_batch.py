@@ -0,0 +1,118 @@
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from txsolr.batch import BatchingIndexer
+from txsolr.errors import HTTPWrongStatus
+
+
+class FakeClient(object):
+    """A client that records the updates and answers them manually."""
+
+    def __init__(self):
+        self.updates = []
+
+    def add(self, documents, overwrite=None, commitWithin=None):
+        d = Deferred()
+        self.updates.append(('add', list(documents), d))
+        return d
+
+    def delete(self, ids):
+        d = Deferred()
+        self.updates.append(('delete', list(ids), d))
+        return d
+
+
+class BatchingIndexerTest(TestCase):
+
+    def setUp(self):
+        self.client = FakeClient()
+        self.clock = Clock()
+
+    def createIndexer(self, **kwargs):
+        return BatchingIndexer(self.client, clock=self.clock, **kwargs)
+
+    def testFlushOnMaxDocuments(self):
+        """
+        L{BatchingIndexer} sends a batch when it reaches C{maxDocuments}
+        documents.
+        """
+        indexer = self.createIndexer(maxDocuments=3)
+        for i in range(7):
+            indexer.add({'id': i})
+        self.assertEqual([docs for _, docs, _ in self.client.updates],
+                         [[{'id': 0}, {'id': 1}, {'id': 2}],
+                          [{'id': 3}, {'id': 4}, {'id': 5}]])
+
+    def testFlushOnMaxBytes(self):
+        """
+        L{BatchingIndexer} sends a batch when its payload reaches C{maxBytes}.
+        """
+        indexer = self.createIndexer(maxBytes=1000)
+        indexer.add({'id': '1', 'text': 'x' * 500})
+        self.assertEqual(self.client.updates, [])
+        indexer.add({'id': '2', 'text': 'x' * 500})
+        self.assertEqual(len(self.client.updates), 1)
+
+    def testFlushOnMaxDelay(self):
+        """
+        L{BatchingIndexer} sends a batch when its first document has waited
+        for C{maxDelay} milliseconds.
+        """
+        indexer = self.createIndexer(maxDelay=500)
+        indexer.add({'id': 1})
+        self.clock.advance(0.3)
+        indexer.add({'id': 2})
+        self.assertEqual(self.client.updates, [])
+        self.clock.advance(0.2)
+        self.assertEqual(len(self.client.updates), 1)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def testCallersDeferreds(self):
+        """
+        Every caller gets its own L{Deferred}, fired when the batch with its
+        document is acknowledged.
+        """
+        indexer = self.createIndexer(maxDocuments=2)
+        results = []
+        indexer.add({'id': 1}).addCallback(results.append)
+        indexer.add({'id': 2}).addCallback(results.append)
+        indexer.add({'id': 3}).addCallback(results.append)
+        self.client.updates[0][2].callback('response')
+        self.assertEqual(results, ['response', 'response'])
+
+    def testBatchFailure(self):
+        """
+        If a batch fails, the L{Deferred}s of all its documents fail with the
+        same error.
+        """
+        indexer = self.createIndexer()
+        d1 = indexer.add({'id': 1})
+        d2 = indexer.add({'id': 2})
+        indexer.flush()
+        self.client.updates[0][2].errback(HTTPWrongStatus(503))
+        self.assertFailure(d1, HTTPWrongStatus)
+        return self.assertFailure(d2, HTTPWrongStatus)
+
+    def testAddsAndDeletesKeepOrder(self):
+        """
+        L{BatchingIndexer} sends adds and deletes in different batches,
+        keeping the order in which they were requested.
+        """
+        indexer = self.createIndexer()
+        indexer.add({'id': 1})
+        indexer.delete(2)
+        indexer.delete(3)
+        indexer.add({'id': 4})
+        indexer.flush()
+        self.assertEqual([(kind, items)
+                          for kind, items, _ in self.client.updates],
+                         [('add', [{'id': 1}]), ('delete', [2, 3]),
+                          ('add', [{'id': 4}])])
+
+    def testFlushWithoutDocuments(self):
+        """L{BatchingIndexer.flush} does nothing if there are no documents."""
+        indexer = self.createIndexer()
+        d = indexer.flush()
+        self.assertTrue(d.called)
+        self.assertEqual(self.client.updates, [])
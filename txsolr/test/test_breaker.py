@@ -0,0 +1,132 @@
+from twisted.internet.defer import CancelledError, Deferred, inlineCallbacks
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from txsolr.breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from txsolr.client import SolrClient
+from txsolr.errors import CircuitOpen, HTTPRequestError, HTTPWrongStatus
+from txsolr.test.fakesolr import FakeSolrServer
+
+
+URL = 'http://a/solr'
+
+
+class CircuitBreakerTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.sent = 0
+
+    def createBreaker(self, **kwargs):
+        return CircuitBreaker(clock=self.clock, **kwargs)
+
+    def send(self, breaker, error=None, url=URL):
+        """Send a request that fails with C{error} or succeeds."""
+        def request():
+            self.sent += 1
+            d = Deferred()
+            if error is None:
+                d.callback('ok')
+            else:
+                d.errback(error)
+            return d
+
+        d = breaker.run(url, request)
+        d.addErrback(lambda failure: failure.value)
+        return self.successResultOf(d)
+
+    def testConsecutiveFailures(self):
+        """The breaker opens after C{maxFailures} consecutive failures."""
+        breaker = self.createBreaker(maxFailures=3)
+        for error in (HTTPWrongStatus(503), HTTPRequestError(), None,
+                      HTTPWrongStatus(500), HTTPWrongStatus(503)):
+            self.send(breaker, error)
+        self.assertEqual(breaker.state(URL), CLOSED)
+        self.send(breaker, HTTPRequestError())
+        self.assertEqual(breaker.state(URL), OPEN)
+
+    def testFailFast(self):
+        """While open, requests fail without being sent."""
+        breaker = self.createBreaker(maxFailures=1)
+        self.send(breaker, HTTPWrongStatus(503))
+        error = self.send(breaker)
+        self.assertIsInstance(error, CircuitOpen)
+        self.assertEqual(error.args[0], URL)
+        self.assertEqual(self.sent, 1)
+
+    def testEndpoints(self):
+        """Each endpoint has its own breaker."""
+        breaker = self.createBreaker(maxFailures=1)
+        self.send(breaker, HTTPWrongStatus(503))
+        self.assertEqual(self.send(breaker, url='http://b/solr'), 'ok')
+
+    def testFailureRate(self):
+        """The breaker opens when the rate of failures is too high."""
+        breaker = self.createBreaker(failureRate=0.5, minRequests=4)
+        for error in (HTTPWrongStatus(503), None, HTTPWrongStatus(503)):
+            self.send(breaker, error)
+        self.assertEqual(breaker.state(URL), CLOSED)
+        self.send(breaker)
+        self.assertEqual(breaker.state(URL), CLOSED)
+        self.send(breaker, HTTPWrongStatus(503))
+        self.assertEqual(breaker.state(URL), OPEN)
+
+    def testNotFailures(self):
+        """Client errors and cancelled requests don't open the breaker."""
+        breaker = self.createBreaker(maxFailures=1)
+        self.send(breaker, HTTPWrongStatus(400))
+        self.send(breaker, CancelledError())
+        self.assertEqual(breaker.state(URL), CLOSED)
+
+    def testHalfOpenSuccess(self):
+        """A successful trial request closes the breaker."""
+        breaker = self.createBreaker(maxFailures=1, resetTimeout=10)
+        self.send(breaker, HTTPWrongStatus(503))
+        self.clock.advance(10)
+        self.assertEqual(breaker.state(URL), HALF_OPEN)
+        self.assertEqual(self.send(breaker), 'ok')
+        self.assertEqual(breaker.state(URL), CLOSED)
+
+    def testHalfOpenFailure(self):
+        """A failed trial request opens the breaker again."""
+        breaker = self.createBreaker(maxFailures=3, resetTimeout=10)
+        for _ in range(3):
+            self.send(breaker, HTTPWrongStatus(503))
+        self.clock.advance(10)
+        self.send(breaker, HTTPWrongStatus(503))
+        self.assertEqual(breaker.state(URL), OPEN)
+        self.clock.advance(5)
+        self.assertIsInstance(self.send(breaker), CircuitOpen)
+
+    def testTrialRequests(self):
+        """Only C{trialRequests} requests are sent while half open."""
+        breaker = self.createBreaker(maxFailures=1, resetTimeout=10)
+        self.send(breaker, HTTPWrongStatus(503))
+        self.clock.advance(10)
+        trial = breaker.run(URL, Deferred)
+        self.assertIsInstance(self.send(breaker), CircuitOpen)
+        trial.callback('ok')
+        self.assertEqual(breaker.state(URL), CLOSED)
+
+
+class ClientCircuitBreakerTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeSolrServer()
+        self.url = self.server.start()
+        breaker = CircuitBreaker(maxFailures=2)
+        self.client = SolrClient(self.url, circuitBreaker=breaker)
+
+    def tearDown(self):
+        self.client.close()
+        return self.server.stop()
+
+    @inlineCallbacks
+    def testOverloadedServer(self):
+        """Requests to an overloaded server fail fast."""
+        self.server.resource.defaultResponse = (503, 'Overloaded')
+        for _ in range(2):
+            yield self.assertFailure(self.client.search('*:*'),
+                                     HTTPWrongStatus)
+        yield self.assertFailure(self.client.search('*:*'), CircuitOpen)
+        self.assertEqual(len(self.server.requests), 2)
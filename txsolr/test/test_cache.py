@@ -0,0 +1,143 @@
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from txsolr.cache import QueryCache
+from txsolr.client import SolrClient
+from txsolr.test.fakesolr import FakeSolrServer, EMPTY_RESPONSE
+
+
+class QueryCacheTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = QueryCache(maxEntries=2, maxBytes=100, ttl=10,
+                                clock=self.clock)
+
+    def testGetAndPut(self):
+        """Stored values are found until they expire."""
+        self.cache.put('a', 'A', 1)
+        self.assertEqual(self.cache.get('a'), 'A')
+        self.clock.advance(10)
+        self.assertEqual(self.cache.get('a'), None)
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.stats()['expirations'], 1)
+
+    def testEntryTTL(self):
+        """Each entry can have its own TTL."""
+        self.cache.put('a', 'A', 1, ttl=20)
+        self.cache.put('b', 'B', 1)
+        self.clock.advance(15)
+        self.assertEqual(self.cache.get('a'), 'A')
+        self.assertEqual(self.cache.get('b'), None)
+
+    def testMaxEntries(self):
+        """The least recently used entry is evicted."""
+        self.cache.put('a', 'A', 1)
+        self.cache.put('b', 'B', 1)
+        self.cache.get('a')
+        self.cache.put('c', 'C', 1)
+        self.assertEqual(self.cache.get('b'), None)
+        self.assertEqual(self.cache.get('a'), 'A')
+        self.assertEqual(self.cache.get('c'), 'C')
+        self.assertEqual(self.cache.evictions, 1)
+
+    def testMaxBytes(self):
+        """Entries are evicted to respect the size bound."""
+        self.cache.put('a', 'A', 60)
+        self.cache.put('b', 'B', 60)
+        self.assertEqual(self.cache.get('a'), None)
+        self.assertEqual(self.cache.size, 60)
+        self.cache.put('c', 'C', 101)
+        self.assertEqual(self.cache.get('c'), None)
+
+    def testReplace(self):
+        """Storing an existing key replaces its value and size."""
+        self.cache.put('a', 'A', 60)
+        self.cache.put('a', 'B', 30)
+        self.assertEqual(self.cache.get('a'), 'B')
+        self.assertEqual(self.cache.size, 30)
+
+    def testInvalidate(self):
+        """
+        Invalidating removes all the entries and rejects values requested
+        before.
+        """
+        self.cache.put('a', 'A', 1)
+        generation = self.cache.generation
+        self.cache.invalidate()
+        self.assertEqual(self.cache.get('a'), None)
+        self.cache.put('b', 'B', 1, generation=generation)
+        self.assertEqual(len(self.cache), 0)
+
+    def testStats(self):
+        """The statistics report hits and misses."""
+        self.cache.put('a', 'A', 5)
+        self.cache.get('a')
+        self.cache.get('b')
+        self.assertEqual(self.cache.stats(),
+                         {'hits': 1, 'misses': 1, 'evictions': 0,
+                          'expirations': 0, 'entries': 1, 'bytes': 5,
+                          'hitRate': 0.5})
+
+
+class ClientCacheTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeSolrServer()
+        self.cache = QueryCache()
+        self.client = SolrClient(self.server.start(), cache=self.cache)
+
+    @inlineCallbacks
+    def tearDown(self):
+        yield self.client.close()
+        yield self.server.stop()
+
+    @inlineCallbacks
+    def testCachedSearch(self):
+        """
+        Repeated searches are answered synchronously from the cache, with a
+        new response each time.
+        """
+        first = yield self.client.search('*:*', rows=10, sort='id asc')
+        d = self.client.search('*:*', sort='id asc', rows=10)
+        second = []
+        d.addCallback(second.append)
+        self.assertEqual(len(second), 1)
+        self.assertNotIdentical(second[0], first)
+        self.assertEqual(second[0].rawResponse, EMPTY_RESPONSE)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.cache.hits, 1)
+
+    @inlineCallbacks
+    def testDifferentParams(self):
+        """Different parameters are cached separately."""
+        yield self.client.search('*:*', rows=10)
+        yield self.client.search('*:*', rows=20)
+        self.assertEqual(len(self.server.requests), 2)
+
+    @inlineCallbacks
+    def testInvalidation(self):
+        """Commit, rollback and optimize invalidate the cache."""
+        for action in (self.client.commit, self.client.rollback,
+                       self.client.optimize):
+            yield self.client.search('*:*')
+            yield action()
+            self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.hits, 0)
+
+    @inlineCallbacks
+    def testStaleResult(self):
+        """A search running while the index changes is not cached."""
+        d = self.client.search('*:*')
+        yield self.client.commit()
+        yield d
+        self.assertEqual(len(self.cache), 0)
+
+    @inlineCallbacks
+    def testErrorNotCached(self):
+        """Failed searches are not cached."""
+        self.server.resource.responses.append((500, ''))
+        yield self.assertFailure(self.client.search('*:*'), Exception)
+        yield self.client.search('*:*')
+        self.assertEqual(len(self.server.requests), 2)
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+import json
+
+from twisted.internet.defer import inlineCallbacks
+from twisted.trial.unittest import TestCase
+
+from txsolr.cloud import (murmurHash3, compositeIdHash, ClusterState,
+                          CloudSolrClient)
+from txsolr.errors import HTTPWrongStatus
+from txsolr.test.fakesolr import FakeSolrServer, loadFixture
+
+
+NODE1 = 'http://127.0.0.1:8983/solr'
+NODE2 = 'http://127.0.0.1:7574/solr'
+SHARD1 = '/books_shard1_replica_n1'
+SHARD2 = '/books_shard2_replica_n6'
+
+
+def loadClusterStatus(node1=NODE1, node2=NODE2):
+    """Load the recorded C{CLUSTERSTATUS} with the given node URLs."""
+    body = loadFixture('clusterstatus.json')
+    body = body.replace(NODE1, '{node1}').replace(NODE2, '{node2}')
+    return body.replace('{node1}', node1).replace('{node2}', node2)
+
+
+class MurmurHash3Test(TestCase):
+
+    def testKnownValues(self):
+        """The hash matches the reference implementation."""
+        self.assertEqual(murmurHash3(''), 0)
+        self.assertEqual(murmurHash3('hello'), 0x248bfa47)
+        self.assertEqual(
+            murmurHash3('The quick brown fox jumps over the lazy dog'),
+            0x2e4ff723)
+
+    def testSigned(self):
+        """Hashes are signed like Java integers."""
+        self.assertEqual(murmurHash3('doc1'), 0xd8ced634 - 0x100000000)
+
+    def testUnicode(self):
+        """Unicode strings are hashed as UTF-8."""
+        self.assertEqual(murmurHash3(u'ナルト'),
+                         murmurHash3(u'ナルト'.encode('utf-8')))
+
+
+class CompositeIdHashTest(TestCase):
+
+    def testPlainId(self):
+        """Plain IDs use the hash of the whole ID."""
+        self.assertEqual(compositeIdHash('doc1'), murmurHash3('doc1'))
+
+    def testRouteKey(self):
+        """The high bits come from the route key and the low ones from the
+        ID."""
+        self.assertEqual(compositeIdHash('a!b') & 0xffffffff, 0x3c257e03)
+        self.assertEqual(compositeIdHash('a!b') >> 16,
+                         compositeIdHash('a!c') >> 16)
+        self.assertEqual(compositeIdHash('a!') & 0xffff, 0)
+
+    def testBits(self):
+        """The number of bits of the route key can be chosen."""
+        self.assertEqual(compositeIdHash('a/4!b') & 0xffffffff, 0x35de7e03)
+
+    def testThreeLevels(self):
+        """Keys with three parts use 8, 8 and 16 bits."""
+        self.assertEqual(compositeIdHash('a!b!c') & 0xffffffff, 0x3cded65f)
+
+    def testInvalidBits(self):
+        """Invalid numbers of bits are rejected."""
+        self.assertRaises(ValueError, compositeIdHash, 'a/17!b')
+        self.assertRaises(ValueError, compositeIdHash, 'a/x!b')
+
+
+class ClusterStateTest(TestCase):
+
+    def setUp(self):
+        self.status = json.loads(loadClusterStatus())
+
+    def testClusterStatus(self):
+        """The layout is read from a C{CLUSTERSTATUS} response."""
+        state = ClusterState(self.status, 'books')
+        self.assertEqual(state.router, 'compositeId')
+        self.assertEqual(state.version, 11)
+        self.assertEqual([shard.name for shard in state.shards],
+                         ['shard1', 'shard2'])
+        self.assertEqual(state.nodes(), [NODE2, NODE1])
+
+    def testClusterStateFile(self):
+        """The layout is read from the content of a C{state.json} file."""
+        collections = self.status['cluster']['collections']
+        state = ClusterState(collections, 'books')
+        self.assertEqual(len(state.shards), 2)
+
+    def testUnknownCollection(self):
+        """Unknown collections are rejected."""
+        self.assertRaises(ValueError, ClusterState, self.status, 'movies')
+
+    def testLeaderFor(self):
+        """Documents are routed to the leader of the shard of their hash."""
+        state = ClusterState(self.status, 'books')
+        self.assertEqual(state.leaderFor('doc1'), NODE1 + SHARD1)
+        self.assertEqual(state.leaderFor('doc4'), NODE2 + SHARD2)
+
+    def testInactiveShards(self):
+        """Inactive shards and replicas are ignored."""
+        shards = self.status['cluster']['collections']['books']['shards']
+        shards['shard2']['state'] = 'inactive'
+        replicas = shards['shard1']['replicas']
+        replicas['core_node5']['state'] = 'down'
+        state = ClusterState(self.status, 'books')
+        self.assertEqual(state.nodes(), [NODE1])
+        self.assertEqual(state.leaderFor('doc4'), None)
+
+    def testOtherRouters(self):
+        """Documents can't be routed with other routers."""
+        collection = self.status['cluster']['collections']['books']
+        collection['router']['name'] = 'implicit'
+        state = ClusterState(self.status, 'books')
+        self.assertEqual(state.leaderFor('doc1'), None)
+
+
+class CloudSolrClientTest(TestCase):
+
+    def setUp(self):
+        self.servers = [FakeSolrServer(), FakeSolrServer()]
+        urls = [server.start() for server in self.servers]
+        self.status = loadClusterStatus(*urls)
+        self.client = None
+
+    def tearDown(self):
+        if self.client is not None:
+            self.client.close()
+        return self.servers[0].stop().addCallback(
+            lambda _: self.servers[1].stop())
+
+    def createClient(self, **kwargs):
+        urls = [server.url for server in self.servers]
+        self.client = CloudSolrClient(urls, 'books', **kwargs)
+        return self.client
+
+    def paths(self, server):
+        return [request.path for request in server.requests]
+
+    @inlineCallbacks
+    def testAddToLeaders(self):
+        """Each leader receives the documents of its shard."""
+        client = self.createClient(clusterState=json.loads(self.status))
+        yield client.add([{'id': 'doc%d' % i} for i in range(1, 5)])
+        requests = [server.requests for server in self.servers]
+        self.assertEqual([request.path for request in requests[0]],
+                         ['/solr' + SHARD1 + '/update'])
+        self.assertEqual([request.path for request in requests[1]],
+                         ['/solr' + SHARD2 + '/update'])
+        self.assertEqual(requests[0][0].body.count('name="id"'), 3)
+        self.assertIn('doc4', requests[1][0].body)
+
+    @inlineCallbacks
+    def testDeleteFromLeaders(self):
+        """Deleted IDs are sent to the leaders of their shards."""
+        client = self.createClient(clusterState=json.loads(self.status))
+        yield client.delete(['doc1', 'doc4'])
+        self.assertIn('doc1', self.servers[0].requests[0].body)
+        self.assertIn('doc4', self.servers[1].requests[0].body)
+
+    @inlineCallbacks
+    def testDocumentsWithoutId(self):
+        """Documents that can't be routed are sent to the collection."""
+        client = self.createClient(clusterState=json.loads(self.status))
+        yield client.add({'title': 'No ID'})
+        requests = self.servers[0].requests + self.servers[1].requests
+        self.assertEqual([request.path for request in requests],
+                         ['/solr/books/update'])
+
+    @inlineCallbacks
+    def testLoadClusterStatus(self):
+        """The layout is loaded before the first update."""
+        self.servers[0].resource.responses.append((200, self.status))
+        client = self.createClient()
+        yield client.add({'id': 'doc4'})
+        request = self.servers[0].requests[0]
+        self.assertEqual(request.path, '/solr/admin/collections')
+        self.assertEqual(request.args['action'], ['CLUSTERSTATUS'])
+        self.assertEqual(request.args['collection'], ['books'])
+        self.assertEqual(self.paths(self.servers[1]),
+                         ['/solr' + SHARD2 + '/update'])
+
+    @inlineCallbacks
+    def testLeaderChanged(self):
+        """
+        When a leader fails, the layout is reloaded and the documents are
+        routed again.
+        """
+        client = self.createClient(clusterState=json.loads(self.status))
+        # The leader of the second shard moves to the first node.
+        status = json.loads(self.status)
+        shards = status['cluster']['collections']['books']['shards']
+        replicas = shards['shard2']['replicas']
+        replicas['core_node7']['leader'] = 'true'
+        replicas.pop('core_node8')
+        self.servers[1].resource.responses.append((503, 'Leader is gone'))
+        nodes = client.clusterState.nodes()
+        statusServer = self.servers[nodes[0] != self.servers[0].url]
+        statusServer.resource.responses.append((200, json.dumps(status)))
+
+        yield client.add({'id': 'doc4'})
+        self.assertEqual(self.paths(self.servers[1])[0],
+                         '/solr' + SHARD2 + '/update')
+        self.assertIn('/solr/admin/collections', self.paths(statusServer))
+        self.assertEqual(self.paths(self.servers[0])[-1],
+                         '/solr/books_shard2_replica_n4/update')
+
+    @inlineCallbacks
+    def testClientErrors(self):
+        """Client errors are not retried."""
+        client = self.createClient(clusterState=json.loads(self.status))
+        self.servers[1].resource.responses.append((400, 'Bad request'))
+        error = yield self.assertFailure(client.add({'id': 'doc4'}),
+                                         HTTPWrongStatus)
+        self.assertEqual(error.args[0], 400)
+        self.assertEqual(len(self.servers[1].requests), 1)
+
+    @inlineCallbacks
+    def testSearchesSpread(self):
+        """Searches are spread across the nodes of the collection."""
+        client = self.createClient(clusterState=json.loads(self.status))
+        yield client.search('*:*')
+        yield client.search('title:txsolr')
+        for server in self.servers:
+            self.assertEqual(self.paths(server), ['/solr/books/select'])
@@ -0,0 +1,140 @@
+from twisted.internet.defer import (CancelledError, Deferred, gatherResults,
+                                    inlineCallbacks)
+from twisted.trial.unittest import TestCase
+
+from txsolr.client import SolrClient
+from txsolr.coalesce import RequestCoalescer
+from txsolr.errors import HTTPWrongStatus
+from txsolr.test.fakesolr import FakeSolrServer, loadFixture
+
+
+class RequestCoalescerTest(TestCase):
+
+    def setUp(self):
+        self.coalescer = RequestCoalescer(copy=list)
+        self.requests = []
+
+    def request(self):
+        d = Deferred()
+        self.requests.append(d)
+        return d
+
+    def testShared(self):
+        """Concurrent calls with the same key share the request."""
+        d1 = self.coalescer.run('a', self.request)
+        d2 = self.coalescer.run('a', self.request)
+        d3 = self.coalescer.run('b', self.request)
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(self.coalescer.coalesced, 1)
+
+        result = [1]
+        self.requests[0].callback(result)
+        results = []
+        d1.addCallback(results.append)
+        d2.addCallback(results.append)
+        self.assertIdentical(results[0], result)
+        self.assertEqual(results[1], result)
+        self.assertNotIdentical(results[1], result)
+        self.assertFalse(d3.called)
+
+    def testNewRequestAfterResult(self):
+        """Once the result arrives, a new call makes a new request."""
+        self.coalescer.run('a', self.request)
+        self.requests[0].callback([])
+        self.coalescer.run('a', self.request)
+        self.assertEqual(len(self.requests), 2)
+
+    def testFailure(self):
+        """Failures are given to every caller."""
+        d1 = self.coalescer.run('a', self.request)
+        d2 = self.coalescer.run('a', self.request)
+        self.requests[0].errback(ValueError())
+        return gatherResults([self.assertFailure(d1, ValueError),
+                              self.assertFailure(d2, ValueError)])
+
+    def testCancel(self):
+        """Cancelling a caller doesn't affect the others."""
+        d1 = self.coalescer.run('a', self.request)
+        d2 = self.coalescer.run('a', self.request)
+        d1.cancel()
+        self.requests[0].callback([1])
+        results = []
+        d2.addCallback(results.append)
+        self.assertEqual(results, [[1]])
+        return self.assertFailure(d1, CancelledError)
+
+    def testSynchronousRequest(self):
+        """Requests that finish synchronously are not shared."""
+        d = self.coalescer.run('a', lambda: self._fired(1))
+        results = []
+        d.addCallback(results.append)
+        self.assertEqual(results, [1])
+        self.coalescer.run('a', self.request)
+        self.assertEqual(len(self.requests), 1)
+
+    def testSynchronousError(self):
+        """
+        Requests that raise synchronously fail and don't block later calls.
+        """
+        def request():
+            raise ValueError()
+
+        d = self.coalescer.run('a', request)
+        self.coalescer.run('a', self.request)
+        self.assertEqual(len(self.requests), 1)
+        return self.assertFailure(d, ValueError)
+
+    def _fired(self, value):
+        d = Deferred()
+        d.callback(value)
+        return d
+
+
+class ClientCoalesceTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeSolrServer()
+        self.server.resource.defaultResponse = (200,
+                                                loadFixture('select.json'))
+        self.client = SolrClient(self.server.start(), coalesce=True)
+
+    @inlineCallbacks
+    def tearDown(self):
+        yield self.client.close()
+        yield self.server.stop()
+
+    @inlineCallbacks
+    def testSearch(self):
+        """
+        Identical concurrent searches are sent once and every caller gets
+        its own response.
+        """
+        responses = yield gatherResults([self.client.search('*:*', rows=5)
+                                         for _ in range(3)])
+        self.assertEqual(len(self.server.requests), 1)
+        responses[0].results.docs.pop()
+        self.assertEqual(len(responses[1].results.docs), 2)
+        self.assertEqual(len(responses[2].results.docs), 2)
+
+    @inlineCallbacks
+    def testDifferentSearches(self):
+        """Different searches are not coalesced."""
+        yield gatherResults([self.client.search('*:*', rows=5),
+                             self.client.search('*:*', rows=6)])
+        self.assertEqual(len(self.server.requests), 2)
+
+    @inlineCallbacks
+    def testPing(self):
+        """Concurrent pings are coalesced."""
+        yield gatherResults([self.client.ping(), self.client.ping()])
+        self.assertEqual(len(self.server.requests), 1)
+
+    @inlineCallbacks
+    def testFailure(self):
+        """All the callers of a failed request get the failure."""
+        self.server.resource.responses.append((500, ''))
+        d1 = self.client.search('*:*')
+        d2 = self.client.search('*:*')
+        yield self.assertFailure(d1, HTTPWrongStatus)
+        yield self.assertFailure(d2, HTTPWrongStatus)
+        self.assertEqual(len(self.server.requests), 1)
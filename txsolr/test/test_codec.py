@@ -0,0 +1,116 @@
+from twisted.internet.defer import inlineCallbacks
+from twisted.trial.unittest import TestCase
+
+from txsolr.client import SolrClient
+from txsolr.codec import Codec, getCodec, registerCodec
+from txsolr.input import (SimpleXMLInputFactory, JSONInputFactory,
+                          JavabinInputFactory, CSVInputFactory)
+from txsolr.response import JSONSolrResponse, LazyJSONSolrResponse
+from txsolr.test.fakesolr import FakeSolrServer, loadFixture
+
+
+class CodecRegistryTest(TestCase):
+
+    def testBuiltinCodecs(self):
+        """The XML, JSON, javabin and CSV codecs are registered."""
+        factories = [(name, getCodec(name).inputFactory)
+                     for name in ('xml', 'json', 'javabin', 'csv')]
+        self.assertEqual(factories,
+                         [('xml', SimpleXMLInputFactory),
+                          ('json', JSONInputFactory),
+                          ('javabin', JavabinInputFactory),
+                          ('csv', CSVInputFactory)])
+
+    def testUnknownCodec(self):
+        """L{getCodec} raises C{ValueError} for unknown names."""
+        self.assertRaises(ValueError, getCodec, 'yaml')
+
+    def testRegisterCodec(self):
+        """L{registerCodec} makes a codec available by name."""
+        codec = Codec('test', JSONInputFactory, JSONSolrResponse)
+        registerCodec(codec)
+        self.assertIdentical(getCodec('test'), codec)
+
+
+class ClientCodecTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeSolrServer()
+        self.url = self.server.start()
+        self.clients = []
+
+    def createClient(self, **kwargs):
+        client = SolrClient(self.url, **kwargs)
+        self.clients.append(client)
+        return client
+
+    @inlineCallbacks
+    def tearDown(self):
+        for client in self.clients:
+            yield client.close()
+        yield self.server.stop()
+
+    def testCustomInputFactory(self):
+        """The input factory given to L{SolrClient} is used."""
+        factory = JSONInputFactory()
+        client = self.createClient(inputFactory=factory)
+        self.assertIdentical(client.inputFactory, factory)
+
+    def testCodecByName(self):
+        """The codec of L{SolrClient} can be selected by name."""
+        client = self.createClient(codec='json')
+        self.assertIsInstance(client.inputFactory, JSONInputFactory)
+
+    @inlineCallbacks
+    def testResponseClass(self):
+        """The response class given to L{SolrClient} is used."""
+        client = self.createClient(responseClass=LazyJSONSolrResponse)
+        response = yield client.search('*:*')
+        self.assertIsInstance(response, LazyJSONSolrResponse)
+        self.assertEqual(self.server.requests[0].args['wt'], ['json'])
+
+    @inlineCallbacks
+    def testUpdateContentType(self):
+        """Updates are sent with the content type of the codec."""
+        client = self.createClient(codec='json')
+        yield client.add({'id': 1})
+        request = self.server.requests[0]
+        self.assertEqual(request.headers.getRawHeaders('content-type'),
+                         ['application/json'])
+        self.assertEqual(request.args, {'wt': ['json']})
+
+    @inlineCallbacks
+    def testWriterType(self):
+        """Searches ask for the response writer of the codec."""
+        self.server.resource.responses = [
+            (200, loadFixture('select.javabin')),
+            (200, loadFixture('ping.javabin'))]
+        client = self.createClient(codec='javabin')
+        yield client.search('*:*')
+        yield client.ping()
+        self.assertEqual([request.args['wt'] for request in
+                          self.server.requests],
+                         [['javabin'], ['javabin']])
+
+    @inlineCallbacks
+    def testUpdateParams(self):
+        """The parameters of the input are sent in the URL."""
+        self.server.resource.defaultResponse = (
+            200, loadFixture('update.javabin'))
+        client = self.createClient(codec='javabin')
+        yield client.commit(waitSearcher=True)
+        request = self.server.requests[0]
+        self.assertEqual(request.args, {'commit': ['true'],
+                                        'waitSearcher': ['true'],
+                                        'wt': ['javabin']})
+        self.assertEqual(request.headers.getRawHeaders('content-type'),
+                         ['application/javabin'])
+
+    @inlineCallbacks
+    def testDelegatedContentType(self):
+        """Inputs can override the content type of the codec."""
+        client = self.createClient(codec='csv')
+        yield client.commit()
+        request = self.server.requests[0]
+        self.assertEqual(request.headers.getRawHeaders('content-type'),
+                         ['text/xml'])
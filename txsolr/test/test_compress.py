@@ -0,0 +1,177 @@
+import gzip
+import zlib
+from StringIO import StringIO
+
+from twisted.internet.defer import inlineCallbacks, succeed
+from twisted.internet.protocol import Protocol
+from twisted.python.failure import Failure
+from twisted.trial.unittest import TestCase
+from twisted.web.client import ResponseDone
+from twisted.web.iweb import IBodyProducer
+from zope.interface import implements
+
+from txsolr.client import SolrClient
+from txsolr.compress import DeflateDecoder, gzipBody
+from txsolr.test.fakesolr import FakeSolrServer, loadFixture
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=StringIO(data)).read()
+
+
+def rawDeflate(data):
+    compress = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compress.compress(data) + compress.flush()
+
+
+class BodyProtocol(Protocol):
+
+    def __init__(self):
+        self.data = []
+        self.reason = None
+
+    def dataReceived(self, data):
+        self.data.append(data)
+
+    def connectionLost(self, reason):
+        self.reason = reason
+
+
+class FakeResponse(object):
+
+    def deliverBody(self, protocol):
+        self.protocol = protocol
+
+
+class DeflateDecoderTest(TestCase):
+
+    def decode(self, data):
+        response = FakeResponse()
+        protocol = BodyProtocol()
+        DeflateDecoder(response).deliverBody(protocol)
+        for i in range(len(data)):
+            response.protocol.dataReceived(data[i])
+        response.protocol.connectionLost(Failure(ResponseDone()))
+        self.assertIsInstance(protocol.reason.value, ResponseDone)
+        return ''.join(protocol.data)
+
+    def testZlib(self):
+        """Zlib streams are decompressed, even in very small chunks."""
+        self.assertEqual(self.decode(zlib.compress('txsolr' * 100)),
+                         'txsolr' * 100)
+
+    def testRawDeflate(self):
+        """Raw deflate streams are decompressed."""
+        self.assertEqual(self.decode(rawDeflate('txsolr' * 100)),
+                         'txsolr' * 100)
+
+
+class GzipBodyTest(TestCase):
+
+    def testRoundTrip(self):
+        """Bodies are compressed with gzip."""
+        body = '<add><doc/></add>' * 100
+        compressed = gzipBody(body)
+        self.assertTrue(len(compressed) < len(body))
+        self.assertEqual(gunzip(compressed), body)
+
+    def testDeterministic(self):
+        """The same body is always compressed the same way."""
+        self.assertEqual(gzipBody('txsolr'), gzipBody('txsolr'))
+
+
+class CompressionTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeSolrServer()
+        self.url = self.server.start()
+        self.client = None
+
+    def tearDown(self):
+        self.client.close()
+        return self.server.stop()
+
+    @inlineCallbacks
+    def assertDecoded(self, name, encode):
+        self.client = SolrClient(self.url, compression=True)
+        resource = self.server.resource
+        resource.encoding = (name, encode)
+        resource.responses.append((200, loadFixture('select.json')))
+        response = yield self.client.search('*:*')
+        self.assertEqual(response.results.numFound, 2)
+        headers = self.server.requests[0].headers
+        self.assertEqual(headers.getRawHeaders('Accept-Encoding'),
+                         ['gzip,deflate'])
+
+    def testGzipResponse(self):
+        """Gzip responses are decompressed."""
+        return self.assertDecoded('gzip', gzipBody)
+
+    def testDeflateResponse(self):
+        """Deflate responses are decompressed."""
+        return self.assertDecoded('deflate', zlib.compress)
+
+    @inlineCallbacks
+    def testNoCompression(self):
+        """By default, compressed responses are not asked."""
+        self.client = SolrClient(self.url)
+        yield self.client.search('*:*')
+        headers = self.server.requests[0].headers
+        self.assertFalse(headers.hasHeader('Accept-Encoding'))
+
+    @inlineCallbacks
+    def testCompressedUpdates(self):
+        """Large updates are compressed with gzip."""
+        self.client = SolrClient(self.url, compressUpdates=100)
+        yield self.client.add({'id': 1})
+        yield self.client.add({'id': 2, 'text': 'txsolr' * 100})
+        small, large = self.server.requests
+        self.assertFalse(small.headers.hasHeader('Content-Encoding'))
+        self.assertEqual(large.headers.getRawHeaders('Content-Encoding'),
+                         ['gzip'])
+        self.assertEqual(large.headers.getRawHeaders('Content-Type'),
+                         small.headers.getRawHeaders('Content-Type'))
+        self.assertIn('txsolr' * 100, gunzip(large.body))
+
+    @inlineCallbacks
+    def testCompressedCustomProducer(self):
+        """
+        Bodies of producers without URL parameters can be compressed.
+        """
+        self.client = SolrClient(self.url, compressUpdates=100,
+                                 inputFactory=BodyInputFactory())
+        body = '<add><doc><field name="id">1</field></doc></add>' * 10
+        yield self.client.add(body)
+        request = self.server.requests[0]
+        self.assertEqual(request.headers.getRawHeaders('Content-Encoding'),
+                         ['gzip'])
+        self.assertEqual(gunzip(request.body), body)
+
+
+class BodyInputFactory(object):
+    """An input factory that sends the given bodies as they are."""
+
+    contentType = 'text/xml; charset=utf-8'
+
+    def createAdd(self, body, overwrite=None, commitWithin=None):
+        return BodyProducer(body)
+
+
+class BodyProducer(object):
+    """A user-supplied producer of a body, without URL parameters."""
+
+    implements(IBodyProducer)
+
+    def __init__(self, body):
+        self.body = body
+        self.length = len(body)
+
+    def startProducing(self, consumer):
+        consumer.write(self.body)
+        return succeed(None)
+
+    def pauseProducing(self):
+        pass
+
+    def stopProducing(self):
+        pass
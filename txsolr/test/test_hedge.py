@@ -0,0 +1,153 @@
+from twisted.internet import reactor
+from twisted.internet.defer import CancelledError, Deferred, inlineCallbacks
+from twisted.internet.task import Clock, deferLater
+from twisted.trial.unittest import TestCase
+
+from txsolr.client import LoadBalancingSolrClient
+from txsolr.hedge import RequestHedger
+from txsolr.limiter import RequestLimiter
+from txsolr.test.fakesolr import FakeSolrServer
+
+
+class RequestHedgerTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.attempts = []
+
+    def request(self):
+        d = Deferred(lambda d: self.cancelled.append(d))
+        self.attempts.append(d)
+        return d
+
+    def createHedger(self, **kwargs):
+        self.cancelled = []
+        kwargs.setdefault('budget', 100)
+        kwargs.setdefault('initialDelay', 1)
+        return RequestHedger(clock=self.clock, **kwargs)
+
+    def testFastRequest(self):
+        """Requests answered before the delay are not duplicated."""
+        hedger = self.createHedger()
+        d = hedger.run(self.request)
+        self.clock.advance(0.5)
+        self.attempts[0].callback('result')
+        self.assertEqual(self.successResultOf(d), 'result')
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertEqual(hedger.hedged, 0)
+
+    def testSlowRequest(self):
+        """
+        Slow requests are duplicated. The first answer wins and the other
+        attempt is cancelled.
+        """
+        hedger = self.createHedger()
+        d = hedger.run(self.request)
+        self.clock.advance(1)
+        self.assertEqual(len(self.attempts), 2)
+        self.attempts[1].callback('second')
+        self.assertEqual(self.successResultOf(d), 'second')
+        self.assertEqual(self.cancelled, [self.attempts[0]])
+        self.assertEqual(hedger.hedged, 1)
+
+    def testFailedAttempt(self):
+        """A failed attempt waits for the other one."""
+        hedger = self.createHedger()
+        d = hedger.run(self.request)
+        self.clock.advance(1)
+        self.attempts[0].errback(ValueError())
+        self.assertNoResult(d)
+        self.attempts[1].callback('second')
+        self.assertEqual(self.successResultOf(d), 'second')
+
+    def testAllFailed(self):
+        """The failure of the last attempt is reported."""
+        hedger = self.createHedger()
+        d = hedger.run(self.request)
+        self.clock.advance(1)
+        self.attempts[0].errback(ValueError())
+        self.attempts[1].errback(KeyError())
+        self.failureResultOf(d, KeyError)
+
+    def testBudget(self):
+        """The duplicates are limited by the budget."""
+        hedger = self.createHedger(budget=50)
+        for _ in range(4):
+            hedger.run(self.request)
+            self.clock.advance(1)
+        self.assertEqual(len(self.attempts), 6)
+        self.assertEqual(hedger.requests, 4)
+        self.assertEqual(hedger.hedged, 2)
+
+    def testPercentileDelay(self):
+        """The delay is the percentile of the recent latencies."""
+        hedger = self.createHedger(percentile=90, minSamples=10)
+        for latency in range(1, 11):
+            d = hedger.run(self.request)
+            self.clock.advance(latency / 100.0)
+            self.attempts[-1].callback(None)
+            self.successResultOf(d)
+        self.assertAlmostEqual(hedger.delay(), 0.10)
+
+    def testCancel(self):
+        """Cancelling the request cancels every attempt and the timer."""
+        hedger = self.createHedger()
+        d = hedger.run(self.request)
+        self.clock.advance(1)
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.assertEqual(self.cancelled, self.attempts)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def testInvalidPercentile(self):
+        """The percentile must be between 0 and 100."""
+        self.assertRaises(ValueError, RequestHedger, percentile=100)
+
+
+class HedgedSearchTest(TestCase):
+
+    def setUp(self):
+        self.servers = [FakeSolrServer(), FakeSolrServer()]
+        urls = [server.start() for server in self.servers]
+        hedger = RequestHedger(budget=100, initialDelay=0.1)
+        self.client = LoadBalancingSolrClient(urls, hedger=hedger)
+
+    def tearDown(self):
+        self.client.close()
+        return self.servers[0].stop().addCallback(
+            lambda _: self.servers[1].stop())
+
+    @inlineCallbacks
+    def testSlowNode(self):
+        """
+        A search to a slow node is sent to another node, and the slow
+        request is aborted.
+        """
+        slow = self.servers[0].resource
+        slow.hold = True
+        response = yield self.client.search('*:*')
+        self.assertEqual(response.results.numFound, 0)
+        self.assertEqual(len(self.servers[1].requests), 1)
+        # The delay of the duplicate is long enough for the slow request to
+        # arrive before.
+        self.assertEqual(len(slow.requests), 1)
+        yield slow.aborted[0]
+        self.assertEqual(self.client.hedger.hedged, 1)
+
+    @inlineCallbacks
+    def testLimitedHedge(self):
+        """
+        With a limiter, the duplicate of a search waits for a free slot, and
+        it's cancelled if the first attempt wins after it started.
+        """
+        limiter = self.client.limiter = RequestLimiter(maxConcurrent=1)
+        for server in self.servers:
+            server.resource.hold = True
+        d = self.client.search('*:*')
+        while not (limiter.queued() and self.servers[0].requests):
+            yield deferLater(reactor, 0.01, lambda: None)
+        self.servers[0].resource.release()
+        response = yield d
+        self.assertEqual(response.results.numFound, 0)
+        self.assertEqual(limiter.active, 0)
+        self.assertEqual(limiter.queued(), 0)
@@ -1,7 +1,18 @@
+import json
 import unittest
 from datetime import datetime, date
 
-from txsolr.input import SimpleXMLInputFactory, escapeTerm
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import Cooperator
+from twisted.trial.unittest import TestCase
+
+from txsolr.client import SolrClient
+from txsolr.errors import InputError
+from txsolr.input import (FormProducer, IterableProducer,
+                          SimpleXMLInputFactory,
+                          JSONInputFactory, JavabinInputFactory,
+                          CSVInputFactory, escapeTerm)
+from txsolr.test.fakesolr import FakeSolrServer
 
 
 class EscapingTest(unittest.TestCase):
@@ -218,3 +229,489 @@ class SimpleXMLInputFactoryTest(unittest.TestCase):
         input = self.input.createOptimize(maxSegments=2).body
         expected = '<optimize maxSegments="2" />'
         self.assertEqual(input, expected)
+
+    def testCreateStreamingAdd(self):
+        """
+        L{SimpleXMLInputFactory.createStreamingAdd} creates the same body as
+        L{SimpleXMLInputFactory.createAdd}, split in chunks.
+        """
+        documents = [{'id': i, 'text': u'\U0001d1b6 %d' % i}
+                     for i in range(50)]
+        expected = self.input.createAdd(documents, overwrite=True,
+                                        commitWithin=80).body
+        producer = self.input.createStreamingAdd(iter(documents),
+                                                 overwrite=True,
+                                                 commitWithin=80,
+                                                 chunkSize=100)
+        chunks = list(producer._chunks)
+        self.assertEqual(''.join(chunks), expected)
+        self.assertTrue(len(chunks) > 10)
+
+    def testCreateStreamingAddIsLazy(self):
+        """
+        L{SimpleXMLInputFactory.createStreamingAdd} does not consume the
+        documents until the body is produced.
+        """
+        consumed = []
+
+        def documents():
+            for i in range(3):
+                consumed.append(i)
+                yield {'id': i}
+
+        producer = self.input.createStreamingAdd(documents(), chunkSize=1)
+        self.assertEqual(consumed, [])
+        producer._chunks.next()
+        self.assertEqual(consumed, [0])
+
+
+def _decodeCommands(body):
+    """Decode a JSON update body keeping repeated commands."""
+    return json.loads(body, object_pairs_hook=lambda pairs: pairs)
+
+
+class JSONInputFactoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.input = JSONInputFactory()
+
+    def testContentType(self):
+        """L{JSONInputFactory} uses the JSON content type."""
+        self.assertEqual(self.input.contentType, 'application/json')
+
+    def testCreateAdd(self):
+        """
+        L{JSONInputFactory.createAdd} creates one C{add} command for each
+        document.
+        """
+        documents = [{'id': 1, 'text': u'\U0001d1b6'}, {'id': 2}]
+        body = self.input.createAdd(documents).body
+        self.assertEqual(_decodeCommands(body),
+                         [(u'add', [(u'doc', [(u'text', u'\U0001d1b6'),
+                                              (u'id', 1)])]),
+                          (u'add', [(u'doc', [(u'id', 2)])])])
+
+    def testCreateAddValues(self):
+        """
+        L{JSONInputFactory.createAdd} encodes dates, booleans, sequences and
+        skips C{None} values.
+        """
+        document = {'id': 1,
+                    'dt': datetime(2010, 1, 1, 23, 59, 59),
+                    'd': date(2010, 1, 1),
+                    'flag': True,
+                    'links': ('a', None, 'b'),
+                    'nothing': None,
+                    'empty': [None]}
+        body = self.input.createAdd(document).body
+        doc = json.loads(body)['add']['doc']
+        self.assertEqual(doc, {'id': 1,
+                               'dt': '2010-01-01T23:59:59Z',
+                               'd': '2010-01-01T00:00:00Z',
+                               'flag': True,
+                               'links': ['a', 'b']})
+
+    def testCreateAddWithOptions(self):
+        """
+        L{JSONInputFactory.createAdd} adds the C{overwrite} and
+        C{commitWithin} options to every command.
+        """
+        body = self.input.createAdd({'id': 1}, overwrite=False,
+                                    commitWithin=80).body
+        self.assertEqual(json.loads(body),
+                         {'add': {'doc': {'id': 1}, 'overwrite': False,
+                                  'commitWithin': 80}})
+
+    def testCreateAddWithWrongValues(self):
+        """
+        L{JSONInputFactory.createAdd} raises C{AttributeError} if one of the
+        given values is not a proper C{dict} document.
+        """
+        self.assertRaises(AttributeError, self.input.createAdd, None)
+        self.assertRaises(AttributeError, self.input.createAdd, 'string')
+
+    def testCreateAddWithInvalidString(self):
+        """
+        L{JSONInputFactory.createAdd} raises L{InputError} if a value can't
+        be decoded.
+        """
+        self.assertRaises(InputError, self.input.createAdd,
+                          {'id': '\xff\xfe'})
+
+    def testCreateStreamingAdd(self):
+        """
+        L{JSONInputFactory.createStreamingAdd} creates the same body as
+        L{JSONInputFactory.createAdd}, split in chunks.
+        """
+        documents = [{'id': i} for i in range(50)]
+        expected = self.input.createAdd(documents, overwrite=True).body
+        producer = self.input.createStreamingAdd(iter(documents),
+                                                 overwrite=True,
+                                                 chunkSize=100)
+        chunks = list(producer._chunks)
+        self.assertEqual(''.join(chunks), expected)
+        self.assertTrue(len(chunks) > 10)
+
+    def testCreateDelete(self):
+        """
+        L{JSONInputFactory.createDelete} creates one C{delete} command for
+        each ID.
+        """
+        body = self.input.createDelete([1, u'\U0001d1b6']).body
+        self.assertEqual(_decodeCommands(body),
+                         [(u'delete', [(u'id', u'1')]),
+                          (u'delete', [(u'id', u'\U0001d1b6')])])
+
+    def testCreateDeleteByQuery(self):
+        """
+        L{JSONInputFactory.createDeleteByQuery} creates a C{delete} command
+        with a query.
+        """
+        body = self.input.createDeleteByQuery('id:"1"').body
+        self.assertEqual(json.loads(body), {'delete': {'query': 'id:"1"'}})
+
+    def testCommit(self):
+        """
+        L{JSONInputFactory.createCommit} creates a C{commit} command with the
+        given options.
+        """
+        self.assertEqual(json.loads(self.input.createCommit().body),
+                         {'commit': {}})
+        body = self.input.createCommit(waitFlush=True, waitSearcher=False,
+                                       expungeDeletes=True).body
+        self.assertEqual(json.loads(body),
+                         {'commit': {'waitFlush': True,
+                                     'waitSearcher': False,
+                                     'expungeDeletes': True}})
+
+    def testRollback(self):
+        """L{JSONInputFactory.createRollback} creates a C{rollback} command."""
+        self.assertEqual(json.loads(self.input.createRollback().body),
+                         {'rollback': {}})
+
+    def testOptimize(self):
+        """
+        L{JSONInputFactory.createOptimize} creates an C{optimize} command with
+        the given options.
+        """
+        body = self.input.createOptimize(waitFlush=False,
+                                         maxSegments=2).body
+        self.assertEqual(json.loads(body),
+                         {'optimize': {'waitFlush': False, 'maxSegments': 2}})
+
+
+class JavabinInputFactoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.input = JavabinInputFactory()
+
+    def testContentType(self):
+        """L{JavabinInputFactory} uses the javabin content type."""
+        self.assertEqual(self.input.contentType, 'application/javabin')
+
+    def testCreateAdd(self):
+        """
+        L{JavabinInputFactory.createAdd} creates an update message with the
+        options as parameters and an iterator of documents.
+        """
+        body = self.input.createAdd({'id': 1}, overwrite=False).body
+        self.assertEqual(body,
+                         '\x02\xc4'
+                         '\xe0\x26params\xc1\xe0\x29overwrite\x25false'
+                         '\xe0\x27delById\x00'
+                         '\xe0\x26delByQ\x00'
+                         '\xe0\x24docs\x0e'
+                         '\x10\x01\x08\x3f\x80\x00\x00\xe0\x22id\x41'
+                         '\x0f')
+
+    def testCreateStreamingAdd(self):
+        """
+        L{JavabinInputFactory.createStreamingAdd} produces the same message
+        as L{JavabinInputFactory.createAdd}.
+        """
+        documents = [{'id': i, 'name': u'doc %d' % i} for i in range(100)]
+        producer = self.input.createStreamingAdd(iter(documents),
+                                                 commitWithin=10,
+                                                 chunkSize=100)
+        chunks = list(producer._chunks)
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(''.join(chunks),
+                         self.input.createAdd(documents,
+                                              commitWithin=10).body)
+
+    def testCreateDelete(self):
+        """L{JavabinInputFactory.createDelete} sends the IDs as strings."""
+        body = self.input.createDelete([1, u'b']).body
+        self.assertTrue('\xe0\x27delById\x82\x211\x21b' in body)
+
+    def testCreateDeleteByQuery(self):
+        """L{JavabinInputFactory.createDeleteByQuery} sends the query."""
+        body = self.input.createDeleteByQuery(u'id:1').body
+        self.assertTrue('\xe0\x26delByQ\x81\x24id:1' in body)
+
+    def testCommit(self):
+        """
+        L{JavabinInputFactory.createCommit} sends the action and its options
+        as parameters of the request.
+        """
+        producer = self.input.createCommit(waitSearcher=False)
+        self.assertEqual(producer.params,
+                         {'commit': 'true', 'waitSearcher': 'false'})
+        self.assertEqual(producer.body, self.input.createRollback().body)
+
+    def testRollbackAndOptimize(self):
+        """
+        L{JavabinInputFactory.createRollback} and
+        L{JavabinInputFactory.createOptimize} send the action as a parameter.
+        """
+        self.assertEqual(self.input.createRollback().params,
+                         {'rollback': 'true'})
+        self.assertEqual(self.input.createOptimize(maxSegments=2).params,
+                         {'optimize': 'true', 'maxSegments': '2'})
+
+
+class CSVInputFactoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.input = CSVInputFactory()
+
+    def testCreateAdd(self):
+        """
+        L{CSVInputFactory.createAdd} writes a header with all the fields and a
+        row for each document.
+        """
+        documents = [{'id': 1, 'title': u'caf\xe9, "bar"'},
+                     {'id': 2, 'flag': True}]
+        producer = self.input.createAdd(documents)
+        self.assertEqual(producer.body,
+                         'flag,id,title\n'
+                         ',1,"caf\xc3\xa9, ""bar"""\n'
+                         'true,2,\n')
+        self.assertEqual(producer.params, {})
+
+    def testCreateAddMultiValued(self):
+        """
+        Multi-valued fields are joined with the separator and Solr is told to
+        split them.
+        """
+        producer = self.input.createAdd({'id': 1, 'cat': ['a', 'b']},
+                                        overwrite=True, commitWithin=100)
+        self.assertEqual(producer.body, 'cat,id\na|b,1\n')
+        self.assertEqual(producer.params,
+                         {'f.cat.split': 'true', 'f.cat.separator': '|',
+                          'overwrite': 'true', 'commitWithin': '100'})
+
+    def testCreateAddWithSeparator(self):
+        """
+        Values of multi-valued fields containing the separator raise
+        L{InputError}.
+        """
+        self.assertRaises(InputError, self.input.createAdd,
+                          {'cat': ['a|b', 'c']})
+
+    def testOtherActions(self):
+        """The actions that CSV can't express are sent as XML."""
+        producers = [self.input.createDelete(1),
+                     self.input.createDeleteByQuery('*:*'),
+                     self.input.createCommit(),
+                     self.input.createRollback(),
+                     self.input.createOptimize()]
+        xml = SimpleXMLInputFactory()
+        self.assertEqual([p.body for p in producers],
+                         [xml.createDelete(1).body,
+                          xml.createDeleteByQuery('*:*').body,
+                          xml.createCommit().body,
+                          xml.createRollback().body,
+                          xml.createOptimize().body])
+        for producer in producers:
+            self.assertEqual(producer.contentType, xml.contentType)
+
+
+class CSVStreamingAddTest(TestCase):
+
+    def setUp(self):
+        self.input = CSVInputFactory()
+
+    @inlineCallbacks
+    def produce(self, producer):
+        consumer = FakeConsumer()
+        yield producer.startProducing(consumer)
+        self.body = ''.join(consumer.written)
+
+    @inlineCallbacks
+    def testCreateStreamingAdd(self):
+        """
+        L{CSVInputFactory.createStreamingAdd} takes the header and the
+        multi-valued fields from the first document.
+        """
+        documents = [{'id': 1, 'cat': ['a', 'b']},
+                     {'id': 2, 'cat': u'caf\xe9'},
+                     {'id': 3}]
+        producer = self.input.createStreamingAdd(iter(documents),
+                                                 overwrite=False,
+                                                 commitWithin=100,
+                                                 chunkSize=1)
+        self.assertEqual(producer.params,
+                         self.input.createAdd(documents, overwrite=False,
+                                              commitWithin=100).params)
+        yield self.produce(producer)
+        self.assertEqual(self.body,
+                         'cat,id\na|b,1\ncaf\xc3\xa9,2\n,3\n')
+
+    @inlineCallbacks
+    def testEmpty(self):
+        """Without documents the body is empty."""
+        yield self.produce(self.input.createStreamingAdd(iter([])))
+        self.assertEqual(self.body, '')
+
+    def testUnknownField(self):
+        """Fields that are not in the first document raise L{InputError}."""
+        producer = self.input.createStreamingAdd([{'id': 1},
+                                                  {'id': 2, 'title': 'x'}])
+        return self.assertFailure(self.produce(producer), InputError)
+
+    def testUnknownMultiValued(self):
+        """
+        Lists of values for fields that are not multi-valued in the first
+        document raise L{InputError}.
+        """
+        producer = self.input.createStreamingAdd([{'id': 1, 'cat': 'a'},
+                                                  {'id': 2, 'cat': ['b']}])
+        return self.assertFailure(self.produce(producer), InputError)
+
+
+class FakeConsumer(object):
+
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+
+class FormProducerTest(TestCase):
+
+    def testStartProducing(self):
+        """
+        L{FormProducer.startProducing} writes the parts without joining
+        them, as many times as it's called.
+        """
+        static = 'fq=a&rows=10'
+        producer = FormProducer((static, '&q=x'))
+        self.assertEqual(producer.length, 16)
+        self.assertEqual(producer.body, 'fq=a&rows=10&q=x')
+        for _ in range(2):
+            consumer = FakeConsumer()
+            d = producer.startProducing(consumer)
+            self.assertIdentical(consumer.written[0], static)
+            self.assertEqual(consumer.written, [static, '&q=x'])
+            self.assertTrue(d.called)
+
+
+class IterableProducerTest(TestCase):
+
+    def setUp(self):
+        self.scheduled = []
+        self.cooperator = Cooperator(lambda: lambda: True,
+                                     self.scheduled.append)
+
+    def runScheduled(self):
+        while self.scheduled:
+            self.scheduled.pop(0)()
+
+    def testStartProducing(self):
+        """
+        L{IterableProducer.startProducing} writes all the chunks to the
+        consumer and fires the returned L{Deferred} when done.
+        """
+        producer = IterableProducer(iter(['a', 'b', 'c']), self.cooperator)
+        consumer = FakeConsumer()
+        d = producer.startProducing(consumer)
+        self.runScheduled()
+        self.assertEqual(consumer.written, ['a', 'b', 'c'])
+        self.assertTrue(d.called)
+
+    def testPauseProducing(self):
+        """
+        L{IterableProducer.pauseProducing} stops the writes until
+        L{IterableProducer.resumeProducing} is called.
+        """
+        producer = IterableProducer(iter(['a', 'b', 'c']), self.cooperator)
+        consumer = FakeConsumer()
+        producer.startProducing(consumer)
+        self.scheduled.pop(0)()
+        self.assertEqual(consumer.written, ['a'])
+        producer.pauseProducing()
+        self.runScheduled()
+        self.assertEqual(consumer.written, ['a'])
+        producer.resumeProducing()
+        self.runScheduled()
+        self.assertEqual(consumer.written, ['a', 'b', 'c'])
+
+    def testStopProducing(self):
+        """
+        After L{IterableProducer.stopProducing}, no more chunks are written
+        and the L{Deferred} returned by C{startProducing} never fires.
+        """
+        producer = IterableProducer(iter(['a', 'b', 'c']), self.cooperator)
+        consumer = FakeConsumer()
+        results = []
+        producer.startProducing(consumer).addBoth(results.append)
+        self.scheduled.pop(0)()
+        producer.stopProducing()
+        self.runScheduled()
+        self.assertEqual(consumer.written, ['a'])
+        self.assertEqual(results, [])
+
+    def testStopProducingAfterFinished(self):
+        """
+        L{IterableProducer.stopProducing} does nothing once all the chunks
+        are written.
+        """
+        producer = IterableProducer(iter(['a']), self.cooperator)
+        producer.startProducing(FakeConsumer())
+        self.runScheduled()
+        producer.stopProducing()
+
+
+class AddStreamTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeSolrServer()
+        self.client = SolrClient(self.server.start())
+
+    @inlineCallbacks
+    def tearDown(self):
+        yield self.client.close()
+        yield self.server.stop()
+
+    @inlineCallbacks
+    def testAddStream(self):
+        """
+        L{SolrClient.addStream} sends the documents of a generator using
+        chunked transfer encoding.
+        """
+        documents = ({'id': i} for i in range(1000))
+        yield self.client.addStream(documents, chunkSize=1024)
+        request = self.server.requests[0]
+        self.assertEqual(request.headers.getRawHeaders('transfer-encoding'),
+                         ['chunked'])
+        self.assertTrue(request.body.startswith('<add><doc>'))
+        self.assertTrue(request.body.endswith('</doc></add>'))
+        self.assertEqual(request.body.count('<doc>'), 1000)
+
+    @inlineCallbacks
+    def testAddStreamCSV(self):
+        """L{SolrClient.addStream} works with the CSV codec."""
+        client = SolrClient(self.client.url, codec='csv')
+        documents = ({'id': i, 'cat': ['a', 'b']} for i in range(100))
+        try:
+            yield client.addStream(documents, chunkSize=100)
+        finally:
+            yield client.close()
+        request = self.server.requests[0]
+        self.assertEqual(request.headers.getRawHeaders('content-type'),
+                         ['application/csv; charset=utf-8'])
+        self.assertEqual(request.args['f.cat.split'], ['true'])
+        self.assertTrue(request.body.startswith('cat,id\na|b,0\n'))
+        self.assertEqual(request.body.count('\n'), 101)
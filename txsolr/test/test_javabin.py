@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+from datetime import datetime
+
+from twisted.internet.defer import inlineCallbacks
+from twisted.trial.unittest import TestCase
+
+from txsolr.client import SolrClient
+from txsolr.errors import InputError
+from txsolr.input import JavabinInputFactory
+from txsolr.javabin import JavabinEncoder, JavabinDecoder
+from txsolr.response import JavabinSolrResponse
+from txsolr.test.fakesolr import FakeSolrServer, loadFixture
+
+
+class JavabinEncoderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.encoder = JavabinEncoder()
+
+    def testString(self):
+        """Strings are written as UTF-8 with their length in the tag."""
+        self.encoder.writeValue(u'caf\xe9')
+        self.assertEqual(self.encoder.flush(), '\x25caf\xc3\xa9')
+
+    def testLongString(self):
+        """Strings of 31 or more bytes store the length as a vint."""
+        self.encoder.writeValue('a' * 200)
+        self.assertEqual(self.encoder.flush(), '\x3f\xa9\x01' + 'a' * 200)
+
+    def testInvalidString(self):
+        """Byte strings that are not valid UTF-8 raise L{InputError}."""
+        self.assertRaises(InputError, self.encoder.writeValue, '\xff')
+
+    def testSmallInt(self):
+        """Small positive integers take a single byte."""
+        self.encoder.writeValue(5)
+        self.assertEqual(self.encoder.flush(), '\x45')
+
+    def testInt(self):
+        """Bigger integers use the rest of the bits as a vint."""
+        self.encoder.writeValue(300)
+        self.assertEqual(self.encoder.flush(), '\x5c\x12')
+
+    def testNegativeInt(self):
+        """Negative integers are written with 4 bytes."""
+        self.encoder.writeValue(-1)
+        self.assertEqual(self.encoder.flush(), '\x06\xff\xff\xff\xff')
+
+    def testLong(self):
+        """Integers that don't fit in 32 bits are written as longs."""
+        self.encoder.writeValue(1 << 40)
+        self.assertEqual(self.encoder.flush(), '\x70\x80\x80\x80\x80\x80\x02')
+
+    def testHugeInteger(self):
+        """Integers that don't fit in 64 bits raise L{InputError}."""
+        self.assertRaises(InputError, self.encoder.writeValue, 1 << 64)
+
+    def testSimpleValues(self):
+        """C{None}, booleans, floats and dates have their own tags."""
+        for value in (None, True, False, 1.5, datetime(1970, 1, 1, 0, 0, 1)):
+            self.encoder.writeValue(value)
+        self.assertEqual(self.encoder.flush(),
+                         '\x00\x01\x02'
+                         '\x05\x3f\xf8\x00\x00\x00\x00\x00\x00'
+                         '\x09\x00\x00\x00\x00\x00\x00\x03\xe8')
+
+    def testArray(self):
+        """Sequences are written as arrays."""
+        self.encoder.writeValue([1, 2])
+        self.assertEqual(self.encoder.flush(), '\x82\x41\x42')
+
+    def testExternString(self):
+        """Repeated extern strings are written as references."""
+        self.encoder.writeExternString('id')
+        self.encoder.writeExternString('id')
+        self.assertEqual(self.encoder.flush(), '\xe0\x22id\xe1')
+
+    def testInputDocument(self):
+        """
+        Documents are written with a boost and without the C{None} values.
+        """
+        self.encoder.writeInputDocument({'id': 1, 'title': None})
+        self.assertEqual(self.encoder.flush(),
+                         '\x10\x01\x08\x3f\x80\x00\x00\xe0\x22id\x41')
+
+
+class JavabinDecoderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.decoder = JavabinDecoder()
+
+    def testFixtures(self):
+        """
+        Recorded javabin responses are decoded like their JSON equivalents.
+        """
+        for name in ('select', 'empty', 'ping', 'update'):
+            decoded = self.decoder.decode(loadFixture(name + '.javabin'))
+            expected = json.loads(loadFixture(name + '.json'))
+            self.assertEqual(decoded, expected, name)
+
+    def testFloats(self):
+        """Floats are decoded to the value Solr would write in JSON."""
+        response = self.decoder.decode(loadFixture('select.javabin'))
+        self.assertEqual(response['response']['docs'][0]['price'], 1.1)
+
+    def testValues(self):
+        """The values written by L{JavabinEncoder} are decoded."""
+        encoder = JavabinEncoder()
+        encoder.writeVersion()
+        values = [None, True, False, 0, 5, 300, -1, 1 << 40, -(1 << 40),
+                  1.5, u'caf\xe9', 'a' * 100, [1, [2]], {'a': 1},
+                  datetime(2010, 1, 1, 0, 0, 0, 5000)]
+        encoder.writeValue(values)
+        self.assertEqual(self.decoder.decode(encoder.flush()),
+                         [None, True, False, 0, 5, 300, -1, 1 << 40,
+                          -(1 << 40), 1.5, u'caf\xe9', u'a' * 100, [1, [2]],
+                          {'a': 1}, '2010-01-01T00:00:00.005Z'])
+
+    def testUpdateMessage(self):
+        """Update messages created by L{JavabinInputFactory} are decoded."""
+        body = JavabinInputFactory().createAdd([{'id': 1, 'cat': ['a']},
+                                                {'id': 2}]).body
+        self.assertEqual(self.decoder.decode(body),
+                         {'params': [], 'delById': None, 'delByQ': None,
+                          'docs': [{'id': 1, 'cat': ['a']}, {'id': 2}]})
+
+    def testInvalidMessages(self):
+        """Invalid messages raise C{ValueError}."""
+        data = loadFixture('select.javabin')
+        for message in ('', '\x01' + data[1:], data[:-5], data + '\x00',
+                        '\x02\x14'):
+            self.assertRaises(ValueError, self.decoder.decode, message)
+
+
+class JavabinSolrResponseTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeSolrServer()
+        self.server.resource.defaultResponse = (
+            200, loadFixture('select.javabin'))
+        self.url = self.server.start()
+        self.clients = []
+
+    def createClient(self, **kwargs):
+        client = SolrClient(self.url, **kwargs)
+        self.clients.append(client)
+        return client
+
+    @inlineCallbacks
+    def tearDown(self):
+        for client in self.clients:
+            yield client.close()
+        yield self.server.stop()
+
+    @inlineCallbacks
+    def testSearch(self):
+        """A client using the javabin codec decodes javabin responses."""
+        client = self.createClient(codec='javabin')
+        response = yield client.search('*:*')
+        self.assertIsInstance(response, JavabinSolrResponse)
+        self.assertEqual(response.header['QTime'], 3)
+        self.assertEqual(response.results.numFound, 2)
+        self.assertEqual([doc['id'] for doc in response.results.docs],
+                         [u'doc-1', u'doc-2'])
+        self.assertEqual(response.facet_counts['facet_fields']['cat'],
+                         [u'electronics', 12, u'books', 0])
+
+    @inlineCallbacks
+    def testSearchWithWriterType(self):
+        """The response format can be selected for a single request."""
+        client = self.createClient()
+        response = yield client.search('*:*', wt='javabin')
+        self.assertIsInstance(response, JavabinSolrResponse)
+        self.assertEqual(self.server.requests[0].args['wt'], ['javabin'])
+
+    def testUnknownWriterType(self):
+        """Unknown response writers raise C{ValueError}."""
+        client = self.createClient()
+        self.assertRaises(ValueError, client.search, '*:*', wt='ruby')
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import json
+
+from twisted.internet.defer import inlineCallbacks
+from twisted.trial.unittest import TestCase
+
+from txsolr.client import SolrClient
+from txsolr.errors import SolrResponseError
+from txsolr.jsonstream import DocumentStreamParser
+from txsolr.test.fakesolr import FakeSolrServer
+
+
+RESPONSE = json.dumps({
+    'responseHeader': {'status': 0, 'QTime': 3, 'params': {'q': '*:*'}},
+    'response': {
+        'numFound': 3,
+        'start': 0,
+        'docs': [
+            {'id': '1', 'title': u'Naruto ナルト', 'tags': ['a', 'b']},
+            {'id': '2', 'title': 'Tricky "quotes" {and} [brackets]\\'},
+            {'id': '3', 'nested': {'docs': [1, 2]}}]},
+    'facet_counts': {'facet_fields': {'category': ['drama', 2]}}},
+    indent=1)
+
+
+def _parse(body, chunkSize):
+    parser = DocumentStreamParser()
+    docs = []
+    for i in range(0, len(body), chunkSize):
+        parser.feed(body[i:i + chunkSize])
+        while True:
+            doc = parser.nextDocument()
+            if doc is None:
+                break
+            docs.append(doc)
+    parser.end()
+    doc = parser.nextDocument()
+    while doc is not None:
+        docs.append(doc)
+        doc = parser.nextDocument()
+    return docs, parser.skeleton()
+
+
+class DocumentStreamParserTest(TestCase):
+
+    def testParseWholeBody(self):
+        """
+        L{DocumentStreamParser} extracts all the documents of a body given
+        at once.
+        """
+        docs, skeleton = _parse(RESPONSE, len(RESPONSE))
+        self.assertEqual(docs, json.loads(RESPONSE)['response']['docs'])
+
+    def testParseByteByByte(self):
+        """
+        L{DocumentStreamParser} extracts all the documents when the body
+        arrives in very small chunks.
+        """
+        expected = json.loads(RESPONSE)['response']['docs']
+        for chunkSize in (1, 2, 7, 64):
+            docs, skeleton = _parse(RESPONSE, chunkSize)
+            self.assertEqual(docs, expected)
+
+    def testSkeleton(self):
+        """
+        L{DocumentStreamParser.skeleton} returns the response with an empty
+        documents array.
+        """
+        expected = json.loads(RESPONSE)
+        expected['response']['docs'] = []
+        for chunkSize in (1, 5, len(RESPONSE)):
+            docs, skeleton = _parse(RESPONSE, chunkSize)
+            self.assertEqual(json.loads(skeleton), expected)
+
+    def testEmptyDocuments(self):
+        """L{DocumentStreamParser} handles responses without documents."""
+        body = '{"response":{"numFound":0,"start":0,"docs":[]}}'
+        docs, skeleton = _parse(body, 3)
+        self.assertEqual(docs, [])
+        self.assertEqual(skeleton, body)
+
+    def testTruncatedBody(self):
+        """
+        L{DocumentStreamParser} raises L{SolrResponseError} if the body ends
+        in the middle of a document.
+        """
+        body = RESPONSE[:RESPONSE.index('Tricky')]
+        self.assertRaises(SolrResponseError, _parse, body, 10)
+
+    def testSkeletonBeforeEnd(self):
+        """
+        L{DocumentStreamParser.skeleton} raises L{SolrResponseError} if the
+        body is not complete.
+        """
+        parser = DocumentStreamParser()
+        parser.feed('{"response":{"docs":[]')
+        parser.nextDocument()
+        self.assertRaises(SolrResponseError, parser.skeleton)
+
+
+class SearchStreamTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeSolrServer()
+        self.server.resource.defaultResponse = (200, RESPONSE)
+        self.client = SolrClient(self.server.start())
+
+    @inlineCallbacks
+    def tearDown(self):
+        yield self.client.close()
+        yield self.server.stop()
+
+    @inlineCallbacks
+    def testSearchStream(self):
+        """
+        L{SolrClient.searchStream} gives every document to the callback and
+        fires with the rest of the response.
+        """
+        docs = []
+        response = yield self.client.searchStream('*:*', docs.append)
+        self.assertEqual([doc['id'] for doc in docs], ['1', '2', '3'])
+        self.assertEqual(response.results.numFound, 3)
+        self.assertEqual(response.results.docs, [])
+        self.assertEqual(response.facet_counts['facet_fields'],
+                         {'category': ['drama', 2]})
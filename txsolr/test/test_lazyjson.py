@@ -0,0 +1,79 @@
+import json
+
+from twisted.trial.unittest import TestCase
+
+from txsolr.errors import SolrResponseError
+from txsolr.lazyjson import LazyArray, LazyObject, plain
+
+
+class LazyArrayTest(TestCase):
+
+    def setUp(self):
+        self.decoder = json.JSONDecoder()
+
+    def testItemsDecodedOnDemand(self):
+        """Items are only decoded up to the one being accessed."""
+        array = LazyArray('[ {"a": 1} , {"b": 2}, bad]', 0, self.decoder)
+        self.assertEqual(array[1], {'b': 2})
+        self.assertEqual(array[:2], [{'a': 1}, {'b': 2}])
+        self.assertRaises(SolrResponseError, len, array)
+
+    def testIteration(self):
+        """L{LazyArray} can be iterated, indexed and sliced."""
+        array = LazyArray('[1, 2, 3]', 0, self.decoder)
+        self.assertEqual(list(array), [1, 2, 3])
+        self.assertEqual(array[-1], 3)
+        self.assertEqual(array[:2], [1, 2])
+        self.assertEqual(len(array), 3)
+        self.assertRaises(IndexError, lambda: array[3])
+
+    def testEmpty(self):
+        """An empty array ends right after it's closed."""
+        array = LazyArray('[ ], 1', 0, self.decoder)
+        self.assertEqual(array.end(), 3)
+        self.assertEqual(list(array), [])
+
+    def testWrap(self):
+        """The decoded items are given to C{wrap}."""
+        array = LazyArray('[1, 2]', 0, self.decoder, str)
+        self.assertEqual(list(array), ['1', '2'])
+
+    def testNotAnArray(self):
+        """A value which is not an array raises L{SolrResponseError}."""
+        self.assertRaises(SolrResponseError, LazyArray, '{}', 0, self.decoder)
+
+
+class LazyObjectTest(TestCase):
+
+    def setUp(self):
+        self.decoder = json.JSONDecoder()
+
+    def testMembersDecodedOnDemand(self):
+        """Members are only decoded up to the one being accessed."""
+        obj = LazyObject('{"a": 1, "b": [2], "c": bad}', 0, self.decoder)
+        self.assertEqual(obj['a'], 1)
+        self.assertEqual(obj['b'], [2])
+        self.assertRaises(SolrResponseError, obj.get, 'c')
+
+    def testMissingMember(self):
+        """Missing members raise C{KeyError}."""
+        obj = LazyObject('{"a": 1}', 0, self.decoder)
+        self.assertRaises(KeyError, lambda: obj['b'])
+        self.assertFalse('b' in obj)
+        self.assertEqual(obj.keys(), ['a'])
+
+    def testLazyMembers(self):
+        """
+        Members in C{lazyMembers} become lazy containers, which are skipped
+        when a later member is accessed.
+        """
+        body = '{"a": {"docs": [1, 2]}, "b": true}'
+
+        def lazyResults(body, pos, decoder):
+            return LazyObject(body, pos, decoder, {'docs': LazyArray})
+
+        obj = LazyObject(body, 0, self.decoder, {'a': lazyResults})
+        self.assertIsInstance(obj['a'], LazyObject)
+        self.assertIsInstance(obj['a']['docs'], LazyArray)
+        self.assertEqual(obj['b'], True)
+        self.assertEqual(plain(obj), {'a': {'docs': [1, 2]}, 'b': True})
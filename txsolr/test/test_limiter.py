@@ -0,0 +1,141 @@
+from twisted.internet.defer import CancelledError, Deferred, inlineCallbacks
+from twisted.internet.defer import gatherResults
+from twisted.trial.unittest import TestCase
+
+from txsolr.client import SolrClient
+from txsolr.errors import RequestQueueFull
+from txsolr.limiter import RequestLimiter, QUERY, UPDATE, ADMIN
+from txsolr.test.fakesolr import FakeSolrServer
+
+
+class RequestLimiterTest(TestCase):
+
+    def setUp(self):
+        self.started = []
+
+    def request(self, name):
+        def start():
+            d = Deferred()
+            self.started.append((name, d))
+            return d
+        return start
+
+    def finish(self, index=0):
+        name, d = self.started[index]
+        d.callback(name)
+
+    def testMaxConcurrent(self):
+        """At most C{maxConcurrent} requests run at the same time."""
+        limiter = RequestLimiter(maxConcurrent=2)
+        for name in 'abc':
+            limiter.run(QUERY, self.request(name))
+        self.assertEqual([name for name, _ in self.started], ['a', 'b'])
+        self.assertEqual(limiter.active, 2)
+        self.assertEqual(limiter.queued(), 1)
+        self.finish()
+        self.assertEqual([name for name, _ in self.started], ['a', 'b', 'c'])
+
+    def testResult(self):
+        """The L{Deferred} of a queued request fires with its result."""
+        limiter = RequestLimiter(maxConcurrent=1)
+        limiter.run(QUERY, self.request('a'))
+        d = limiter.run(QUERY, self.request('b'))
+        self.finish(0)
+        self.finish(1)
+        results = []
+        d.addCallback(results.append)
+        self.assertEqual(results, ['b'])
+        self.assertEqual(limiter.active, 0)
+
+    def testPriorities(self):
+        """Queries go before updates and updates before admin requests."""
+        limiter = RequestLimiter(maxConcurrent=1)
+        limiter.run(UPDATE, self.request('first'))
+        limiter.run(ADMIN, self.request('optimize'))
+        limiter.run(UPDATE, self.request('add1'))
+        limiter.run(QUERY, self.request('search'))
+        limiter.run(UPDATE, self.request('add2'))
+        for i in range(4):
+            self.finish(i)
+        self.assertEqual([name for name, _ in self.started],
+                         ['first', 'search', 'add1', 'add2', 'optimize'])
+
+    def testQueueLimit(self):
+        """
+        Requests fail with L{RequestQueueFull} when the queue of their
+        priority is full.
+        """
+        limiter = RequestLimiter(maxConcurrent=1,
+                                 maxQueued={QUERY: 1, UPDATE: 0})
+        limiter.run(QUERY, self.request('a'))
+        limiter.run(QUERY, self.request('b'))
+        limiter.run(ADMIN, self.request('c'))
+        self.assertEqual(limiter.queued(ADMIN), 1)
+        return gatherResults([
+            self.assertFailure(limiter.run(QUERY, self.request('d')),
+                               RequestQueueFull),
+            self.assertFailure(limiter.run(UPDATE, self.request('e')),
+                               RequestQueueFull)])
+
+    def testCancelQueued(self):
+        """Cancelling a queued request removes it from the queue."""
+        limiter = RequestLimiter(maxConcurrent=1)
+        limiter.run(QUERY, self.request('a'))
+        d = limiter.run(QUERY, self.request('b'))
+        d.cancel()
+        self.assertEqual(limiter.queued(), 0)
+        self.finish()
+        self.assertEqual(len(self.started), 1)
+        return self.assertFailure(d, CancelledError)
+
+    def testCancelStarted(self):
+        """
+        Cancelling a request that was queued and then started cancels the
+        L{Deferred} of the request.
+        """
+        limiter = RequestLimiter(maxConcurrent=1)
+        limiter.run(QUERY, self.request('a'))
+        cancelled = []
+
+        def request():
+            return Deferred(cancelled.append)
+
+        d = limiter.run(QUERY, request)
+        self.finish()
+        self.assertEqual(limiter.active, 1)
+        d.cancel()
+        self.assertEqual(len(cancelled), 1)
+        self.assertEqual(limiter.active, 0)
+        return self.assertFailure(d, CancelledError)
+
+    def testFailedRequest(self):
+        """Failed requests release their slot."""
+        limiter = RequestLimiter(maxConcurrent=1)
+        d = limiter.run(QUERY, lambda: 1 / 0)
+        self.assertEqual(limiter.active, 0)
+        return self.assertFailure(d, ZeroDivisionError)
+
+
+class ClientLimiterTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeSolrServer()
+        self.limiter = RequestLimiter(maxConcurrent=1)
+        self.client = SolrClient(self.server.start(), limiter=self.limiter)
+
+    @inlineCallbacks
+    def tearDown(self):
+        yield self.client.close()
+        yield self.server.stop()
+
+    @inlineCallbacks
+    def testPriorities(self):
+        """The client gives priority to searches over updates."""
+        yield gatherResults([self.client.add({'id': 1}),
+                             self.client.optimize(),
+                             self.client.add({'id': 2}),
+                             self.client.search('*:*')])
+        paths = [request.path for request in self.server.requests]
+        self.assertEqual(paths, ['/solr/update', '/solr/select',
+                                 '/solr/update', '/solr/update'])
+        self.assertIn('<optimize', self.server.requests[-1].body)
@@ -0,0 +1,113 @@
+import logging
+
+from twisted.internet.defer import inlineCallbacks
+from twisted.trial.unittest import TestCase
+
+from txsolr.client import SolrClient
+from txsolr.logs import BodyDump, redact, truncate
+from txsolr.test.fakesolr import FakeSolrServer
+
+
+class TruncateTest(TestCase):
+
+    def testShort(self):
+        """Short texts are not changed."""
+        self.assertEqual(truncate('txsolr', 6), 'txsolr')
+        self.assertEqual(truncate('txsolr', None), 'txsolr')
+
+    def testLong(self):
+        """Long texts are cut, saying how much was left out."""
+        self.assertEqual(truncate('txsolr', 2), 'tx... (4 more bytes)')
+
+
+class RedactTest(TestCase):
+
+    def testFormats(self):
+        """Secrets are hidden in URLs, JSON and XML."""
+        self.assertEqual(redact('q=*:*&password=abc&rows=1'),
+                         'q=*:*&password=***&rows=1')
+        self.assertEqual(redact('{"api_key": "k1", "id": 1}'),
+                         '{"api_key": "***", "id": 1}')
+        self.assertEqual(redact('<field name="token">t1</field>'),
+                         '<field name="token">***</field>')
+
+    def testNoSecrets(self):
+        """Texts without secrets are not changed."""
+        self.assertEqual(redact('q=title:txsolr'), 'q=title:txsolr')
+        self.assertEqual(redact('secret=1', pattern=None), 'secret=1')
+
+
+class BodyDumpTest(TestCase):
+
+    def testSample(self):
+        """Requests are dumped at the given rate."""
+        values = iter([0.1, 0.5, 0.9])
+        dump = BodyDump(rate=0.5, random=lambda: next(values))
+        self.assertEqual([dump.sample() for _ in range(3)],
+                         [True, False, False])
+
+    def testFormat(self):
+        """Dumped bodies are truncated and redacted."""
+        dump = BodyDump(maxBytes=12)
+        self.assertEqual(dump.format('password=abc&q=*:*'),
+                         'password=***... (6 more bytes)')
+
+
+class _Handler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class ClientLoggingTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeSolrServer()
+        self.url = self.server.start()
+        self.handler = _Handler()
+        logger = logging.getLogger('txsolr')
+        logger.addHandler(self.handler)
+        self.addCleanup(logger.removeHandler, self.handler)
+        self.addCleanup(logger.setLevel, logger.level)
+        logger.setLevel(logging.DEBUG)
+        self.client = None
+
+    def tearDown(self):
+        self.client.close()
+        return self.server.stop()
+
+    def logged(self, text):
+        return [message for message in self.handler.messages
+                if text in message]
+
+    @inlineCallbacks
+    def testNoBodies(self):
+        """Without a L{BodyDump}, bodies are never logged."""
+        self.client = SolrClient(self.url)
+        yield self.client.add({'id': 'unique-value'})
+        yield self.client.search('*:*')
+        self.assertEqual(self.logged('unique-value'), [])
+        self.assertEqual(self.logged('numFound'), [])
+        self.assertEqual(len(self.logged('Requesting')), 2)
+
+    @inlineCallbacks
+    def testDump(self):
+        """Sampled bodies are dumped, redacted."""
+        self.client = SolrClient(self.url, bodyDump=BodyDump(rate=1))
+        yield self.client.add({'id': 'unique-value', 'password': 'abc'})
+        [request] = self.logged('Request body')
+        self.assertIn('unique-value', request)
+        self.assertNotIn('abc', request)
+        self.assertEqual(len(self.logged('Response body')), 1)
+
+    @inlineCallbacks
+    def testDebugDisabled(self):
+        """Nothing is dumped unless the debug level is enabled."""
+        logging.getLogger('txsolr').setLevel(logging.INFO)
+        self.client = SolrClient(self.url, bodyDump=BodyDump(rate=1))
+        yield self.client.add({'id': 'unique-value'})
+        self.assertEqual(self.handler.messages, [])
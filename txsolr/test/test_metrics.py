@@ -0,0 +1,161 @@
+from twisted.internet.defer import inlineCallbacks
+from twisted.trial.unittest import TestCase
+from zope.interface.verify import verifyObject
+
+from txsolr.client import SolrClient
+from txsolr.errors import HTTPWrongStatus
+from txsolr.metrics import (IRequestObserver, RequestRecord, Histogram,
+                            RequestMetrics, toPrometheus)
+from txsolr.test.fakesolr import FakeSolrServer, loadFixture
+
+
+def createRecord(handler='/select', status=200, total=0.3, qTime=20):
+    record = RequestRecord('http://a/solr', 'GET', handler, 10.0)
+    record.connected = 10.0
+    record.headersReceived = 10.1
+    record.finished = 10.0 + total
+    record.decode = 0.05
+    record.status = status
+    record.qTime = qTime
+    record.bytesReceived = 100
+    return record
+
+
+class RequestRecordTest(TestCase):
+
+    def testPhases(self):
+        """The phases are computed from the timestamps."""
+        phases = createRecord().phases()
+        self.assertEqual(sorted(phases), ['connect', 'decode', 'firstByte',
+                                          'qTime', 'total', 'transfer'])
+        self.assertAlmostEqual(phases['connect'], 0)
+        self.assertAlmostEqual(phases['firstByte'], 0.1)
+        self.assertAlmostEqual(phases['transfer'], 0.15)
+        self.assertAlmostEqual(phases['decode'], 0.05)
+        self.assertAlmostEqual(phases['total'], 0.3)
+        self.assertAlmostEqual(phases['qTime'], 0.02)
+
+    def testMissingPhases(self):
+        """The phases that didn't happen are left out."""
+        record = RequestRecord('http://a/solr', 'GET', '/select', 10.0)
+        record.finished = 12.0
+        self.assertEqual(record.phases(), {'total': 2.0})
+
+
+class HistogramTest(TestCase):
+
+    def testObserve(self):
+        """Values are counted in the first bucket that holds them."""
+        histogram = Histogram([1, 2])
+        for value in (0.5, 1, 1.5, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.sum, 6.0)
+
+    def testQuantile(self):
+        """Quantiles are interpolated inside their bucket."""
+        histogram = Histogram([1, 2, 3])
+        self.assertEqual(histogram.quantile(0.5), None)
+        for value in (0.5, 1.5, 1.5, 2.5):
+            histogram.observe(value)
+        self.assertEqual(histogram.quantile(0.5), 1.5)
+        self.assertEqual(histogram.quantile(1), 3)
+
+
+class RequestMetricsTest(TestCase):
+
+    def testInterface(self):
+        """L{RequestMetrics} is a request observer."""
+        verifyObject(IRequestObserver, RequestMetrics())
+
+    def testRequestDone(self):
+        """Records are aggregated by handler."""
+        metrics = RequestMetrics()
+        metrics.requestDone(createRecord())
+        metrics.requestDone(createRecord(total=0.6))
+        record = createRecord('/update', status=None, qTime=None)
+        record.error = 'HTTPRequestError'
+        metrics.requestDone(record)
+        self.assertEqual(metrics.histograms[('/select', 'total')].count, 2)
+        self.assertNotIn(('/update', 'qTime'), metrics.histograms)
+        self.assertEqual(metrics.requests,
+                         {('/select', '200'): 2,
+                          ('/update', 'HTTPRequestError'): 1})
+        self.assertEqual(metrics.bytes, {('/select', 'received'): 200,
+                                         ('/update', 'received'): 100})
+
+    def testPrometheus(self):
+        """The metrics are exported in the Prometheus text format."""
+        metrics = RequestMetrics(buckets=[0.1, 1])
+        record = RequestRecord('http://a/solr', 'GET', '/select', 10.0)
+        record.finished = 10.5
+        record.status = 200
+        record.bytesSent = 10
+        metrics.requestDone(record)
+        self.assertEqual(toPrometheus(metrics).splitlines(), [
+            '# HELP txsolr_request_phase_seconds Time spent in each phase '
+            'of the requests.',
+            '# TYPE txsolr_request_phase_seconds histogram',
+            'txsolr_request_phase_seconds_bucket'
+            '{handler="/select",le="0.1",phase="total"} 0',
+            'txsolr_request_phase_seconds_bucket'
+            '{handler="/select",le="1",phase="total"} 1',
+            'txsolr_request_phase_seconds_bucket'
+            '{handler="/select",le="+Inf",phase="total"} 1',
+            'txsolr_request_phase_seconds_sum'
+            '{handler="/select",phase="total"} 0.5',
+            'txsolr_request_phase_seconds_count'
+            '{handler="/select",phase="total"} 1',
+            '# HELP txsolr_requests_total Requests by handler and status.',
+            '# TYPE txsolr_requests_total counter',
+            'txsolr_requests_total{handler="/select",status="200"} 1',
+            '# HELP txsolr_body_bytes_total Bytes of the bodies of requests '
+            'and responses.',
+            '# TYPE txsolr_body_bytes_total counter',
+            'txsolr_body_bytes_total{direction="sent",handler="/select"} 10'])
+
+
+class ClientObserverTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeSolrServer()
+        self.url = self.server.start()
+        self.records = []
+        self.requestDone = self.records.append
+        self.client = SolrClient(self.url, observer=self)
+
+    def tearDown(self):
+        self.client.close()
+        return self.server.stop()
+
+    @inlineCallbacks
+    def testSearch(self):
+        """Every request is reported with its phases and sizes."""
+        body = loadFixture('select.json')
+        self.server.resource.responses.append((200, body))
+        yield self.client.search('*:*')
+        yield self.client.search('*:*')
+        first, second = self.records
+        self.assertEqual(first.url, self.url)
+        self.assertEqual((first.method, first.handler), ('GET', '/select'))
+        self.assertEqual(first.status, 200)
+        self.assertEqual(first.error, None)
+        self.assertEqual(first.qTime, 3)
+        self.assertEqual(first.bytesReceived, len(body))
+        self.assertNotEqual(first.decode, None)
+        self.assertEqual(sorted(first.phases()),
+                         ['connect', 'decode', 'firstByte', 'qTime', 'total',
+                          'transfer'])
+        self.assertEqual((first.reused, second.reused), (False, True))
+
+    @inlineCallbacks
+    def testFailure(self):
+        """Failed requests are reported too."""
+        self.server.resource.responses.append((500, 'Error'))
+        yield self.assertFailure(self.client.add({'id': 1}), HTTPWrongStatus)
+        [record] = self.records
+        self.assertEqual((record.method, record.handler), ('POST', '/update'))
+        self.assertEqual(record.status, 500)
+        self.assertEqual(record.error, 'HTTPWrongStatus')
+        self.assertTrue(record.bytesSent > 0)
@@ -0,0 +1,238 @@
+import json
+
+from twisted.internet.defer import Deferred, inlineCallbacks
+from twisted.trial.unittest import TestCase
+
+from txsolr.client import SolrClient
+from txsolr.errors import HTTPWrongStatus
+from txsolr.paging import SearchIterator
+from txsolr.response import JSONSolrResponse
+from txsolr.test.fakesolr import FakeSolrResource, FakeSolrServer
+
+
+class PagingResource(FakeSolrResource):
+    """
+    A L{FakeSolrResource} that pages over a fixed list of documents using
+    C{start} or C{cursorMark}.
+    """
+
+    def __init__(self, numDocs, supportsCursor=True):
+        FakeSolrResource.__init__(self)
+        self.docs = [{'id': '%04d' % i} for i in range(numDocs)]
+        self.supportsCursor = supportsCursor
+
+    def render(self, request):
+        if self.responses:
+            return FakeSolrResource.render(self, request)
+        FakeSolrResource.render(self, request)
+        rows = int(request.args.get('rows', ['10'])[0])
+        start = int(request.args.get('start', ['0'])[0])
+        cursorMark = request.args.get('cursorMark', [None])[0]
+        response = {'responseHeader': {'status': 0, 'QTime': 1}}
+
+        if cursorMark is not None and self.supportsCursor:
+            start = 0 if cursorMark == '*' else int(cursorMark)
+            docs = self.docs[start:start + rows]
+            if docs:
+                response['nextCursorMark'] = str(start + len(docs))
+            else:
+                response['nextCursorMark'] = cursorMark
+        else:
+            docs = self.docs[start:start + rows]
+
+        response['response'] = {'numFound': len(self.docs), 'start': start,
+                                'docs': docs}
+        return json.dumps(response)
+
+
+class SearchIteratorTest(TestCase):
+
+    def startServer(self, resource):
+        self.server = FakeSolrServer(resource)
+        self.client = SolrClient(self.server.start())
+
+    @inlineCallbacks
+    def tearDown(self):
+        yield self.client.close()
+        yield self.server.stop()
+
+    @inlineCallbacks
+    def consume(self, iterator):
+        ids = []
+        while True:
+            doc = yield iterator.next()
+            if doc is None:
+                break
+            ids.append(doc['id'])
+        self.ids = ids
+
+    @inlineCallbacks
+    def testCursorPaging(self):
+        """
+        L{SolrClient.iterSearch} walks over all the documents using
+        C{cursorMark}, adding the unique key to the sort.
+        """
+        self.startServer(PagingResource(25))
+        iterator = self.client.iterSearch('*:*', rows=10)
+        yield self.consume(iterator)
+        self.assertEqual(self.ids, ['%04d' % i for i in range(25)])
+        self.assertEqual(iterator.numFound, 25)
+
+        requests = self.server.requests
+        self.assertEqual([r.args['cursorMark'][0] for r in requests],
+                         ['*', '10', '20'])
+        self.assertEqual(requests[0].args['sort'], ['id asc'])
+        for request in requests:
+            self.assertFalse('start' in request.args)
+
+    @inlineCallbacks
+    def testCursorWithSort(self):
+        """
+        L{SolrClient.iterSearch} adds the unique key to a given sort when
+        using cursors.
+        """
+        self.startServer(PagingResource(5))
+        yield self.consume(self.client.iterSearch('*:*', sort='score desc'))
+        self.assertEqual(self.server.requests[0].args['sort'],
+                         ['score desc, id asc'])
+
+    @inlineCallbacks
+    def testStartFallback(self):
+        """
+        L{SolrClient.iterSearch} falls back to C{start} based paging if the
+        server does not return a C{nextCursorMark}.
+        """
+        self.startServer(PagingResource(25, supportsCursor=False))
+        yield self.consume(self.client.iterSearch('*:*', rows=10))
+        self.assertEqual(self.ids, ['%04d' % i for i in range(25)])
+        starts = [r.args.get('start', ['0'])[0]
+                  for r in self.server.requests]
+        self.assertEqual(starts, ['0', '10', '20'])
+
+    @inlineCallbacks
+    def testEmptyResults(self):
+        """L{SearchIterator} handles queries without results."""
+        self.startServer(PagingResource(0))
+        yield self.consume(self.client.iterSearch('*:*'))
+        self.assertEqual(self.ids, [])
+        yield self.consume(self.client.iterSearch('*:*', cursor=False))
+        self.assertEqual(self.ids, [])
+
+    @inlineCallbacks
+    def testSearchAll(self):
+        """
+        L{SolrClient.searchAll} calls the callback with every document and
+        waits for the L{Deferred}s it returns.
+        """
+        from twisted.internet import reactor
+        self.startServer(PagingResource(30))
+        ids = []
+
+        def callback(doc):
+            ids.append(doc['id'])
+            if len(ids) % 7 == 0:
+                d = Deferred()
+                reactor.callLater(0, d.callback, None)
+                return d
+
+        count = yield self.client.searchAll('*:*', callback, rows=8)
+        self.assertEqual(count, 30)
+        self.assertEqual(ids, ['%04d' % i for i in range(30)])
+
+    def testSearchAllError(self):
+        """
+        L{SolrClient.searchAll} fails if one of the pages can't be fetched.
+        """
+        resource = PagingResource(30)
+        resource.responses = [(500, 'error')]
+        self.startServer(resource)
+        d = self.client.searchAll('*:*', lambda doc: None)
+        return self.assertFailure(d, HTTPWrongStatus)
+
+
+class FakeClient(object):
+    """A client whose searches are answered manually by the test."""
+
+    def __init__(self):
+        self.searches = []
+
+    def search(self, query, **kwargs):
+        d = Deferred()
+        self.searches.append((kwargs, d))
+        return d
+
+    def prepare(self, **kwargs):
+        return kwargs
+
+    def searchPrepared(self, prepared, query, **values):
+        params = dict(prepared)
+        params.update(values)
+        return self.search(query, **params)
+
+    def answer(self, index, numFound, docs):
+        body = json.dumps({
+            'responseHeader': {'status': 0},
+            'response': {'numFound': numFound, 'start': 0, 'docs': docs}})
+        self.searches[index][1].callback(JSONSolrResponse(body))
+
+
+class PrefetchTest(TestCase):
+
+    def testStartPagingPrefetch(self):
+        """
+        With C{start} based paging, L{SearchIterator} requests up to
+        C{prefetch} pages ahead of the page being consumed, once the number
+        of results is known.
+        """
+        client = FakeClient()
+        iterator = SearchIterator(client, '*:*', rows=10, prefetch=2,
+                                  cursor=False)
+        pages = []
+        iterator.nextPage().addCallback(pages.append)
+        self.assertEqual(len(client.searches), 1)
+
+        client.answer(0, 100, [{'id': 1}] * 10)
+        self.assertEqual(len(pages), 1)
+        self.assertEqual([kwargs['start'] for kwargs, _ in client.searches],
+                         [0, 10, 20])
+
+        iterator.nextPage().addCallback(pages.append)
+        self.assertEqual(len(client.searches), 4)
+        self.assertEqual(len(pages), 1)
+
+        client.answer(1, 100, [{'id': 2}] * 10)
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(len(client.searches), 4)
+
+    def testCursorPagingPrefetch(self):
+        """
+        With cursors, L{SearchIterator} requests the next page as soon as
+        the current one arrives.
+        """
+        client = FakeClient()
+        iterator = SearchIterator(client, '*:*', rows=1, prefetch=1)
+        pages = []
+        iterator.nextPage().addCallback(pages.append)
+        self.assertEqual(len(client.searches), 1)
+
+        body = json.dumps({
+            'responseHeader': {'status': 0}, 'nextCursorMark': 'AB',
+            'response': {'numFound': 3, 'start': 0, 'docs': [{'id': 1}]}})
+        client.searches[0][1].callback(JSONSolrResponse(body))
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(len(client.searches), 2)
+        self.assertEqual(client.searches[1][0]['cursorMark'], 'AB')
+
+    def testNoPrefetch(self):
+        """
+        L{SearchIterator} does not request pages ahead if C{prefetch} is
+        C{0}.
+        """
+        client = FakeClient()
+        iterator = SearchIterator(client, '*:*', rows=10, prefetch=0,
+                                  cursor=False)
+        iterator.nextPage()
+        client.answer(0, 100, [{'id': 1}] * 10)
+        self.assertEqual(len(client.searches), 1)
+        iterator.nextPage()
+        self.assertEqual(len(client.searches), 2)
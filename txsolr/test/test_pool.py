@@ -0,0 +1,85 @@
+from twisted.internet.defer import inlineCallbacks
+from twisted.trial.unittest import TestCase
+
+from txsolr.client import SolrClient
+from txsolr.errors import HTTPRequestError
+from txsolr.test.fakesolr import FakeSolrServer
+
+
+class ConnectionPoolTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeSolrServer()
+        self.url = self.server.start()
+        self.clients = []
+
+    def createClient(self, **kwargs):
+        client = SolrClient(self.url, **kwargs)
+        self.clients.append(client)
+        return client
+
+    @inlineCallbacks
+    def tearDown(self):
+        for client in self.clients:
+            yield client.close()
+        yield self.server.stop()
+
+    @inlineCallbacks
+    def testRequestsReuseConnection(self):
+        """
+        Consecutive requests made by a L{SolrClient} use the same persistent
+        connection.
+        """
+        client = self.createClient()
+        for _ in range(3):
+            yield client.search('*:*')
+        ports = set(request.peerPort for request in self.server.requests)
+        self.assertEqual(len(ports), 1)
+
+    @inlineCallbacks
+    def testNonPersistentClient(self):
+        """
+        A non persistent L{SolrClient} uses a new connection for every
+        request.
+        """
+        client = self.createClient(persistent=False)
+        for _ in range(3):
+            yield client.search('*:*')
+        ports = set(request.peerPort for request in self.server.requests)
+        self.assertEqual(len(ports), 3)
+
+    @inlineCallbacks
+    def testMaxRequestsPerConnection(self):
+        """
+        A connection is retired after serving C{maxRequestsPerConnection}
+        requests.
+        """
+        client = self.createClient(maxRequestsPerConnection=2)
+        for _ in range(4):
+            yield client.search('*:*')
+        ports = [request.peerPort for request in self.server.requests]
+        self.assertEqual(ports[0], ports[1])
+        self.assertEqual(ports[2], ports[3])
+        self.assertNotEqual(ports[1], ports[2])
+
+    @inlineCallbacks
+    def testCloseWaitsForPendingRequests(self):
+        """
+        L{SolrClient.close} lets the pending requests finish before closing
+        the connections.
+        """
+        client = self.createClient()
+        d = client.search('*:*')
+        yield client.close()
+        self.assertTrue(d.called)
+        response = yield d
+        self.assertEqual(response.results.numFound, 0)
+        self.assertEqual(client.pool._connections, {})
+
+    def testRequestAfterClose(self):
+        """
+        Requests made after L{SolrClient.close} fail with L{HTTPRequestError}.
+        """
+        client = self.createClient()
+        client.close()
+        return self.assertFailure(client.search('*:*'), HTTPRequestError)
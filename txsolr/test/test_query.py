@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+import json
+import urlparse
+
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import deferLater
+from twisted.python.failure import Failure
+from twisted.trial.unittest import TestCase
+from twisted.web.server import NOT_DONE_YET
+
+from txsolr.client import SolrClient
+from txsolr.errors import HTTPWrongStatus
+from txsolr.input import FormProducer
+from txsolr.query import PreparedQuery, encodeParams, mergeSearches
+from txsolr.response import JSONSolrResponse
+from txsolr.retry import RetryPolicy
+from txsolr.test.fakesolr import FakeSolrResource, FakeSolrServer
+
+
+class EncodeParamsTest(TestCase):
+
+    def testUnderscores(self):
+        """Underscores in the names become dots."""
+        self.assertEqual(encodeParams({'facet_field': 'cat'}),
+                         'facet.field=cat')
+
+    def testSorted(self):
+        """The parameters are sorted by name."""
+        self.assertEqual(encodeParams({'rows': 10, 'q': 'a', 'fl': 'id'}),
+                         'fl=id&q=a&rows=10')
+
+    def testMultipleValues(self):
+        """Lists and tuples repeat the parameter, keeping their order."""
+        query = encodeParams({'fq': ['type:book', 'inStock:true'],
+                              'facet_field': ('price', 'cat'), 'q': '*:*'})
+        self.assertEqual(query, 'facet.field=price&facet.field=cat&'
+                                'fq=type%3Abook&fq=inStock%3Atrue&q=%2A%3A%2A')
+
+    def testUnicode(self):
+        """Unicode values are encoded as UTF-8."""
+        self.assertEqual(encodeParams({'q': u'ñ', 'fq': [u'ü']}),
+                         'fq=%C3%BC&q=%C3%B1')
+
+    def testNone(self):
+        """C{None} values are left out."""
+        self.assertEqual(encodeParams({'q': 'a', 'start': None,
+                                       'fq': ['b', None]}), 'fq=b&q=a')
+
+
+class PreparedQueryTest(TestCase):
+
+    def testEncode(self):
+        """The variable parameters are added to the static ones."""
+        prepared = PreparedQuery({'fq': ['a', 'b'], 'rows': 10})
+        self.assertEqual(prepared.encode(q='x', start=20),
+                         'fq=a&fq=b&rows=10&q=x&start=20')
+
+    def testDefaults(self):
+        """Variable values given when preparing are defaults."""
+        prepared = PreparedQuery({'q': 'x', 'start': 0, 'rows': 10})
+        self.assertEqual(prepared.encode(), 'rows=10&q=x&start=0')
+        self.assertEqual(prepared.encode(start=10), 'rows=10&q=x&start=10')
+        self.assertEqual(prepared.encode(start=None), 'rows=10&q=x')
+
+    def testOnlyVariables(self):
+        """A query without static parameters encodes only the variables."""
+        prepared = PreparedQuery({})
+        self.assertEqual(prepared.encode(q='x'), 'q=x')
+        self.assertEqual(prepared.encode(), '')
+
+    def testCustomVariables(self):
+        """The variable parameters can be chosen."""
+        prepared = PreparedQuery({'q': 'x'}, variables=['facet_offset'])
+        self.assertEqual(prepared.encode(facet_offset=5),
+                         'q=x&facet.offset=5')
+        self.assertRaises(ValueError, prepared.encode, q='y')
+
+    def testNotVariable(self):
+        """Static parameters can't be changed."""
+        prepared = PreparedQuery({'rows': 10})
+        self.assertRaises(ValueError, prepared.encode, rows=20)
+
+
+class ClientPreparedQueryTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeSolrServer()
+        self.client = SolrClient(self.server.start())
+
+    @inlineCallbacks
+    def tearDown(self):
+        yield self.client.close()
+        yield self.server.stop()
+
+    @inlineCallbacks
+    def testSearchMultipleValues(self):
+        """L{SolrClient.search} accepts lists of values."""
+        yield self.client.search(u'*:*', fq=[u'type:book', u'inStock:true'],
+                                 facet_field=['cat', 'author'])
+        args = self.server.requests[0].args
+        self.assertEqual(args['fq'], ['type:book', 'inStock:true'])
+        self.assertEqual(args['facet.field'], ['cat', 'author'])
+
+    @inlineCallbacks
+    def testSearchPrepared(self):
+        """A prepared search sends the static and the variable values."""
+        prepared = self.client.prepare(fq=[u'type:book', u'inStock:true'],
+                                       rows=10)
+        yield self.client.searchPrepared(prepared, u'ñandú', start=10)
+        yield self.client.searchPrepared(prepared, u'*:*')
+        first, second = self.server.requests
+        self.assertEqual(first.args['fq'], ['type:book', 'inStock:true'])
+        self.assertEqual(first.args['q'], ['ñandú'])
+        self.assertEqual(first.args['start'], ['10'])
+        self.assertEqual(first.args['rows'], ['10'])
+        self.assertEqual(second.args['q'], ['*:*'])
+        self.assertNotIn('start', second.args)
+
+    @inlineCallbacks
+    def testPreparedResponseClass(self):
+        """The response writer is chosen when the query is prepared."""
+        prepared = self.client.prepare(u'*:*', wt='json')
+        self.assertIdentical(prepared.responseClass, JSONSolrResponse)
+        response = yield self.client.searchPrepared(prepared)
+        self.assertIsInstance(response, JSONSolrResponse)
+        self.assertEqual(self.server.requests[0].args['wt'], ['json'])
+
+    def testPreparedNotVariable(self):
+        """Only the variable parameters can be given to a prepared search."""
+        prepared = self.client.prepare(rows=10)
+        self.assertRaises(ValueError, self.client.searchPrepared, prepared,
+                          u'*:*', rows=20)
+
+    @inlineCallbacks
+    def testLongPreparedQuery(self):
+        """Long prepared queries are sent with POST."""
+        prepared = self.client.prepare(fq=[u'x' * 600, u'y' * 600])
+        yield self.client.searchPrepared(prepared, u'*:*')
+        request = self.server.requests[0]
+        self.assertEqual(request.method, 'POST')
+        body = urlparse.parse_qs(request.body)
+        self.assertEqual(body['fq'], ['x' * 600, 'y' * 600])
+
+
+class SelectMethodTest(TestCase):
+
+    def startClient(self, **kwargs):
+        self.server = FakeSolrServer()
+        self.client = SolrClient(self.server.start(), **kwargs)
+
+    @inlineCallbacks
+    def tearDown(self):
+        yield self.client.close()
+        yield self.server.stop()
+
+    @inlineCallbacks
+    def testMaxGetLength(self):
+        """Searches are sent with POST from C{maxGetLength} bytes."""
+        self.startClient(maxGetLength=30)
+        yield self.client.search(u'a')
+        yield self.client.search(u'a' * 30)
+        self.assertEqual([r.method for r in self.server.requests],
+                         ['GET', 'POST'])
+        request = self.server.requests[1]
+        self.assertEqual(
+            request.headers.getRawHeaders('Content-Type'),
+            ['application/x-www-form-urlencoded; charset=UTF-8'])
+        self.assertEqual(urlparse.parse_qs(request.body)['q'], ['a' * 30])
+
+    @inlineCallbacks
+    def testTooLong(self):
+        """
+        A search rejected as too long is sent again with POST, and the
+        searches of that length are sent with POST from then on.
+        """
+        self.startClient()
+        self.server.resource.responses = [(414, '')]
+        response = yield self.client.search(u'a' * 100, wt='json')
+        self.assertEqual(response.header['status'], 0)
+        self.assertEqual([r.method for r in self.server.requests],
+                         ['GET', 'POST'])
+        length = len(self.server.requests[1].body)
+        self.assertEqual(self.client.maxGetLength, length)
+
+        yield self.client.search(u'b' * 100, wt='json')
+        yield self.client.search(u'b' * 90, wt='json')
+        self.assertEqual([r.method for r in self.server.requests[2:]],
+                         ['POST', 'GET'])
+
+    @inlineCallbacks
+    def testRetriedPost(self):
+        """
+        Long searches are retried without joining the parts of their body.
+        """
+        self.startClient(retryPolicy=RetryPolicy(initialDelay=0))
+        self.server.resource.responses = [(503, '')]
+        self.patch(FormProducer, 'body',
+                   property(lambda producer: self.fail('Body joined')))
+        prepared = self.client.prepare(fq=[u'x' * 1024])
+        response = yield self.client.searchPrepared(prepared, u'*:*')
+        self.assertEqual(response.retries, 1)
+        self.assertEqual([r.method for r in self.server.requests],
+                         ['POST', 'POST'])
+        self.assertEqual(self.server.requests[0].body,
+                         self.server.requests[1].body)
+
+    def testOtherErrors(self):
+        """Other wrong statuses are not sent again with POST."""
+        self.startClient()
+        self.server.resource.responses = [(400, '')]
+        d = self.client.search(u'a')
+
+        def check(_):
+            self.assertEqual([r.method for r in self.server.requests],
+                             ['GET'])
+            self.assertEqual(self.client.maxGetLength, 1024)
+
+        return self.assertFailure(d, HTTPWrongStatus).addCallback(check)
+
+
+class MergeSearchesTest(TestCase):
+
+    def testMerge(self):
+        """Searches that differ only in their facets are joined."""
+        searches = [{'q': 'a', 'rows': 0, 'facet': 'true',
+                     'facet_field': 'cat'},
+                    {'q': 'a', 'rows': 0, 'facet': 'true',
+                     'facet.field': ['cat', 'brand']},
+                    {'q': 'a', 'rows': 0, 'facet': 'true',
+                     'facet_query': 'price:[0 TO 10]'}]
+        merged = mergeSearches(searches)
+        self.assertEqual(merged, [({'q': 'a', 'rows': 0, 'facet': 'true',
+                                    'facet.field': ['cat', 'brand'],
+                                    'facet.query': ['price:[0 TO 10]']},
+                                   [0, 1, 2])])
+        self.assertEqual(searches[0]['facet_field'], 'cat')
+
+    def testDifferentSearches(self):
+        """Searches with other differences are kept apart, in order."""
+        searches = [{'q': 'a', 'facet_field': 'cat'},
+                    {'q': 'b', 'facet_field': 'cat'},
+                    {'q': 'a', 'fq': ['x', 'y'], 'facet_field': 'brand'},
+                    {'q': 'a', 'facet_field': 'brand'}]
+        merged = mergeSearches(searches)
+        self.assertEqual([indexes for _, indexes in merged],
+                         [[0, 3], [1], [2]])
+        self.assertEqual(merged[0][0]['facet.field'], ['cat', 'brand'])
+
+
+class EchoResource(FakeSolrResource):
+    """A L{FakeSolrResource} that answers with the query it received."""
+
+    def render(self, request):
+        body = FakeSolrResource.render(self, request)
+        if request.code != 200 or body is NOT_DONE_YET:
+            return body
+        return json.dumps({
+            'responseHeader': {'status': 0,
+                               'params': {'q': request.args['q'][0]}},
+            'response': {'numFound': 0, 'start': 0, 'docs': []}})
+
+
+class MultiSearchTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeSolrServer(EchoResource())
+        self.client = SolrClient(self.server.start(), codec='json')
+
+    @inlineCallbacks
+    def tearDown(self):
+        yield self.client.close()
+        yield self.server.stop()
+
+    @inlineCallbacks
+    def testOrder(self):
+        """The responses are in the order of the searches."""
+        queries = [u'q%d' % i for i in range(10)]
+        responses = yield self.client.multiSearch(
+            [{'q': query} for query in queries], concurrency=3)
+        self.assertEqual([r.header['params']['q'] for r in responses],
+                         queries)
+
+    @inlineCallbacks
+    def testFailures(self):
+        """Failed searches give a L{Failure} in their position."""
+        self.server.resource.responses = [(200, ''), (500, '')]
+        responses = yield self.client.multiSearch(
+            [{'q': u'a'}, {'q': u'b'}, {'q': u'c'}], concurrency=1)
+        self.assertEqual(responses[0].header['params']['q'], 'a')
+        self.assertIsInstance(responses[1], Failure)
+        responses[1].trap(HTTPWrongStatus)
+        self.assertEqual(responses[2].header['params']['q'], 'c')
+
+    @inlineCallbacks
+    def testConcurrency(self):
+        """At most C{concurrency} searches are in flight."""
+        resource = self.server.resource
+        resource.hold = True
+        d = self.client.multiSearch([{'q': u'q%d' % i} for i in range(5)],
+                                    concurrency=2)
+        while len(resource.requests) < 2:
+            yield deferLater(reactor, 0.01, lambda: None)
+        yield deferLater(reactor, 0.05, lambda: None)
+        self.assertEqual(len(resource.requests), 2)
+        resource.release()
+        responses = yield d
+        self.assertEqual(len(responses), 5)
+        self.assertEqual(len(resource.requests), 5)
+
+    @inlineCallbacks
+    def testMerge(self):
+        """Merged searches are sent once and share the response."""
+        searches = [{'q': u'a', 'rows': 0, 'facet': 'true',
+                     'facet_field': field}
+                    for field in ('cat', 'brand', 'color')]
+        searches.append({'q': u'b'})
+        responses = yield self.client.multiSearch(searches, merge=True)
+        first, second = self.server.requests
+        self.assertEqual(first.args['facet.field'],
+                         ['cat', 'brand', 'color'])
+        self.assertEqual(second.args['q'], ['b'])
+        self.assertIdentical(responses[0], responses[1])
+        self.assertIdentical(responses[0], responses[2])
+        self.assertEqual(responses[3].header['params']['q'], 'b')
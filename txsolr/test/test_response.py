@@ -1,4 +1,4 @@
-from twisted.internet.defer import Deferred, inlineCallbacks
+from twisted.internet.defer import Deferred, inlineCallbacks, succeed
 from twisted.python.failure import Failure
 from twisted.trial.unittest import TestCase
 from twisted.web.client import ResponseDone
@@ -6,7 +6,11 @@ from twisted.web.http import OK
 from twisted.web.http_headers import Headers
 
 from txsolr.errors import SolrResponseError
-from txsolr.response import JSONSolrResponse, ResponseConsumer
+from txsolr.response import (JSONSolrResponse, ResponseConsumer,
+                             StreamingResponseConsumer, LazyJSONSolrResponse,
+                             CompactDocument, CompactJSONSolrResponse,
+                             compactDocuments)
+from txsolr.test.fakesolr import loadFixture
 
 
 class JSONSorlResponseTest(TestCase):
@@ -75,6 +79,122 @@ class JSONSorlResponseTest(TestCase):
         self.assertEqual('SolrResponse: %r' % raw, repr(response))
 
 
+class LazyJSONSolrResponseTest(TestCase):
+
+    def testHeader(self):
+        """
+        L{LazyJSONSolrResponse} decodes the header without decoding the rest
+        of the body.
+        """
+        r = LazyJSONSolrResponse('{"responseHeader": {"status": 0}, '
+                                 '"response": invalid}')
+        self.assertEqual(r.header, {'status': 0})
+        self.assertRaises(SolrResponseError, getattr, r, 'results')
+
+    def testWrongStatus(self):
+        """A status different from 0 raises L{SolrResponseError}."""
+        self.assertRaises(SolrResponseError, LazyJSONSolrResponse,
+                          '{"responseHeader": {"status": 1}}')
+        self.assertRaises(SolrResponseError, LazyJSONSolrResponse,
+                          '{"response": {}}')
+        self.assertRaises(SolrResponseError, LazyJSONSolrResponse, 'foo')
+
+    def testResultsDecodedOnDemand(self):
+        """
+        The documents are decoded as they are accessed, after C{numFound} and
+        C{start}.
+        """
+        r = LazyJSONSolrResponse('{"responseHeader": {"status": 0}, '
+                                 '"response": {"numFound": 3, "start": 0, '
+                                 '"docs": [{"id": 1}, {"id": 2}, invalid]}}')
+        self.assertEqual(r.results.numFound, 3)
+        self.assertEqual(r.results.start, 0)
+        self.assertEqual(r.results.docs[0], {'id': 1})
+        self.assertEqual(r.results.docs[1], {'id': 2})
+        self.assertRaises(SolrResponseError, len, r.results.docs)
+
+    def testReadOnlyDocuments(self):
+        """The documents are read-only L{CompactDocument}s."""
+        r = LazyJSONSolrResponse(loadFixture('select.json'))
+        doc = r.results.docs[0]
+        self.assertIsInstance(doc, CompactDocument)
+        self.assertEqual(doc['id'], 'doc-1')
+        self.assertEqual(sorted(doc.keys())[:2], ['_version_', 'created'])
+
+        def setField():
+            doc['id'] = 'foo'
+
+        self.assertRaises(TypeError, setField)
+        self.assertEqual(dict(doc)['id'], 'doc-1')
+
+    def testSharedSchema(self):
+        """Documents with the same fields share their schema."""
+        r = LazyJSONSolrResponse('{"responseHeader": {"status": 0}, '
+                                 '"response": {"numFound": 3, "start": 0, '
+                                 '"docs": [{"id": 1}, {"id": 2}, '
+                                 '{"id": 3, "title": "foo"}]}}')
+        docs = r.results.docs
+        self.assertIdentical(docs[0]._schema, docs[1]._schema)
+        self.assertNotIdentical(docs[0]._schema, docs[2]._schema)
+        self.assertEqual(docs[2], {'id': 3, 'title': 'foo'})
+
+    def testSameAsJSONSolrResponse(self):
+        """
+        L{LazyJSONSolrResponse} gives the same data as L{JSONSolrResponse}.
+        """
+        body = loadFixture('select.json')
+        lazy = LazyJSONSolrResponse(body)
+        eager = JSONSolrResponse(body)
+        self.assertEqual(lazy.header, eager.header)
+        self.assertEqual(lazy.results.numFound, eager.results.numFound)
+        self.assertEqual(list(lazy.results.docs), eager.results.docs)
+        self.assertEqual(lazy.facet_counts, eager.facet_counts)
+        self.assertEqual(lazy.responseDict, eager.responseDict)
+        self.assertRaises(AttributeError, getattr, lazy, 'highlighting')
+
+
+class CompactDocumentTest(TestCase):
+
+    def testMapping(self):
+        """L{CompactDocument}s behave like read-only C{dict}s."""
+        doc = compactDocuments([{'id': 1, 'cat': ['a']}])[0]
+        self.assertEqual(doc['id'], 1)
+        self.assertEqual(doc.get('cat'), ['a'])
+        self.assertEqual(doc.get('missing', 2), 2)
+        self.assertTrue('id' in doc)
+        self.assertFalse('missing' in doc)
+        self.assertEqual(sorted(doc), ['cat', 'id'])
+        self.assertEqual(len(doc), 2)
+        self.assertEqual(dict(doc), {'id': 1, 'cat': ['a']})
+        self.assertEqual(doc, {'id': 1, 'cat': ['a']})
+        self.assertNotEqual(doc, {'id': 2, 'cat': ['a']})
+        self.assertRaises(KeyError, lambda: doc['missing'])
+
+        def setField():
+            doc['id'] = 2
+
+        self.assertRaises(TypeError, setField)
+
+    def testSharedSchema(self):
+        """Documents with the same fields share their schema."""
+        docs = compactDocuments([{'id': 1, 'a': 2}, {'id': 3, 'a': 4},
+                                 {'id': 5}])
+        self.assertIdentical(docs[0]._schema, docs[1]._schema)
+        self.assertEqual(dict(docs[2]), {'id': 5})
+
+    def testCompactJSONSolrResponse(self):
+        """
+        L{CompactJSONSolrResponse} stores the documents as
+        L{CompactDocument}s, also in C{responseDict}.
+        """
+        body = loadFixture('select.json')
+        compact = CompactJSONSolrResponse(body)
+        docs = compact.results.docs
+        self.assertIsInstance(docs[0], CompactDocument)
+        self.assertEqual(docs, JSONSolrResponse(body).results.docs)
+        self.assertIdentical(compact.responseDict['response']['docs'], docs)
+
+
 class ResponseConsumerTest(TestCase):
 
     @inlineCallbacks
@@ -115,6 +235,127 @@ class ResponseConsumerTest(TestCase):
         return self.assertFailure(deferred, SolrResponseError)
 
 
+class StreamingResponseConsumerTest(TestCase):
+
+    rawResponse = ('{"responseHeader":{"status":0,"QTime":2},'
+                   '"response":{"numFound":2,"start":0,'
+                   '"docs":[{"id":"a"},{"id":"b"}]}}')
+
+    @inlineCallbacks
+    def testStreamingResponseConsumer(self):
+        """
+        L{StreamingResponseConsumer} gives each document to the callback and
+        fires the given L{Deferred} with the rest of the response.
+        """
+        deferred = Deferred()
+        docs = []
+        consumer = StreamingResponseConsumer(deferred, JSONSolrResponse,
+                                             docs.append)
+        response = FakeResponse(ResponseDone(), self.rawResponse)
+        response.deliverBody(consumer)
+        solrResponse = yield deferred
+        self.assertEqual(docs, [{'id': 'a'}, {'id': 'b'}])
+        self.assertEqual(solrResponse.results.numFound, 2)
+        self.assertEqual(solrResponse.results.docs, [])
+
+    def testStreamingResponseConsumerWaitsForCallback(self):
+        """
+        If the document callback returns a L{Deferred}, the
+        L{StreamingResponseConsumer} pauses the transport and waits for it
+        before processing the next document.
+        """
+        deferred = Deferred()
+        pending = []
+        docs = []
+
+        def callback(doc):
+            docs.append(doc)
+            d = Deferred()
+            pending.append(d)
+            return d
+
+        consumer = StreamingResponseConsumer(deferred, JSONSolrResponse,
+                                             callback)
+        transport = FakeTransport()
+        consumer.makeConnection(transport)
+        consumer.dataReceived(self.rawResponse)
+        self.assertEqual(docs, [{'id': 'a'}])
+        self.assertTrue(transport.paused)
+
+        pending.pop().callback(None)
+        self.assertEqual(docs, [{'id': 'a'}, {'id': 'b'}])
+
+        consumer.connectionLost(Failure(ResponseDone()))
+        self.assertFalse(deferred.called)
+        pending.pop().callback(None)
+        self.assertTrue(deferred.called)
+        self.assertFalse(transport.paused)
+
+    def testStreamingResponseConsumerCallbackError(self):
+        """
+        If the document callback fails, the L{StreamingResponseConsumer}
+        fires the given L{Deferred} with the error.
+        """
+        deferred = Deferred()
+
+        def callback(doc):
+            raise ValueError(doc)
+
+        consumer = StreamingResponseConsumer(deferred, JSONSolrResponse,
+                                             callback)
+        response = FakeResponse(ResponseDone(), self.rawResponse)
+        response.deliverBody(consumer)
+        return self.assertFailure(deferred, ValueError)
+
+    def testStreamingResponseConsumerDeferredError(self):
+        """
+        If the L{Deferred} returned by the document callback fails while the
+        transport is paused, the L{StreamingResponseConsumer} stops the
+        transport and fires the given L{Deferred} with the error.
+        """
+        deferred = Deferred()
+        pending = Deferred()
+        consumer = StreamingResponseConsumer(deferred, JSONSolrResponse,
+                                             lambda doc: pending)
+        transport = FakeTransport()
+        consumer.makeConnection(transport)
+        consumer.dataReceived(self.rawResponse)
+        self.assertTrue(transport.paused)
+        self.assertFalse(transport.stopped)
+
+        pending.errback(ValueError())
+        self.assertTrue(transport.stopped)
+        return self.assertFailure(deferred, ValueError)
+
+    def testStreamingResponseConsumerWithBadResponse(self):
+        """
+        The L{StreamingResponseConsumer} fires the given L{Deferred} with
+        L{SolrResponseError} if the decoding fails.
+        """
+        deferred = Deferred()
+        consumer = StreamingResponseConsumer(deferred, JSONSolrResponse,
+                                             lambda doc: succeed(None))
+        response = FakeResponse(ResponseDone(), 'Bad body!')
+        response.deliverBody(consumer)
+        return self.assertFailure(deferred, SolrResponseError)
+
+
+class FakeTransport(object):
+    """A fake transport that records if it's paused or stopped."""
+
+    paused = False
+    stopped = False
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+    def stopProducing(self):
+        self.stopped = True
+
+
 class FakeResponse(object):
     """A fake C{Response} that can stream a response payload to a consumer.
 
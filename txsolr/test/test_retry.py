@@ -0,0 +1,233 @@
+from twisted.internet import reactor
+from twisted.internet.defer import CancelledError, Deferred, inlineCallbacks
+from twisted.internet.error import ConnectionRefusedError, ConnectionLost
+from twisted.internet.task import Clock, deferLater
+from twisted.trial.unittest import TestCase
+
+from txsolr.client import SolrClient
+from txsolr.errors import (CircuitOpen, HTTPRequestError, HTTPWrongStatus,
+                           RequestQueueFull, RequestTimeout)
+from txsolr.retry import RetryPolicy
+from txsolr.test.fakesolr import FakeSolrServer
+
+
+class Result(object):
+    """A result that can store the number of retries."""
+
+
+class RetryPolicyTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.attempts = []
+        self.cancelled = []
+
+    def request(self):
+        d = Deferred(self.cancelled.append)
+        self.attempts.append(d)
+        return d
+
+    def createPolicy(self, **kwargs):
+        return RetryPolicy(clock=self.clock, random=lambda: 1.0, **kwargs)
+
+    def testSuccess(self):
+        """Successful requests are not retried."""
+        d = self.createPolicy().run(self.request)
+        result = Result()
+        self.attempts[0].callback(result)
+        self.assertIdentical(self.successResultOf(d), result)
+        self.assertEqual(result.retries, 0)
+
+    def testConnectionErrors(self):
+        """Requests that never reached Solr are always retried."""
+        policy = self.createPolicy()
+        d = policy.run(self.request)
+        self.attempts[0].errback(HTTPRequestError(ConnectionRefusedError()))
+        self.clock.advance(0.1)
+        self.attempts[1].callback(Result())
+        self.assertEqual(self.successResultOf(d).retries, 1)
+        self.assertEqual(policy.retries, 1)
+
+    def testIdempotent(self):
+        """
+        Lost connections and unavailable servers are only retried for
+        idempotent requests.
+        """
+        policy = self.createPolicy()
+        for error in (HTTPRequestError(ConnectionLost()), HTTPWrongStatus(503),
+                      RequestTimeout('total')):
+            d = policy.run(self.request)
+            self.attempts[-1].errback(error)
+            self.failureResultOf(d, error.__class__)
+
+            d = policy.run(self.request, idempotent=True)
+            self.attempts[-1].errback(error)
+            self.clock.advance(0.1)
+            self.attempts[-1].callback(Result())
+            self.assertEqual(self.successResultOf(d).retries, 1)
+
+    def testNotRetried(self):
+        """Client errors, full queues and open circuits are never retried."""
+        policy = self.createPolicy()
+        for error in (HTTPWrongStatus(400), RequestQueueFull(),
+                      CircuitOpen('http://a/solr')):
+            d = policy.run(self.request, idempotent=True)
+            self.attempts[-1].errback(error)
+            self.failureResultOf(d, error.__class__)
+
+    def testGiveUp(self):
+        """After C{maxRetries} retries the last failure is reported."""
+        d = self.createPolicy(maxRetries=2).run(self.request, True)
+        for delay in (0.1, 0.2):
+            self.attempts[-1].errback(HTTPWrongStatus(503))
+            self.clock.advance(delay)
+        self.attempts[-1].errback(HTTPWrongStatus(502))
+        failure = self.failureResultOf(d, HTTPWrongStatus)
+        self.assertEqual(failure.value.args[0], 502)
+        self.assertEqual(failure.value.retries, 2)
+        self.assertEqual(len(self.attempts), 3)
+
+    def testBackoff(self):
+        """The delay grows exponentially up to C{maxDelay}, with jitter."""
+        policy = self.createPolicy(initialDelay=1, maxDelay=5)
+        self.assertEqual([policy.backoff(n) for n in range(5)],
+                         [1, 2, 4, 5, 5])
+        policy = RetryPolicy(initialDelay=1, random=lambda: 0.5)
+        self.assertEqual(policy.backoff(1), 1)
+
+    def testCancelWaiting(self):
+        """Cancelling while waiting for a retry stops the retries."""
+        d = self.createPolicy().run(self.request, True)
+        self.attempts[0].errback(HTTPWrongStatus(503))
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def testCancelAttempt(self):
+        """Cancelling cancels the attempt in progress."""
+        d = self.createPolicy().run(self.request, True)
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.assertEqual(self.cancelled, self.attempts)
+
+
+class TimeoutTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeSolrServer()
+        self.url = self.server.start()
+        self.client = None
+
+    def tearDown(self):
+        self.client.close()
+        return self.server.stop()
+
+    @inlineCallbacks
+    def waitForRequest(self):
+        while not self.server.requests:
+            yield deferLater(reactor, 0.001, lambda: None)
+
+    @inlineCallbacks
+    def assertTimeout(self, d, name):
+        # The timeouts are long enough for the request to arrive before.
+        yield self.waitForRequest()
+        error = yield self.assertFailure(d, RequestTimeout)
+        self.assertEqual(error.args[0], name)
+        yield self.server.resource.aborted[0]
+
+    def testFirstByteTimeout(self):
+        """Requests without an answer in time are aborted."""
+        self.client = SolrClient(self.url, firstByteTimeout=0.1)
+        self.server.resource.hold = True
+        return self.assertTimeout(self.client.search('*:*'), 'firstByte')
+
+    def testTotalTimeout(self):
+        """Requests that take too long are aborted."""
+        self.client = SolrClient(self.url, timeout=0.1)
+        self.server.resource.hold = True
+        return self.assertTimeout(self.client.search('*:*'), 'total')
+
+    @inlineCallbacks
+    def testWithTimeouts(self):
+        """Some requests can use other timeouts."""
+        self.client = SolrClient(self.url)
+        self.server.resource.hold = True
+        d = self.client.withTimeouts(total=0.1).search('*:*')
+        yield self.assertTimeout(d, 'total')
+        self.assertEqual(self.client.timeout, None)
+
+    @inlineCallbacks
+    def testCancel(self):
+        """Cancelling a request aborts its connection."""
+        self.client = SolrClient(self.url)
+        self.server.resource.hold = True
+        d = self.client.search('*:*')
+        yield self.waitForRequest()
+        d.cancel()
+        yield self.assertFailure(d, CancelledError)
+        yield self.server.resource.aborted[0]
+
+    @inlineCallbacks
+    def testCloseDerivedClients(self):
+        """
+        Closing a client closes the clients derived from it, and waits for
+        their requests in progress.
+        """
+        self.client = SolrClient(self.url)
+        derived = self.client.withTimeouts(total=5)
+        other = self.client.withResultSchema(None)
+        self.server.resource.hold = True
+        d = derived.search('*:*')
+        yield self.waitForRequest()
+        closed = self.client.close()
+        self.assertFalse(closed.called)
+        yield self.assertFailure(other.search('*:*'), HTTPRequestError)
+        yield self.assertFailure(derived.ping(), HTTPRequestError)
+        self.server.resource.release()
+        response = yield d
+        self.assertEqual(response.results.numFound, 0)
+        yield closed
+
+    @inlineCallbacks
+    def testInTime(self):
+        """Requests answered in time are not affected."""
+        self.client = SolrClient(self.url, firstByteTimeout=5, timeout=5)
+        response = yield self.client.search('*:*')
+        self.assertEqual(response.results.numFound, 0)
+
+
+class ClientRetryTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeSolrServer()
+        self.url = self.server.start()
+        policy = RetryPolicy(initialDelay=0)
+        self.client = SolrClient(self.url, retryPolicy=policy)
+
+    def tearDown(self):
+        self.client.close()
+        return self.server.stop()
+
+    @inlineCallbacks
+    def testRetriedSearch(self):
+        """Searches are retried, and the response tells how many times."""
+        self.server.resource.responses.append((503, 'Unavailable'))
+        response = yield self.client.search('*:*')
+        self.assertEqual(response.retries, 1)
+        self.assertEqual(len(self.server.requests), 2)
+
+    @inlineCallbacks
+    def testAddNotRetried(self):
+        """Additions are not retried once they reached Solr."""
+        self.server.resource.responses.append((503, 'Unavailable'))
+        yield self.assertFailure(self.client.add({'id': 1}), HTTPWrongStatus)
+        self.assertEqual(len(self.server.requests), 1)
+
+    @inlineCallbacks
+    def testConnectionRefused(self):
+        """Additions are retried if they could not be sent."""
+        yield self.server.stop()
+        error = yield self.assertFailure(self.client.add({'id': 1}),
+                                         HTTPRequestError)
+        self.assertEqual(error.retries, 3)
+        self.server.start()
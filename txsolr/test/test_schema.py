@@ -0,0 +1,262 @@
+import json
+from datetime import datetime
+
+from twisted.internet.defer import inlineCallbacks
+from twisted.trial.unittest import TestCase
+
+from txsolr.client import SolrClient
+from txsolr.errors import HTTPWrongStatus
+from txsolr.response import (CompactJSONSolrResponse, CompactDocument,
+                             JavabinSolrResponse, JSONSolrResponse)
+from txsolr.schema import (ResultSchema, schemaFromSolr, BOOL, DATE, FLOAT,
+                           INT)
+from txsolr.test.fakesolr import FakeSolrResource, FakeSolrServer
+
+
+SELECT_RESPONSE = json.dumps({
+    'responseHeader': {'status': 0, 'QTime': 1},
+    'response': {'numFound': 2, 'start': 0, 'docs': [
+        {'id': '1', 'created': '2010-01-01T12:30:00Z', 'price': 1.5,
+         'tags_dt': ['2011-02-03T04:05:06.789Z']},
+        {'id': '2', 'created': '2010-01-02T00:00:00Z', 'inStock': 'true'},
+    ]}})
+
+
+class ResultSchemaTest(TestCase):
+
+    def testDates(self):
+        """Dates become naive UTC C{datetime}s, with their fractions."""
+        schema = ResultSchema({'created': DATE})
+        docs = schema.decode([{'created': '2010-01-01T12:30:00Z'},
+                              {'created': '2010-01-01T12:30:00.5Z'},
+                              {'created': '2010-01-01T12:30:00.123456Z'}])
+        self.assertEqual([doc['created'] for doc in docs],
+                         [datetime(2010, 1, 1, 12, 30),
+                          datetime(2010, 1, 1, 12, 30, 0, 500000),
+                          datetime(2010, 1, 1, 12, 30, 0, 123456)])
+
+    def testScalars(self):
+        """Numbers and booleans given as strings are converted."""
+        schema = ResultSchema({'count': INT, 'price': FLOAT,
+                               'inStock': BOOL})
+        doc = schema.decodeDocument({'count': '3', 'price': '1.5',
+                                     'inStock': 'false', 'name': '4'})
+        self.assertEqual(doc, {'count': 3, 'price': 1.5, 'inStock': False,
+                               'name': '4'})
+
+    def testTypedValues(self):
+        """Values that already have their type are kept."""
+        created = datetime(2010, 1, 1)
+        schema = ResultSchema({'count': INT, 'created': DATE,
+                               'inStock': BOOL})
+        doc = schema.decodeDocument({'count': 3, 'created': created,
+                                     'inStock': True})
+        self.assertEqual(doc, {'count': 3, 'created': created,
+                               'inStock': True})
+
+    def testInvalidValues(self):
+        """Values that can't be converted are kept as strings."""
+        schema = ResultSchema({'count': INT, 'created': DATE,
+                               'inStock': BOOL})
+        doc = {'count': 'many', 'created': 'NOW', 'inStock': 'maybe'}
+        self.assertEqual(schema.decodeDocument(dict(doc)), doc)
+
+    def testMultiValued(self):
+        """Every value of a multi-valued field is converted."""
+        schema = ResultSchema({'counts': INT})
+        doc = schema.decodeDocument({'counts': ['1', '2']})
+        self.assertEqual(doc['counts'], [1, 2])
+
+    def testDynamicFields(self):
+        """Patterns give the types of dynamic fields, the longest first."""
+        schema = ResultSchema({'*_i': INT, '*_dt_i': BOOL,
+                               'solr.*': FLOAT})
+        doc = schema.decodeDocument({'a_i': '1', 'b_dt_i': 'true',
+                                     'solr.x': '1.5', 'c_s': '1'})
+        self.assertEqual(doc, {'a_i': 1, 'b_dt_i': True, 'solr.x': 1.5,
+                               'c_s': '1'})
+
+    def testSolrClasses(self):
+        """The types can be given as Solr field type classes."""
+        schema = ResultSchema({'created': 'solr.DatePointField',
+                               'count': 'solr.TrieLongField',
+                               'name': 'solr.TextField'})
+        doc = schema.decodeDocument({'created': '2010-01-01T00:00:00Z',
+                                     'count': '7', 'name': 'x'})
+        self.assertEqual(doc, {'created': datetime(2010, 1, 1),
+                               'count': 7, 'name': 'x'})
+
+    def testProject(self):
+        """
+        A projection requests some fields, and the fields found are
+        converted.
+        """
+        schema = ResultSchema({'a': INT, 'b': INT}).project(['id', 'a'])
+        self.assertEqual(schema.fields, ('id', 'a'))
+        doc = schema.decodeDocument({'id': 'x', 'a': '1', 'b': '2'})
+        self.assertEqual(doc, {'id': 'x', 'a': 1, 'b': 2})
+
+    def testProjectPattern(self):
+        """The fields matching a pattern of the projection are converted."""
+        schema = ResultSchema({'*_dt': DATE}).project(['id', '*_dt'])
+        doc = schema.decodeDocument({'id': 'x',
+                                     'a_dt': '2010-01-01T00:00:00Z'})
+        self.assertEqual(doc, {'id': 'x', 'a_dt': datetime(2010, 1, 1)})
+
+    def testResponseClass(self):
+        """
+        L{ResultSchema.responseClass} gives a subclass that converts the
+        documents, always the same one for a base class.
+        """
+        schema = ResultSchema({'created': DATE, 'tags_dt': DATE})
+        responseClass = schema.responseClass(JSONSolrResponse)
+        self.assertTrue(issubclass(responseClass, JSONSolrResponse))
+        self.assertIdentical(schema.responseClass(JSONSolrResponse),
+                             responseClass)
+        self.assertNotIdentical(schema.responseClass(JavabinSolrResponse),
+                                responseClass)
+        docs = responseClass(SELECT_RESPONSE).results.docs
+        self.assertEqual(docs[0]['created'], datetime(2010, 1, 1, 12, 30))
+        self.assertEqual(docs[0]['tags_dt'],
+                         [datetime(2011, 2, 3, 4, 5, 6, 789000)])
+        self.assertEqual(docs[1]['created'], datetime(2010, 1, 2))
+
+    def testCompactDocuments(self):
+        """The documents are converted before being compacted."""
+        schema = ResultSchema({'created': DATE})
+        responseClass = schema.responseClass(CompactJSONSolrResponse)
+        docs = responseClass(SELECT_RESPONSE).results.docs
+        self.assertIsInstance(docs[0], CompactDocument)
+        self.assertEqual(docs[0]['created'], datetime(2010, 1, 1, 12, 30))
+
+    def testSchemaFromSolr(self):
+        """L{schemaFromSolr} uses the classes of the field types."""
+        schema = schemaFromSolr(
+            [{'name': 'created', 'type': 'pdate'},
+             {'name': 'name', 'type': 'text_general'}],
+            [{'name': 'pdate', 'class': 'solr.DatePointField'},
+             {'name': 'text_general', 'class': 'solr.TextField'},
+             {'name': 'pint', 'class': 'solr.IntPointField'}],
+            [{'name': '*_i', 'type': 'pint'}], projection=['created'])
+        self.assertEqual(schema.fields, ('created',))
+        doc = schema.project(None).decodeDocument(
+            {'created': '2010-01-01T00:00:00Z', 'name': '1', 'a_i': '2'})
+        self.assertEqual(doc, {'created': datetime(2010, 1, 1), 'name': '1',
+                               'a_i': 2})
+
+
+class SchemaResource(FakeSolrResource):
+    """A L{FakeSolrResource} that answers the schema API by path."""
+
+    def __init__(self):
+        FakeSolrResource.__init__(self)
+        header = {'status': 0, 'QTime': 1}
+        self.paths = {
+            '/solr/schema/fields': json.dumps({
+                'responseHeader': header,
+                'fields': [{'name': 'created', 'type': 'pdate'},
+                           {'name': 'id', 'type': 'string'}]}),
+            '/solr/schema/fieldtypes': json.dumps({
+                'responseHeader': header,
+                'fieldTypes': [{'name': 'pdate',
+                                'class': 'solr.DatePointField'},
+                               {'name': 'string',
+                                'class': 'solr.StrField'}]}),
+            '/solr/schema/dynamicfields': json.dumps({
+                'responseHeader': header,
+                'dynamicFields': [{'name': '*_dt', 'type': 'pdate'}]}),
+        }
+
+    def render(self, request):
+        body = FakeSolrResource.render(self, request)
+        return self.paths.get(request.path, body)
+
+
+class ClientResultSchemaTest(TestCase):
+
+    def setUp(self):
+        self.server = FakeSolrServer(SchemaResource())
+        self.server.resource.defaultResponse = (200, SELECT_RESPONSE)
+        self.url = self.server.start()
+        self.schema = ResultSchema({'created': DATE, '*_dt': DATE})
+        self.client = SolrClient(self.url, codec='json',
+                                 resultSchema=self.schema.project(
+                                     ['id', 'created']))
+
+    @inlineCallbacks
+    def tearDown(self):
+        yield self.client.close()
+        yield self.server.stop()
+
+    @inlineCallbacks
+    def testSearch(self):
+        """Searches request the projection and convert the documents."""
+        response = yield self.client.search(u'*:*')
+        self.assertEqual(self.server.requests[0].args['fl'], ['id,created'])
+        self.assertEqual(response.results.docs[0]['created'],
+                         datetime(2010, 1, 1, 12, 30))
+
+    @inlineCallbacks
+    def testFieldListOverride(self):
+        """
+        The fields of a search with another C{fl} than the projection are
+        converted.
+        """
+        response = yield self.client.search(u'*:*', fl='id,tags_dt')
+        self.assertEqual(self.server.requests[0].args['fl'], ['id,tags_dt'])
+        self.assertEqual(response.results.docs[0]['tags_dt'],
+                         [datetime(2011, 2, 3, 4, 5, 6, 789000)])
+
+    @inlineCallbacks
+    def testExplicitFieldList(self):
+        """A given C{fl} is kept."""
+        yield self.client.search(u'*:*', fl='id')
+        prepared = self.client.prepare(fl='id,score')
+        yield self.client.searchPrepared(prepared, u'*:*')
+        self.assertEqual([r.args['fl'] for r in self.server.requests],
+                         [['id'], ['id,score']])
+
+    @inlineCallbacks
+    def testWithResultSchema(self):
+        """L{SolrClient.withResultSchema} changes the schema of a copy."""
+        client = self.client.withResultSchema(self.schema)
+        response = yield client.search(u'*:*')
+        self.assertNotIn('fl', self.server.requests[0].args)
+        self.assertEqual(response.results.docs[0]['tags_dt'],
+                         [datetime(2011, 2, 3, 4, 5, 6, 789000)])
+        response = yield client.withResultSchema(None).search(u'*:*')
+        self.assertEqual(response.results.docs[0]['created'],
+                         '2010-01-01T12:30:00Z')
+
+    @inlineCallbacks
+    def testSearchStream(self):
+        """The documents of streamed searches are converted."""
+        docs = []
+        yield self.client.searchStream(u'*:*', docs.append)
+        self.assertEqual([doc['created'] for doc in docs],
+                         [datetime(2010, 1, 1, 12, 30),
+                          datetime(2010, 1, 2)])
+
+    @inlineCallbacks
+    def testLoadResultSchema(self):
+        """
+        L{SolrClient.loadResultSchema} gets the types from the schema API.
+        """
+        schema = yield self.client.loadResultSchema(['id', 'created'])
+        self.assertEqual(schema.fields, ('id', 'created'))
+        doc = schema.project(None).decodeDocument(
+            {'id': '1', 'created': '2010-01-01T00:00:00Z',
+             'a_dt': '2010-01-02T00:00:00Z'})
+        self.assertEqual(doc, {'id': '1', 'created': datetime(2010, 1, 1),
+                               'a_dt': datetime(2010, 1, 2)})
+        paths = sorted(r.path for r in self.server.requests)
+        self.assertEqual(paths, ['/solr/schema/dynamicfields',
+                                 '/solr/schema/fields',
+                                 '/solr/schema/fieldtypes'])
+
+    def testLoadResultSchemaError(self):
+        """Errors loading the schema are given as they are."""
+        self.server.resource.paths = {}
+        self.server.resource.defaultResponse = (404, '')
+        d = self.client.loadResultSchema()
+        return self.assertFailure(d, HTTPWrongStatus)